@@ -4,7 +4,7 @@ from .callbacks import register_callbacks
 import logging
 
 from ..common_utils.utils import protect_dash_app
-from ..utils import load_config
+from ..app_config import load_config
 
 from flask import send_from_directory, session, abort
 from pathlib import Path
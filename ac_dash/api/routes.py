@@ -1,6 +1,5 @@
 import os
 import pandas as pd
-import csv
 import logging
 from flask import (
     redirect,
@@ -13,44 +12,73 @@ from flask import (
     stream_with_context,
 )
 from flask_restful import Resource
-from flask_login import login_required, login_user
+from flask_login import current_user, login_required, login_user
 from ..server import User, login_manager, server
 from werkzeug.security import check_password_hash
 from ..data_mgt import (
     cycle_table_to_df,
     flux_table_to_df,
-    df_to_cycle_table,
-    df_to_gas_table,
-    df_to_meteo_table,
     get_distinct_instrument,
     get_distinct_meteo_source,
+    check_existing_instrument,
+    add_instrument,
 )
 
-from ..utils import (
-    process_protocol_file,
-    process_protocol_zip,
-    process_measurement_file,
+from ..app_config import load_config
+from ..flux_init import init_from_cycle_table
+from ..ingest import (
+    check_ingested,
+    ingested_message,
+    ingest_file,
+    record_ingest,
+    ingest_measurement_file,
     process_measurement_zip,
-    load_config,
-    init_from_cycle_table,
+    report_to_json,
 )
 
-from ..measuring import instruments
+from ..measuring import instruments, detect_instrument
+from ..ingest_metrics import IngestMetrics, metrics_summary, record_metrics
+from ..tools.profiling import profiling_summary
+from ..tools.query_profiler import query_summary
+from ..uploads import (
+    UPLOAD_CHUNK_SIZE,
+    UploadError,
+    append_chunk,
+    create_upload,
+    queue_upload,
+    read_meta,
+    remove_upload,
+    upload_offset,
+)
+from ..inbox import INBOX_DIR
+from ..export import stream_fluxes, export_formats
 from ..db import engine
 
 logger = logging.getLogger("defaultLogger")
 
-(_, chamber_map, _, _) = load_config()
-
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
 
+def chamber_map():
+    return load_config()[1]
+
+
 def register_api(api):
     api.add_resource(FluxApi, "/api/fluxes", "/api/fluxes/")
     api.add_resource(CycleApi, "/api/cycle_api", "/api/cycle_api/")
     api.add_resource(GasApi, "/api/gas_api", "/api/gas_api/")
     api.add_resource(MeteoApi, "/api/meteo_api", "/api/meteo_api/")
     api.add_resource(InitFluxApi, "/api/init_api", "/api/init_api/")
+    api.add_resource(
+        IngestMetricsApi, "/api/ingest_metrics", "/api/ingest_metrics/"
+    )
+    api.add_resource(ProfilingApi, "/api/profiling", "/api/profiling/")
+    api.add_resource(
+        UploadApi,
+        "/api/uploads",
+        "/api/uploads/",
+        "/api/uploads/<string:upload_id>",
+    )
 
 
 @auth_bp.route("/login/", methods=["POST"])
@@ -75,21 +103,131 @@ def login_route():
     return redirect("/login/")
 
 
+def parse_bool_arg(value):
+    if value is None:
+        return None
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise ValueError(f"Can't parse {value} as boolean.")
+
+
+def parse_list_arg(args, key):
+    values = []
+    for value in args.getlist(key):
+        values.extend(item for item in value.split(",") if item)
+    return values or None
+
+
 class FluxApi(Resource):
     @login_required
     def get(self):
-        csv = flux_table_to_df().to_csv(index=False)
-        response = Response(
-            csv,
-            mimetype="text/csv",
-            headers={"Content-disposition": "attachment; filename=data.csv"},
+        """
+        Stream the flux table as csv or parquet.
+
+        Query parameters: start, end, chamber, serial, is_valid, cols, format.
+        chamber and cols can be given multiple times or comma separated.
+        """
+        args = request.args
+        fmt = args.get("format", "csv").lower()
+        try:
+            start = args.get("start", None)
+            end = args.get("end", None)
+            if start is not None:
+                start = pd.to_datetime(start, format="ISO8601", utc=True)
+            if end is not None:
+                end = pd.to_datetime(end, format="ISO8601", utc=True)
+            is_valid = parse_bool_arg(args.get("is_valid", None))
+            chunks = stream_fluxes(
+                fmt,
+                cols=parse_list_arg(args, "cols"),
+                start=start,
+                end=end,
+                chamber_ids=parse_list_arg(args, "chamber"),
+                serial=args.get("serial", None),
+                is_valid=is_valid,
+            )
+        except ValueError as e:
+            return {"message": f"{e}"}, 400
+
+        mimetype, ext = export_formats[fmt]
+        date = pd.Timestamp.today().strftime("%Y_%m_%d")
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={
+                "Content-disposition": f"attachment; filename={date}_calculated_fluxes.{ext}"
+            },
         )
-        return response
 
     def post(self):
         pass
 
 
+def skip_ingested(file):
+    """
+    Check the ingest registry for an identical file.
+
+    Returns
+    -------
+    tuple
+        file hash, size and a response if the file should be skipped, pass
+        force=true in the form to ingest it anyway
+    """
+    file_hash, size, known = check_ingested(file)
+    if known is not None and not parse_bool_arg(request.form.get("force", None)):
+        response = {"message": ingested_message(known), "skipped": True}
+        return file_hash, size, (response, 200)
+    return file_hash, size, None
+
+
+def ingest_upload(kind, what, **kwargs):
+    """
+    Ingest the file field of the request with ingest_file.
+
+    Parameters
+    ----------
+    kind : str
+        cycle, meteo or volume
+    what : str
+        What the rows are called in the response message
+    **kwargs
+        Passed on to ingest_file
+    """
+    if "file" not in request.files:
+        return {"message": "No file provided"}, 400
+    file = request.files["file"]
+    if file.filename == "":
+        return {"message": "No selected file"}, 400
+
+    try:
+        force = bool(parse_bool_arg(request.form.get("force", None)))
+        report, known = ingest_file(file, kind, file.filename, force=force, **kwargs)
+    except Exception as e:
+        return {"message": f"Unable to parse {file.filename}, error {e}"}, 500
+    if known is not None:
+        return {"message": ingested_message(known), "skipped": True}, 200
+
+    covered = report["covered"]
+    row_count, in_rows = report["pushed_rows"], report["in_rows"]
+    response = {
+        "message": f"Pushed {row_count}/{in_rows} {what} to db."
+        + covered_message(covered),
+        "report": report_to_json(report),
+        "covered": covered,
+    }
+    if "members" in report:
+        response["members"] = response["report"]["members"]
+    return response, 200
+
+
+def covered_message(covered):
+    if covered:
+        return " Time span of the file was already covered by earlier uploads."
+    return ""
+
+
 def convert_datetime_to_str(df):
     """
     Convert all columns with dtype datetime in a pandas DataFrame to string type.
@@ -112,103 +250,91 @@ class GasApi(Resource):
     @login_required
     def post(self):
         """
-        Upload a CSV file and process it.
+        Upload instrument output files or zips of them.
+
+        Several files can be sent in the file field. instrument_model and
+        instrument_serial apply to all of them, when they are missing the
+        instrument is detected from the header of each file.
         """
-        # Check if a file is provided
-        if "file" not in request.files:
+        files = request.files.getlist("file")
+        if not files:
             return {"message": "No file provided"}, 400
 
-        file = request.files["file"]
-        # check for zero lengt files
-        file_length = file.seek(0, os.SEEK_END)
-        file.seek(0, os.SEEK_SET)
-
+        model = request.form.get("instrument_model", None)
+        serial = request.form.get("instrument_serial", None)
+        results = [self.ingest_upload(file, model, serial) for file in files]
+        if len(results) == 1:
+            return results[0]
+        ok = sum(status == 200 for _, status in results)
+        return {
+            "message": f"Ingested {ok}/{len(results)} files.",
+            "files": [
+                {**response, "file": file.filename, "status": status}
+                for file, (response, status) in zip(files, results)
+            ],
+        }, 200
+
+    def ingest_upload(self, file, model, serial):
         if file.filename == "":
             return {"message": "No selected file"}, 400
 
+        # check for zero lengt files
+        file_length = file.seek(0, os.SEEK_END)
+        file.seek(0, os.SEEK_SET)
         if file_length < 10:
             return {"message": f"No data in file {file.filename}"}, 400
 
-        instrument = request.form.get("instrument_model", None)
-        serial = request.form.get("instrument_serial", None)
-
-        # try and read the first two rows of the file for model and serial
-        if not instrument or not serial:
-            file.stream.seek(0)
-            reader = csv.reader(file.stream.read().decode("utf-8").splitlines())
-            rows = {}
-            for i, row in enumerate(reader):
-                row_data = row[0].split("\t")
-                rows[row_data[0]] = row_data[1]
-                if i == 1:
-                    break
-            instrument_class = rows.get("Model:").replace("-", "")
-            serial = rows.get("SN:")
-            file.stream.seek(0)
-
-        # BUG: this doesnt fail gracefully
-        if instrument is None:
-            return {"message": "Provide instrument_model"}, 400
-        if serial is None:
-            return {"message": "Provide instrument_serial"}, 400
-
-        instrument_class = instrument.replace("-", "")
-        file_reader = instruments.get(instrument_class, None)
-
-        if not file_reader:
-            return {"message": "Provide proper instrument details"}, 400
-
-        file_reader = file_reader(serial)
+        file_hash, size, skipped = skip_ingested(file)
+        if skipped:
+            return skipped
+
+        is_zip = file.filename.lower().endswith(".zip")
+        instrument_class = None
+        if model:
+            instrument_class = instruments.get(model.replace("-", ""), None)
+            if instrument_class is None:
+                return {"message": "Provide proper instrument details"}, 400
+
+        if instrument_class is not None and serial:
+            file_reader = instrument_class(serial)
+        elif is_zip:
+            # each member is detected separately
+            file_reader = None
+        else:
+            # only reads the start of the file
+            try:
+                detected_class, detected_serial = detect_instrument(file)
+            except ValueError as e:
+                return {"message": f"{file.filename}: {e}"}, 400
+            instrument_class = instrument_class or detected_class
+            serial = serial or detected_serial
+            if not serial:
+                return {"message": "Provide instrument_serial"}, 400
+            file_reader = instrument_class(serial)
 
         try:
-            row_count, in_rows = 0, 0
+            report = None
+            metrics = IngestMetrics()
             file_exts = ("csv", "DATA", "DAT", "data")
             if file.filename.split(".")[-1] in file_exts:
-                df = process_measurement_file(file, file_reader)
-                df = self._process_dataframe(df, file_reader)
-
-                in_rows = len(df)
-
-                pushed_data, dupes = df_to_gas_table(df)
-                logger.debug(pushed_data)
-                row_count = len(pushed_data) if not pushed_data.empty else 0
+                report = ingest_measurement_file(file, file_reader, metrics=metrics)
 
-            if "zip" in file.filename:
+            if is_zip:
                 logger.debug("Process zip")
-                df = process_measurement_zip(file, file_reader)
-                in_rows = len(df)
-                df["instrument_serial"] = file_reader.serial
-                df["instrument_model"] = file_reader.model
-                in_rows = len(df)
-                df["datetime"] = (
-                    df["datetime"]
-                    .dt.tz_localize("Europe/Helsinki", ambiguous=True)
-                    .dt.tz_convert("UTC")
-                )
-
-                pushed_data, dupes = df_to_gas_table(df)
-                if pushed_data.empty:
-                    row_count = 0
-                else:
-                    row_count = len(pushed_data)
+                report = process_measurement_zip(file, file_reader, metrics=metrics)
+            if report is None:
+                return {"message": "Unsupported file type"}, 400
+            covered = record_ingest(file_hash, size, "gas", report, serial=serial)
+            row_count, in_rows = report["pushed_rows"], report["in_rows"]
             return {
-                "message": f"Pushed {row_count}/{in_rows} gas measurements to db.",
+                "message": f"Pushed {row_count}/{in_rows} gas measurements to db."
+                + covered_message(covered),
+                "report": report_to_json(report),
+                "covered": covered,
+                "metrics": record_metrics(file.filename, metrics),
             }, 200
         except Exception as e:
-            return {"message": f"Unable to parse {file}, exception: {e}"}, 500
-
-    def _process_dataframe(self, df, file_reader):
-        """
-        Process the DataFrame by adding instrument details and converting timestamps.
-        """
-        df["instrument_serial"] = file_reader.serial
-        df["instrument_model"] = file_reader.model
-        df["datetime"] = (
-            df["datetime"]
-            .dt.tz_localize("Europe/Helsinki", ambiguous=True)
-            .dt.tz_convert("UTC")
-        )
-        return df
+            return {"message": f"Unable to parse {file.filename}, exception: {e}"}, 500
 
 
 class CycleApi(Resource):
@@ -218,63 +344,9 @@ class CycleApi(Resource):
     @login_required
     def post(self):
         """
-        Upload a CSV file and process it.
+        Upload a cycle csv, a protocol log or a zip of protocol logs.
         """
-        # Check if a file is provided
-        if "file" not in request.files:
-            return {"message": "No file provided"}, 400
-
-        file = request.files["file"]
-
-        # Check if the file has a valid filename
-        if file.filename == "":
-            return {"message": "No selected file"}, 400
-
-        try:
-            if "csv" in file.filename:
-                df = pd.read_csv(file)
-                df["start_time"] = pd.to_datetime(
-                    df["start_time"], format="ISO8601"
-                )
-                df["start_time"] = (
-                    df["start_time"]
-                    .dt.tz_localize("Europe/Helsinki", ambiguous=True)
-                    .dt.tz_convert("UTC")
-                )
-                print(df)
-                in_cycles = len(df)
-                pushed_data = df_to_cycle_table(df)
-
-                if pushed_data.empty:
-                    row_count = 0
-                else:
-                    row_count = len(pushed_data)
-
-            # Read the CSV into a Pandas DataFrame
-            if "log" in file.filename:
-                df = process_protocol_file(file, chamber_map)
-                in_cycles = len(df)
-
-                pushed_data = df_to_cycle_table(df)
-                if pushed_data.empty:
-                    row_count = 0
-                else:
-                    row_count = len(pushed_data)
-
-            if "zip" in file.filename:
-                df = process_protocol_zip(file, chamber_map)
-                in_cycles = len(df)
-                pushed_data = df_to_cycle_table(df)
-                if pushed_data.empty:
-                    row_count = 0
-                else:
-                    row_count = len(pushed_data)
-            return {
-                "message": f"Pushed {row_count}/{in_cycles} cycles to db.",
-            }, 200
-        except Exception as e:
-            return {"message": f"Unable to parse {file}, error {e}"}, 500
-        pass
+        return ingest_upload("cycle", "cycles", chamber_map=chamber_map())
 
 
 class InitFluxApi(Resource):
@@ -372,47 +444,148 @@ class MeteoApi(Resource):
 
     @login_required
     def post(self):
-        # Check if a file is provided
-        if "file" not in request.files:
-            return {"message": "No file provided"}, 400
+        """
+        Upload a meteo csv, the source form field names where it came from.
+        """
+        return ingest_upload(
+            "meteo", "meteo measurements", source=request.form.get("source", None)
+        )
 
-        file = request.files["file"]
 
-        # Check if the file has a valid filename
-        if file.filename == "":
-            return {"message": "No selected file"}, 400
+class IngestMetricsApi(Resource):
+    @login_required
+    def get(self):
+        """Stage timings and counters of the latest ingests in this worker."""
+        return metrics_summary(), 200
 
-        data = request.get_json()
-        source = data.get("source", None)
 
-        def read_meteo_file(file):
-            df = pd.read_csv(file)
-            df["datetime"] = pd.to_datetime(df["datetime"], format="ISO8601")
-            df["datetime"] = (
-                df["datetime"]
-                .dt.tz_localize("Europe/Helsinki", ambiguous=True)
-                .dt.tz_convert("UTC")
-            )
-            df["source"] = source
-            return df
+class ProfilingApi(Resource):
+    @login_required
+    def get(self):
+        """
+        Callback timings and slow callbacks of all workers and the query
+        fingerprints of this worker, admins only.
+        """
+        if current_user.role != "admin":
+            return {"message": "Only admins can view profiling."}, 403
+        return {**profiling_summary(), "queries": query_summary()}, 200
+
+
+class UploadApi(Resource):
+    """
+    Chunked, resumable file uploads.
+
+    POST /api/uploads with json filename, size, kind and the ingest details
+    (python_class, serial, model and name for gas, source for meteo) starts
+    an upload. The file is then sent in parts with
+    PATCH /api/uploads/<upload_id> and an Upload-Offset header, GET returns
+    the received offset to resume from. POST /api/uploads/<upload_id> moves
+    the finished file to the inbox and returns 202, GET then returns its
+    state, queued, done with the report or failed with the error.
+    """
 
+    @login_required
+    def get(self, upload_id=None):
         try:
-            if "csv" in file.filename:
-                df = read_meteo_file(file)
-                in_cycles = len(df)
-                pushed_data = df_to_meteo_table(df)
+            meta = read_meta(upload_id)
+            if "state" in meta:
+                return upload_status(upload_id, meta), 200
+            offset = upload_offset(upload_id)
+        except UploadError as e:
+            return {"message": f"{e}"}, e.status
+        return {
+            "upload_id": upload_id,
+            "offset": offset,
+            "size": meta["size"],
+        }, 200, {"Upload-Offset": str(offset)}
 
-                if pushed_data.empty:
-                    row_count = 0
-                else:
-                    row_count = len(pushed_data)
+    @login_required
+    def patch(self, upload_id=None):
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+        except ValueError:
+            return {"message": "Provide Upload-Offset header"}, 400
+        try:
+            offset = append_chunk(upload_id, offset, request.stream)
+        except UploadError as e:
+            return {"message": f"{e}"}, e.status
+        return {"offset": offset}, 200, {"Upload-Offset": str(offset)}
 
+    @login_required
+    def post(self, upload_id=None):
+        if upload_id is None:
+            try:
+                meta = request.get_json() or {}
+                if meta.get("kind") == "gas":
+                    gas_upload_instrument(meta)
+                upload_id = create_upload(meta)
+            except UploadError as e:
+                return {"message": f"{e}"}, e.status
             return {
-                "message": f"Pushed {row_count}/{in_cycles} cycles to db.",
-            }, 200
-        except Exception as e:
-            return {"message": f"Unable to parse {file}, error {e}"}, 500
-        pass
+                "upload_id": upload_id,
+                "offset": 0,
+                "chunk_size": UPLOAD_CHUNK_SIZE,
+            }, 201
+        return self.complete(upload_id)
+
+    @login_required
+    def delete(self, upload_id=None):
+        try:
+            remove_upload(upload_id)
+        except UploadError as e:
+            return {"message": f"{e}"}, e.status
+        return {"message": f"Removed upload {upload_id}"}, 200
+
+    def complete(self, upload_id):
+        """
+        Hand the finished upload to the inbox watcher, ingesting big files
+        here would run into the worker timeout.
+        """
+        try:
+            meta = read_meta(upload_id)
+            if "state" not in meta:
+                if meta["kind"] == "gas":
+                    instrument = gas_upload_instrument(meta)
+                    if not check_existing_instrument(
+                        instrument.serial, instrument.model, meta["python_class"]
+                    ):
+                        add_instrument(
+                            instrument.model,
+                            instrument.serial,
+                            meta["python_class"],
+                            meta.get("name"),
+                        )
+                meta = queue_upload(upload_id, INBOX_DIR)
+        except UploadError as e:
+            return {"message": f"{e}"}, e.status
+        return upload_status(upload_id, meta), 202, {
+            "Location": f"/api/uploads/{upload_id}"
+        }
+
+
+def upload_status(upload_id, meta):
+    """State of an upload that was handed to the inbox."""
+    status = {
+        "upload_id": upload_id,
+        "state": meta["state"],
+        "message": meta.get("message") or meta.get("error"),
+    }
+    if meta["state"] == "queued":
+        status["message"] = f"{meta['filename']} is waiting to be ingested."
+    for key in ("report", "skipped", "error"):
+        if key in meta:
+            status[key] = meta[key]
+    return status
+
+
+def gas_upload_instrument(meta):
+    """Instrument of a gas upload from its python_class and serial."""
+    instrument_class = instruments.get(meta.get("python_class"))
+    if instrument_class is None:
+        raise UploadError("Provide proper instrument details")
+    if not meta.get("serial"):
+        raise UploadError("Provide instrument_serial")
+    return instrument_class(meta["serial"])
 
 
 @login_manager.unauthorized_handler
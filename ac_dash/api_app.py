@@ -0,0 +1,39 @@
+import logging
+
+from .server import server, api, User, login_manager
+
+logger = logging.getLogger("defaultLogger")
+
+# The REST API and auth without the dash app. Nothing here imports dash or
+# plotly, so API and ingest workers can run separately from the dashboard
+# workers with a fraction of their memory and start up time.
+
+_state = {"registered": False}
+
+
+def init_api():
+    """Register the API resources, /auth and the user loader once."""
+    if _state["registered"]:
+        return server
+    from .api.routes import register_api, auth_bp
+
+    register_api(api)
+    server.register_blueprint(auth_bp)
+
+    @login_manager.user_loader
+    def user_loader(user_id):
+        return User.query.get(user_id)
+
+    _state["registered"] = True
+    return server
+
+
+def create_api_app():
+    """
+    Flask app serving only the REST API and /auth, e.g.
+    gunicorn -c gunicorn.conf.py api_wsgi:server
+    """
+    from .tools.logger import init_logger
+
+    init_logger()
+    return init_api()
@@ -0,0 +1,23 @@
+import os
+import json
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def load_config():
+    """
+    Load configuration for InfluxDB. Read once per process, the returned
+    objects are shared so don't modify them.
+    """
+    filepath = os.path.abspath(os.path.dirname(__file__))
+    with open(f"{filepath}/config/config.json", "r") as f:
+        defaults = json.load(f)
+    with open(f"{filepath}/config/custom.json", "r") as f:
+        custom = json.load(f)
+    config = {**defaults, **custom}
+    return (
+        config["chambers"],
+        config["chamber_map"],
+        config["layout"],
+        config["measurements"],
+    )
@@ -0,0 +1,160 @@
+// Chunked, resumable uploads to /api/uploads for files that are too large
+// for dcc.Upload. Buttons with the class chunked-upload open a file dialog,
+// data-kind tells what is uploaded and data-status the id of the element
+// that shows the progress. An interrupted upload continues from the last
+// received byte when the same file is selected again.
+(function () {
+  const API = "/api/uploads/";
+  const DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024;
+  const RETRIES = 5;
+  const POLL_INTERVAL = 2000;
+
+  function inputValue(id) {
+    const el = document.getElementById(id);
+    return el && el.value ? el.value : null;
+  }
+
+  function storageKey(file, kind) {
+    return `ac-dash-upload:${kind}:${file.name}:${file.size}:${file.lastModified}`;
+  }
+
+  function sleep(ms) {
+    return new Promise((resolve) => setTimeout(resolve, ms));
+  }
+
+  async function call(method, url, body, headers) {
+    const resp = await fetch(url, {
+      method: method,
+      body: body,
+      headers: headers || {},
+      credentials: "same-origin",
+    });
+    let data = {};
+    try {
+      data = await resp.json();
+    } catch (e) {
+      data = {};
+    }
+    if (!resp.ok) {
+      const err = new Error(data.message || `${resp.status} ${resp.statusText}`);
+      err.status = resp.status;
+      throw err;
+    }
+    return data;
+  }
+
+  function uploadMeta(file, kind) {
+    const meta = { filename: file.name, size: file.size, kind: kind };
+    if (kind === "gas") {
+      meta.python_class = inputValue("class-input");
+      meta.serial = inputValue("serial-input");
+      meta.model = inputValue("model-input");
+      meta.name = inputValue("name-input");
+    }
+    return meta;
+  }
+
+  async function resume(key, file) {
+    const uploadId = localStorage.getItem(key);
+    if (!uploadId) {
+      return null;
+    }
+    try {
+      const state = await call("GET", API + uploadId);
+      // a finished upload that is already being ingested
+      const offset = state.state ? file.size : state.offset;
+      return { uploadId: uploadId, offset: offset };
+    } catch (e) {
+      localStorage.removeItem(key);
+      return null;
+    }
+  }
+
+  async function sendChunk(url, file, offset, chunkSize) {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const chunk = file.slice(offset, offset + chunkSize);
+        const resp = await call("PATCH", url, chunk, {
+          "Content-Type": "application/offset+octet-stream",
+          "Upload-Offset": String(offset),
+        });
+        return resp.offset;
+      } catch (e) {
+        if (attempt >= RETRIES || (e.status && e.status < 500 && e.status !== 409)) {
+          throw e;
+        }
+        await sleep(1000 * 2 ** attempt);
+        // the server may have received part of the chunk
+        offset = (await call("GET", url)).offset;
+      }
+    }
+  }
+
+  async function upload(file, kind, show) {
+    const key = storageKey(file, kind);
+    let state = await resume(key, file);
+    let chunkSize = DEFAULT_CHUNK_SIZE;
+    if (state === null) {
+      const created = await call("POST", API, JSON.stringify(uploadMeta(file, kind)), {
+        "Content-Type": "application/json",
+      });
+      state = { uploadId: created.upload_id, offset: created.offset };
+      chunkSize = created.chunk_size || DEFAULT_CHUNK_SIZE;
+      localStorage.setItem(key, state.uploadId);
+    } else {
+      show(`Resuming ${file.name} from ${Math.round((100 * state.offset) / file.size)}%`);
+    }
+    const url = API + state.uploadId;
+    let offset = state.offset;
+    while (offset < file.size) {
+      offset = await sendChunk(url, file, offset, chunkSize);
+      show(`Uploading ${file.name}: ${Math.round((100 * offset) / file.size)}%`);
+    }
+    // the server ingests the file in the background, poll until it is done
+    let result = await call("POST", url);
+    while (result.state === "queued") {
+      show(`Processing ${file.name}...`);
+      await sleep(POLL_INTERVAL);
+      result = await call("GET", url);
+    }
+    localStorage.removeItem(key);
+    if (result.state === "failed") {
+      throw new Error(result.error);
+    }
+    return result.message;
+  }
+
+  function statusWriter(button) {
+    const el = document.getElementById(button.dataset.status);
+    return function (text) {
+      if (el) {
+        el.textContent = text;
+      }
+    };
+  }
+
+  document.addEventListener("click", function (event) {
+    const button = event.target.closest(".chunked-upload");
+    if (!button || button.disabled) {
+      return;
+    }
+    const input = document.createElement("input");
+    input.type = "file";
+    input.addEventListener("change", async function () {
+      const file = input.files[0];
+      if (!file) {
+        return;
+      }
+      const show = statusWriter(button);
+      button.disabled = true;
+      try {
+        show(await upload(file, button.dataset.kind, show));
+      } catch (e) {
+        show(`Upload of ${file.name} failed: ${e.message}, select the file again to resume.`);
+      } finally {
+        button.disabled = false;
+      }
+    });
+    input.click();
+  });
+})();
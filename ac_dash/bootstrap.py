@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import time
+import logging
+import subprocess
+
+from .db import engine
+from .users_mgt.users_mgt import db as users_db
+from .data_mgt import db as data_db, apply_volume_table_trigger, init_instruments
+
+logger = logging.getLogger("defaultLogger")
+
+# Database setup that used to run on every import of ac_dash.server, now run
+# once per deployment with manage.py bootstrap, entrypoint.sh runs it before
+# the server starts.
+
+
+def bootstrap():
+    """
+    Create missing tables, the volume_table trigger and the built in
+    instruments. Safe to run again, existing objects are kept.
+    """
+    t0 = time.perf_counter()
+    # one catalog pass per metadata instead of one per table
+    users_db.metadata.create_all(engine)
+    data_db.metadata.create_all(engine)
+    if engine.dialect.name == "postgresql":
+        apply_volume_table_trigger()
+    init_instruments()
+    seconds = time.perf_counter() - t0
+    logger.info(f"Bootstrapped the database in {seconds:.2f} s.")
+    return seconds
+
+
+# run in a fresh interpreter so nothing is imported yet
+startup_probe = """
+import sys, json, time, importlib
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+queries = []
+event.listen(Engine, "before_cursor_execute", lambda *args: queries.append(1))
+t0 = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - t0
+dash = any(name in sys.modules for name in ("dash", "plotly"))
+print(json.dumps({"seconds": seconds, "queries": len(queries), "dash": dash}))
+"""
+
+
+def startup_cost(module):
+    """
+    Seconds, database queries and whether dash or plotly got imported in a
+    cold import of module.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run(
+        [sys.executable, "-c", startup_probe, module],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=root,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    # python -m ac_dash.bootstrap, doesn't import the app, whose layout
+    # reads the tables this creates
+    from .tools.logger import init_logger
+
+    init_logger()
+    print(f"Database ready in {bootstrap():.2f} s.")
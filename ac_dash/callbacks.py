@@ -1,21 +1,19 @@
 import logging
 import json
 import re
-import io
 import pandas as pd
 from flask import session
 from flask_login import current_user
-from datetime import datetime as dt
 from dash import (
     dcc,
     Output,
-    dash_table,
     Input,
     State,
     ctx,
     no_update,
     html,
     ALL,
+    MATCH,
 )
 
 from .users_mgt.users_mgt import change_user_password
@@ -29,19 +27,33 @@ from .utils import (
     parse_date_range,
 )
 from .data_mgt import (
-    cycle_table_to_df,
-    flux_table_to_df,
-    volume_table_to_df,
-    meteo_table_to_df,
+    table_page_to_df,
+    gas_page_to_df,
+    Volume_tbl,
+    Meteo_tbl,
 )
 from .create_graph import apply_graph_zoom
+from .tools.profiling import (
+    profile_body,
+    profile_stage,
+    profiling_summary,
+    reset_profiling,
+    set_enabled,
+)
+from .tools.query_profiler import query_summary, reset_queries, set_query_profiling
+from .profiling_page import mk_profiling_page, profiling_rows, query_rows
 from .layout import (
     mk_settings,
     mk_settings_page,
     mk_main_page,
     graph_style,
 )
-from .db_view_page import mk_db_view_page
+from .db_view_page import (
+    mk_db_view_page,
+    mk_db_table,
+    mk_gas_view,
+    filter_query_to_clauses,
+)
 from .data_mgt import Cycle_tbl, Flux_tbl
 from .data_init import (
     read_gas_init_input,
@@ -54,6 +66,16 @@ from .data_init import (
 from .views.change_pw import mk_change_pw
 
 cycle_tbl_cols = [col.name for col in Cycle_tbl.columns]
+volume_tbl_cols = [col.name for col in Volume_tbl.columns]
+meteo_tbl_cols = [col.name for col in Meteo_tbl.columns]
+db_view_tables = {
+    "flux": Flux_tbl,
+    "cycle": Cycle_tbl,
+    "volume": Volume_tbl,
+    "meteo": Meteo_tbl,
+}
+# gas data is 1Hz, don't allow querying more than this at once
+max_gas_view_range = pd.Timedelta(days=31)
 
 logger = logging.getLogger("defaultLogger")
 
@@ -88,8 +110,6 @@ def mk_binds(settings):
 def register_callbacks(
     app,
     url,
-    main_page,
-    settings_page,
     chambers,
     chamber_map,
     graph_names,
@@ -162,24 +182,6 @@ def register_callbacks(
 
         return ""
 
-    @app.callback(
-        Output("dl-all", "data"),
-        Input("dl-all-button", "n_clicks"),
-        prevent_initial_call=True,
-    )
-    def download_fluxes(n_clicks):
-        if n_clicks is not None:
-            date = dt.today().strftime("%Y_%m_%d")
-            data = flux_table_to_df()
-            csv = data.to_csv(index=False)
-            csv_buffer = io.StringIO(csv)
-            return dcc.send_bytes(
-                csv_buffer.getvalue().encode(),
-                filename=f"{date}_calculated_fluxes.csv",
-            )
-        else:
-            return no_update
-
     @app.callback(
         Output("model-input-div", "style"),
         Output("model-input", "value"),
@@ -439,6 +441,15 @@ def register_callbacks(
             return store, display
         return no_update, no_update
 
+    @app.callback(
+        Output("profiling-link", "style"),
+        Input("url", "pathname"),
+    )
+    def show_profiling_link(pathname):
+        if current_user.is_authenticated and current_user.role == "admin":
+            return {"padding-right": "15px"}
+        return {"display": "none"}
+
     # Callback to update the page content
     @app.callback(
         Output("page-content", "children"),
@@ -462,6 +473,10 @@ def register_callbacks(
             logger.info("Making change pw view")
             page = mk_change_pw(username=current_user.username).layout
             return page
+        if pathname == f"{url}profiling":
+            if current_user.role != "admin":
+                return html.P("Only admins can view callback profiling.")
+            return mk_profiling_page()
         else:
             page, _, _ = mk_main_page(
                 settings_store["gas_graphs"],
@@ -470,6 +485,30 @@ def register_callbacks(
             )
             return page
 
+    @app.callback(
+        Output("profiling-callbacks", "data"),
+        Output("profiling-slow", "data"),
+        Output("profiling-queries", "data"),
+        Output("profiling-violations", "data"),
+        Input("profiling-toggle", "value"),
+        Input("profiling-refresh", "n_clicks"),
+        Input("profiling-reset", "n_clicks"),
+        prevent_initial_call=True,
+    )
+    def update_profiling(toggle, refresh, reset):
+        if current_user.role != "admin":
+            return no_update, no_update, no_update, no_update
+        if ctx.triggered_id == "profiling-toggle":
+            set_enabled("callbacks" in toggle)
+            set_query_profiling("queries" in toggle)
+        if ctx.triggered_id == "profiling-reset":
+            reset_profiling()
+            reset_queries()
+        return (
+            *profiling_rows(profiling_summary()),
+            *query_rows(query_summary()),
+        )
+
     # NOTE: add a file to record changes in the setup, so that chamber
     # selection buttons can be generated for currently available chambers
     # instead of always displaying all?
@@ -512,30 +551,22 @@ def register_callbacks(
         prevent_initial_call=True,
     )
     def populate_db_views(tab, col_store, current_cols):
+        """
+        Create the table for the selected tab, the rows are loaded one page
+        at a time by page_db_table.
+        """
         table_cols = [
             {"label": col.name, "value": col.name} for col in Flux_tbl.columns
         ]
         logger.info(tab)
         if tab == "flux-db-tab":
-            df = flux_table_to_df(col_store)
             col_select = dcc.Dropdown(
                 id="column-selector",
                 options=table_cols,
                 value=list(col_store),  # Default: All columns selected
                 multi=True,
             )
-            datatable = dash_table.DataTable(
-                id="flux-db-table",
-                columns=[
-                    {"name": col, "id": col, "deletable": True} for col in col_store
-                ],
-                data=df.to_dict("records"),
-                sort_action="native",
-                editable=True,
-                page_size=50,
-                style_data={"font-size": "15px"},
-                style_header={"font-size": "15px"},
-            )
+            datatable = mk_db_table("flux", col_store, True, "15px", editable=True)
             button = html.Button("Use cols", id="submit-table-cols")
             return (
                 [button, col_select, datatable],
@@ -545,63 +576,76 @@ def register_callbacks(
                 no_update,
             )
         if tab == "cycle-db-tab":
-            df = cycle_table_to_df("2021-01-01", "2025-01-01")
-            datatable = dash_table.DataTable(
-                id="cycle-db-table",
-                columns=[{"name": col, "id": col} for col in df.columns],
-                data=df.to_dict("records"),
-                sort_action="native",
-                page_size=50,
-                style_table={"width": "80%", "margin": "auto"},
-                style_data={"font-size": "18px"},
-                style_header={"font-size": "18px"},
-            )
+            datatable = mk_db_table("cycle", cycle_tbl_cols)
             return no_update, [datatable], no_update, no_update, no_update
         if tab == "gas-db-tab":
-            # df = gas_table_to_df()
-            df = pd.DataFrame()
-            datatable = dash_table.DataTable(
-                id="gas-db-table",
-                columns=[{"name": col, "id": col} for col in df.columns],
-                data=df.to_dict("records"),
-                sort_action="native",
-                page_size=50,
-                style_table={"width": "80%", "margin": "auto"},
-                style_data={"font-size": "18px"},
-                style_header={"font-size": "18px"},
-            )
-            placeholder = html.Div(
-                "Need to add logic for querying limited range of data"
-            )
-            return no_update, no_update, [placeholder], no_update, no_update
+            return no_update, no_update, mk_gas_view(), no_update, no_update
         if tab == "volume-db-tab":
-            df = volume_table_to_df()
-            datatable = dash_table.DataTable(
-                id="volume-db-table",
-                columns=[{"name": col, "id": col} for col in df.columns],
-                data=df.to_dict("records"),
-                sort_action="native",
-                page_size=50,
-                style_table={"width": "80%", "margin": "auto"},
-                style_data={"font-size": "18px"},
-                style_header={"font-size": "18px"},
-            )
+            datatable = mk_db_table("volume", volume_tbl_cols)
             return no_update, no_update, no_update, [datatable], no_update
         if tab == "meteo-db-tab":
-            df = meteo_table_to_df()
-            datatable = dash_table.DataTable(
-                id="meteo-db-table",
-                columns=[{"name": col, "id": col} for col in df.columns],
-                data=df.to_dict("records"),
-                sort_action="native",
-                page_size=50,
-                style_table={"width": "80%", "margin": "auto"},
-                style_data={"font-size": "18px"},
-                style_header={"font-size": "18px"},
-            )
+            datatable = mk_db_table("meteo", meteo_tbl_cols)
             return no_update, no_update, no_update, no_update, [datatable]
         return no_update, no_update, no_update, no_update, no_update
 
+    @app.callback(
+        Output({"type": "db-table", "index": MATCH}, "data"),
+        Input({"type": "db-table", "index": MATCH}, "page_current"),
+        Input({"type": "db-table", "index": MATCH}, "page_size"),
+        Input({"type": "db-table", "index": MATCH}, "sort_by"),
+        Input({"type": "db-table", "index": MATCH}, "filter_query"),
+        Input({"type": "db-table", "index": MATCH}, "columns"),
+        State({"type": "db-table", "index": MATCH}, "id"),
+    )
+    def page_db_table(page_current, page_size, sort_by, filter_query, columns, id):
+        table = db_view_tables.get(id["index"])
+        if table is None:
+            return no_update
+        try:
+            filters = filter_query_to_clauses(table, filter_query)
+        except Exception as e:
+            logger.debug(f"Bad filter query {filter_query}: {e}")
+            return no_update
+        df = table_page_to_df(
+            table,
+            page_current or 0,
+            page_size,
+            sort_by,
+            filters,
+            cols=[col["id"] for col in columns],
+        )
+        return df.to_dict("records")
+
+    @app.callback(
+        Output("gas-db-table", "data"),
+        Output("gas-db-table", "page_current"),
+        Output("gas-view-warn", "children"),
+        Input("gas-view-apply", "n_clicks"),
+        Input("gas-db-table", "page_current"),
+        Input("gas-db-table", "sort_by"),
+        State("gas-db-table", "page_size"),
+        State("gas-view-start", "value"),
+        State("gas-view-end", "value"),
+        State("gas-view-serial", "value"),
+        State("gas-view-resolution", "value"),
+    )
+    def page_gas_table(_, page_current, sort_by, page_size, start, end, serial, res):
+        try:
+            start = pd.to_datetime(start, utc=True)
+            end = pd.to_datetime(end, utc=True)
+        except Exception:
+            return no_update, no_update, "Give dates as YYYY-MM-DD HH:MM"
+        if end - start > max_gas_view_range:
+            return no_update, no_update, f"Maximum range is {max_gas_view_range}"
+        # new query, start from the first page
+        if ctx.triggered_id == "gas-view-apply":
+            page_current = 0
+        desc_order = bool(sort_by) and sort_by[0].get("direction") == "desc"
+        df = gas_page_to_df(
+            start, end, serial, res, page_current or 0, page_size, desc_order
+        )
+        return df.to_dict("records"), page_current, ""
+
     @app.callback(
         Output("date-store", "data"),
         Output("range-pick", "initial_visible_month"),
@@ -668,6 +712,7 @@ def register_callbacks(
         Input("used-instrument-select", "value"),
         prevent_initial_call=True,
     )
+    @profile_body
     def update_graph(*args):
         stored_settings = args[4]
         logger.info(stored_settings)
@@ -690,26 +735,29 @@ def register_callbacks(
         #     return no_data_response(chambers, [gas_graphs, attr_graphs], points_store)
 
         logger.info("Running")
-        (
-            triggered_elem,
-            index,
-            measurements,
-            measurement,
-            selected_chambers,
-            date_range,
-        ) = handle_triggers(args, chambers, graph_names)
+        with profile_stage("handle_triggers"):
+            (
+                triggered_elem,
+                index,
+                measurements,
+                measurement,
+                selected_chambers,
+                date_range,
+            ) = handle_triggers(args, chambers, graph_names)
         logger.debug("Handled triggers")
         if measurements is None or measurements.empty:
             return no_data_response(chambers, [gas_graphs, attr_graphs])
 
-        execute_actions(
-            triggered_elem,
-            measurement,
-            measurements,
-            date_range,
-        )
+        with profile_stage("execute_actions"):
+            execute_actions(
+                triggered_elem,
+                measurement,
+                measurements,
+                date_range,
+            )
 
-        figs = create_gas_plots(measurement, gas_graphs, stored_settings)
+        with profile_stage("create_gas_plots"):
+            figs = create_gas_plots(measurement, gas_graphs, stored_settings)
 
         # graph_names is a list of the ids of the graphs, first part of the id
         # is the attribute that is being plotted
@@ -724,19 +772,20 @@ def register_callbacks(
             else [attr]
             for attr in attrs
         ]
-        attr_plots = [
-            create_attribute_graph(
-                measurement,
-                measurements,
-                selected_chambers,
-                index,
-                triggered_elem,
-                date_range,
-                gas_graphs,
-                *var,
-            )
-            for var in vars
-        ]
+        with profile_stage("create_attribute_graph"):
+            attr_plots = [
+                create_attribute_graph(
+                    measurement,
+                    measurements,
+                    selected_chambers,
+                    index,
+                    triggered_elem,
+                    date_range,
+                    gas_graphs,
+                    *var,
+                )
+                for var in vars
+            ]
 
         # TODO: add a toggle to zoom all rightside graph to the same width
         for i, graph in enumerate(attr_plots):
@@ -8,7 +8,6 @@ import pandas as pd
 from .db import engine
 from .measuring import instruments
 from .data_mgt import (
-    df_to_gas_table,
     df_to_cycle_table,
     df_to_meteo_table,
     df_to_volume_table,
@@ -17,17 +16,29 @@ from .data_mgt import (
     check_existing_instrument,
     add_instrument,
 )
-from .utils import (
-    process_measurement_file,
+from .ingest import (
+    check_ingested,
+    frame_report,
+    ingested_message,
+    record_ingest,
+    ingest_measurement_file,
     process_measurement_zip,
     process_protocol_file,
     process_protocol_zip,
-    init_from_cycle_table,
+    to_utc,
 )
+from .ingest_metrics import IngestMetrics, record_metrics
+from .flux_init import init_from_cycle_table
 
 logger = logging.getLogger("defaultLogger")
 
 
+def covered_note(covered):
+    if covered:
+        return " (time span already covered by earlier uploads)"
+    return ""
+
+
 def read_gas_init_input(use_class, serial, model, name, contents, filename):
     """Read data passed from the settings page"""
     if serial is None or model is None:
@@ -44,29 +55,36 @@ def read_gas_init_input(use_class, serial, model, name, contents, filename):
 
     instrument = instrument(serial)
     file_exts = ["csv", "data", "dat"]
+    metrics = IngestMetrics()
     try:
+        file_hash, size, known = check_ingested(io.BytesIO(decoded))
+        if known is not None:
+            return "", ingested_message(known)
         if ext in file_exts:
-            df = process_measurement_file(
-                io.StringIO(decoded.decode("utf-8")), instrument
-            )
-            in_rows = len(df)
-            df["instrument_serial"] = instrument.serial
-            df["instrument_model"] = instrument.model
-            df["datetime"] = (
-                df["datetime"]
-                .dt.tz_localize("Europe/Helsinki", ambiguous=True)
-                .dt.tz_convert("UTC")
+            report = ingest_measurement_file(
+                io.BytesIO(decoded), instrument, metrics=metrics
             )
-            pushed_data, dupes = df_to_gas_table(df)
-            push_rows = len(pushed_data)
-            return "", f"Pushed {push_rows}/{in_rows}"
+            record_metrics(filename, metrics)
+            report["file"] = filename
+            covered = record_ingest(file_hash, size, "gas", report, serial=serial)
+            push_rows, in_rows = report["pushed_rows"], report["in_rows"]
+            return "", f"Pushed {push_rows}/{in_rows}" + covered_note(covered)
 
         if ext == "zip":
-            print("process zip")
-            push_rows, in_rows = process_measurement_zip(
-                io.BytesIO(decoded), instrument
+            report = process_measurement_zip(
+                io.BytesIO(decoded), instrument, metrics=metrics
             )
-            return "", f"Pushed {push_rows}/{in_rows} rows."
+            record_metrics(filename, metrics)
+            report["file"] = filename
+            covered = record_ingest(file_hash, size, "gas", report, serial=serial)
+            push_rows, in_rows = report["pushed_rows"], report["in_rows"]
+            failed = [m["file"] for m in report["members"] if m["error"]]
+            if failed:
+                return (
+                    f"Failed to read {', '.join(failed)}",
+                    f"Pushed {push_rows}/{in_rows} rows.",
+                )
+            return "", f"Pushed {push_rows}/{in_rows} rows." + covered_note(covered)
         else:
             return "Wrong filetype extension", ""
     except Exception as e:
@@ -79,15 +97,14 @@ def read_cycle_init_input(contents, filename, chamber_map):
     content_type, content_str = contents.split(",")
     decoded = base64.b64decode(content_str)
     try:
+        file_hash, size, known = check_ingested(io.BytesIO(decoded))
+        if known is not None:
+            return "", ingested_message(known)
         if "csv" in filename:
             df = pd.read_csv(io.StringIO(decoded.decode("utf-8")))
             df["start_time"] = pd.to_datetime(df["start_time"], format="ISO8601")
             try:
-                df["start_time"] = (
-                    df["start_time"]
-                    .dt.tz_localize("Europe/Helsinki", ambiguous=True)
-                    .dt.tz_convert("UTC")
-                )
+                df["start_time"] = to_utc(df["start_time"])
             except Exception:
                 pass
             inrows = len(df)
@@ -97,7 +114,9 @@ def read_cycle_init_input(contents, filename, chamber_map):
                 row_count = 0
             else:
                 row_count = len(pushed_data)
-            return "", f"Pushed {inrows}/{row_count}"
+            report = frame_report(filename, df, "start_time", pushed_data)
+            covered = record_ingest(file_hash, size, "cycle", report)
+            return "", f"Pushed {inrows}/{row_count}" + covered_note(covered)
 
         # Read the CSV into a Pandas DataFrame
         if "log" in filename:
@@ -111,17 +130,28 @@ def read_cycle_init_input(contents, filename, chamber_map):
                 row_count = 0
             else:
                 row_count = len(pushed_data)
-            return "", f"Pushed {row_count}/{in_cycles}"
+            report = frame_report(filename, df, "start_time", pushed_data)
+            covered = record_ingest(file_hash, size, "cycle", report)
+            return "", f"Pushed {row_count}/{in_cycles}" + covered_note(covered)
 
         if "zip" in filename:
-            df = process_protocol_zip(io.BytesIO(decoded), chamber_map)
+            df, members = process_protocol_zip(io.BytesIO(decoded), chamber_map)
             in_cycles = len(df)
             pushed_data = df_to_cycle_table(df)
             if pushed_data.empty:
                 row_count = 0
             else:
                 row_count = len(pushed_data)
-            return "", f"Pushed {row_count}/{in_cycles}"
+            report = frame_report(filename, df, "start_time", pushed_data)
+            report["members"] = members
+            covered = record_ingest(file_hash, size, "cycle", report)
+            failed = [m["file"] for m in members if m["error"]]
+            if failed:
+                return (
+                    f"Failed to read {', '.join(failed)}",
+                    f"Pushed {row_count}/{in_cycles}",
+                )
+            return "", f"Pushed {row_count}/{in_cycles}" + covered_note(covered)
     except Exception as e:
         return f"Returned exception {e}", ""
 
@@ -139,16 +169,13 @@ def read_meteo_init_input(source, contents, filename):
     def read_meteo_file(file):
         df = pd.read_csv(file)
         df["datetime"] = pd.to_datetime(df["datetime"], format="ISO8601")
-        df["datetime"] = (
-            df["datetime"]
-            .dt.tz_localize(
-                "Europe/Helsinki", ambiguous=True, nonexistent="shift_forward"
-            )
-            .dt.tz_convert("UTC")
-        )
+        df["datetime"] = to_utc(df["datetime"])
         return df
 
     try:
+        file_hash, size, known = check_ingested(io.BytesIO(decoded))
+        if known is not None:
+            return "", ingested_message(known)
         file_exts = ["csv"]
         if ext in file_exts:
             logger.debug("Read file.")
@@ -159,7 +186,11 @@ def read_meteo_init_input(source, contents, filename):
             logger.debug("Pushing to table")
             pushed_data = df_to_meteo_table(df)
             push_rows = len(pushed_data)
-            return "", f"Pushed {push_rows}/{in_rows}"
+            report = frame_report(filename, df, "datetime", pushed_data)
+            covered = record_ingest(
+                file_hash, size, "meteo", report, meteo_source=source
+            )
+            return "", f"Pushed {push_rows}/{in_rows}" + covered_note(covered)
 
         else:
             return "Wrong filetype extension", ""
@@ -213,18 +244,15 @@ def read_volume_init_input(contents, filename):
     def read_volume_file(file):
         df = pd.read_csv(file)
         df["datetime"] = pd.to_datetime(df["datetime"], format="ISO8601")
-        df["datetime"] = (
-            df["datetime"]
-            .dt.tz_localize(
-                "Europe/Helsinki", ambiguous=True, nonexistent="shift_forward"
-            )
-            .dt.tz_convert("UTC")
-        )
+        df["datetime"] = to_utc(df["datetime"])
         df["chamber_id"] = df["chamber_id"].astype(str)
         df["chamber_height"] = df["chamber_height"].astype(float)
         return df
 
     try:
+        file_hash, size, known = check_ingested(io.BytesIO(decoded))
+        if known is not None:
+            return "", ingested_message(known)
         file_exts = ["csv"]
         if ext in file_exts:
             logger.debug("Read file.")
@@ -233,7 +261,9 @@ def read_volume_init_input(contents, filename):
             logger.debug("Pushing to table")
             pushed_data = df_to_volume_table(df)
             push_rows = len(pushed_data)
-            return "", f"Pushed {push_rows}/{in_rows}"
+            report = frame_report(filename, df, "datetime", pushed_data)
+            covered = record_ingest(file_hash, size, "volume", report)
+            return "", f"Pushed {push_rows}/{in_rows}" + covered_note(covered)
 
         else:
             return "Wrong filetype extension", ""
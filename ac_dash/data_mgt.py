@@ -1,7 +1,10 @@
-import logging
+import os
+import numpy as np
 import pandas as pd
 import pandas.api.types as ptypes
+from collections import namedtuple
 from datetime import timedelta
+from functools import lru_cache
 from sqlalchemy import (
     Table,
     update,
@@ -10,15 +13,21 @@ from sqlalchemy import (
     PrimaryKeyConstraint,
     inspect,
     distinct,
+    func,
 )
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import select, desc
 from flask_sqlalchemy import SQLAlchemy
 from .db import engine
-from .measuring import instruments
+from .measuring import instruments, gas_dtypes
+from .write_buffer import WriteBehindBuffer
+from .ingest_metrics import timed
+from .metrics import cache_lookups
+from .tools.logger import get_logger
 
 db = SQLAlchemy()
-logger = logging.getLogger("defaultLogger")
+logger = get_logger("db")
 
 
 class Flux(db.Model):
@@ -74,10 +83,6 @@ class Flux(db.Model):
 Flux_tbl = Table("flux_table", Flux.metadata)
 
 
-def mk_flux_table():
-    Flux.metadata.create_all(engine)
-
-
 def add_flux(
     start_time,
     lagtime,
@@ -123,7 +128,7 @@ def add_flux(
 def flux_df_to_table(df, instrument_serial):
     table = Flux.__tablename__
     primary_keys = get_primary_keys(table, engine)
-    logger.debug(f"Pushing {len(df)} rows to local db.")
+    logger.debug("Pushing %s rows to local db.", len(df))
     logger.debug(df)
     with engine.begin() as con:
         df_new, _ = drop_pk_dupes(df, table, primary_keys, con)
@@ -131,25 +136,138 @@ def flux_df_to_table(df, instrument_serial):
     return df_new
 
 
-def single_flux_to_table(df):
-    logger.debug(f"Pushing {len(df)} rows to local db.")
-    logger.debug(df.iloc[0])
-    start_time = df["start_time"].iloc[0]
-    chamber_id = df["chamber_id"].iloc[0]
-    instrument_serial = df["instrument_serial"].iloc[0]
-    to_delete = delete(Flux_tbl).where(
-        Flux_tbl.c.start_time == start_time,
-        Flux_tbl.c.chamber_id == chamber_id,
-        Flux_tbl.c.instrument_serial == instrument_serial,
+@lru_cache(maxsize=None)
+def flux_upsert_statement(columns):
+    """
+    INSERT ... ON CONFLICT DO UPDATE for flux_table, cached for each set of
+    columns so that only the given columns are overwritten on conflict.
+    """
+    ins = pg_insert(Flux_tbl)
+    pk_cols = [col.name for col in Flux_tbl.primary_key.columns]
+    update_cols = {
+        col: ins.excluded[col] for col in columns if col not in pk_cols
+    }
+    if not update_cols:
+        return ins.on_conflict_do_nothing(index_elements=pk_cols)
+    return ins.on_conflict_do_update(index_elements=pk_cols, set_=update_cols)
+
+
+def df_to_records(df):
+    """Convert dataframe to list of dicts with python types and None for NaN."""
+    return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+
+
+def upsert_fluxes(df, conn=None):
+    """
+    Insert rows to flux_table, rows that already exist are updated.
+
+    Parameters
+    ----------
+    df : pd.DataFrame or list of dicts
+        Rows to write, all rows need to have the same columns.
+    conn : sqlalchemy.Connection, optional
+        Write in this transaction instead of a new one.
+
+    Returns
+    -------
+    int
+        Number of written rows
+    """
+    rows = df_to_records(df) if isinstance(df, pd.DataFrame) else df
+    if not rows:
+        return 0
+    # a single statement can't update the same row twice, keep the last one
+    pk_cols = [col.name for col in Flux_tbl.primary_key.columns]
+    rows = list({tuple(row[col] for col in pk_cols): row for row in rows}.values())
+    stmt = flux_upsert_statement(tuple(rows[0].keys()))
+    logger.debug("Upserting %s rows to flux_table.", len(rows))
+    if conn is not None:
+        conn.execute(stmt, rows)
+    else:
+        with engine.begin() as conn:
+            conn.execute(stmt, rows)
+    return len(rows)
+
+
+def flux_key(row):
+    """Primary key of a flux row, start_time normalized to UTC."""
+    start_time = pd.Timestamp(row["start_time"])
+    if start_time.tzinfo is not None:
+        start_time = start_time.tz_convert("UTC")
+    return (start_time, str(row["chamber_id"]), str(row["instrument_serial"]))
+
+
+# write-behind buffer for interactive edits, off by default
+flux_buffer = WriteBehindBuffer(
+    upsert_fluxes,
+    flux_key,
+    max_rows=int(os.getenv("FLUX_WRITE_BEHIND_ROWS", 200)),
+    flush_interval=float(os.getenv("FLUX_WRITE_BEHIND_INTERVAL", 2)),
+    max_attempts=int(os.getenv("FLUX_WRITE_BEHIND_ATTEMPTS", 5)),
+    dead_letter_path=os.getenv(
+        "FLUX_WRITE_BEHIND_DEAD_LETTER", "/tmp/ac_dash_flux_dead_letter.jsonl"
+    ),
+)
+flux_buffer.enabled = os.getenv("FLUX_WRITE_BEHIND", "0") == "1"
+# the buffer lives in one process, a worker that flushes a stale row would
+# overwrite edits made through another worker and reads in the other
+# workers would miss the buffered values
+SERVER_WORKERS = int(os.getenv("AC_DASH_WORKERS", 1))
+if flux_buffer.enabled and SERVER_WORKERS > 1:
+    logger.warning(
+        f"FLUX_WRITE_BEHIND needs a single worker, {SERVER_WORKERS} are "
+        "running, edits are written directly."
     )
-    with engine.begin() as con:
-        con.execute(to_delete)
-        df.to_sql("flux_table", con=con, if_exists="append", index=False)
+    flux_buffer.enabled = False
+
+
+def buffered_flux(start_time, serial):
+    """Buffered edits for the flux at start_time measured with serial."""
+    if not flux_buffer.enabled:
+        return None
+    key_start = flux_key(
+        {"start_time": start_time, "chamber_id": "", "instrument_serial": ""}
+    )[0]
+    for key, row in flux_buffer.rows().items():
+        if key[0] == key_start and key[2] == str(serial):
+            cache_lookups.labels("flux_buffer", "hit").inc()
+            return row
+    cache_lookups.labels("flux_buffer", "miss").inc()
+    return None
+
+
+def overlay_buffered_fluxes(df):
+    """Replace values in a flux_table dataframe with buffered edits."""
+    if not flux_buffer.enabled or df.empty:
+        return df
+    rows = flux_buffer.rows()
+    if not rows:
+        cache_lookups.labels("flux_buffer", "miss").inc(len(df))
+        return df
+    keys = [flux_key(row) for row in df.to_dict(orient="records")]
+    hits = 0
+    for i, key in enumerate(keys):
+        row = rows.get(key)
+        if row is None:
+            continue
+        hits += 1
+        for col, value in row.items():
+            if col in df.columns:
+                df.at[df.index[i], col] = value
+    cache_lookups.labels("flux_buffer", "hit").inc(hits)
+    cache_lookups.labels("flux_buffer", "miss").inc(len(keys) - hits)
+    return df
+
+
+def single_flux_to_table(df):
+    if flux_buffer.enabled:
+        flux_buffer.add(df_to_records(df))
+        return
+    upsert_fluxes(df)
 
 
 def fluxes_to_table(df):
-    with engine.begin() as con:
-        df.to_sql("flux_table", con=con, if_exists="append", index=False)
+    upsert_fluxes(df)
 
 
 # def update_flux(measurement):
@@ -178,12 +296,67 @@ def flux_table_to_df(cols=None):
             Flux_tbl,
         ).order_by(desc(Flux_tbl.c.start_time))
 
+    if flux_buffer.enabled:
+        # cols may not have the key columns needed for overlaying edits
+        flux_buffer.flush()
     with engine.connect() as conn:
         df = pd.read_sql(select_st, conn)
 
     return df
 
 
+def flux_export_query(
+    start=None, end=None, chamber_ids=None, serial=None, is_valid=None, cols=None
+):
+    """
+    Build the select statement used for exporting fluxes.
+
+    Parameters
+    ----------
+    start, end : datetime, optional
+        Limits for start_time, inclusive.
+    chamber_ids : list, optional
+        Only export these chambers.
+    serial : str, optional
+        Only export fluxes calculated from this instrument.
+    is_valid : bool, optional
+        Only export valid or invalid fluxes.
+    cols : list, optional
+        Columns to export, defaults to all columns.
+
+    Returns
+    -------
+    sqlalchemy.sql.Select
+    """
+    if cols:
+        select_st = select(*[Flux_tbl.c[col] for col in cols])
+    else:
+        select_st = select(Flux_tbl)
+    if start is not None:
+        select_st = select_st.where(Flux_tbl.c.start_time >= start)
+    if end is not None:
+        select_st = select_st.where(Flux_tbl.c.start_time <= end)
+    if chamber_ids:
+        select_st = select_st.where(Flux_tbl.c.chamber_id.in_(chamber_ids))
+    if serial is not None:
+        select_st = select_st.where(Flux_tbl.c.instrument_serial == serial)
+    if is_valid is not None:
+        select_st = select_st.where(Flux_tbl.c.is_valid == is_valid)
+    return select_st.order_by(Flux_tbl.c.start_time.asc())
+
+
+def iter_flux_chunks(select_st, chunksize=5000):
+    """
+    Yield the result of select_st as dataframes of at most chunksize rows.
+
+    Uses a server side cursor so only one chunk is held in memory at a time.
+    """
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunksize)
+        for chunk in pd.read_sql(select_st, conn, chunksize=chunksize):
+            yield chunk
+
+
 def flux_to_df_complete(start_time, serial, conn=None):
     select_st = select(Flux_tbl).where(
         Flux_tbl.c.start_time == start_time,
@@ -260,9 +433,174 @@ def flux_to_df(start_time, serial, conn=None):
             df = pd.read_sql(select_st, conn)
 
     df.sort_values("start_time")
+    df = overlay_buffered_fluxes(df)
+    if df.empty:
+        # a flux that hasn't been flushed yet
+        buffered = buffered_flux(start_time, serial)
+        if buffered is not None:
+            df = pd.DataFrame([buffered])
     return df
 
 
+CycleHydration = namedtuple(
+    "CycleHydration",
+    ["flux", "gas", "air_temperature", "air_pressure", "chamber_height"],
+)
+
+# NOTE: gas columns are aggregated into arrays so that the whole cycle comes
+# back as a single row. The gas window and chamber_id come from the flux row
+# when it exists, otherwise from the given parameters.
+hydrate_query = text(
+    """
+    WITH f AS (
+        SELECT *
+        FROM flux_table
+        WHERE start_time = :start_time AND instrument_serial = :serial
+        LIMIT 1
+    ),
+    w AS (
+        SELECT
+            CAST(:start_time AS TIMESTAMPTZ) AS w_start,
+            COALESCE(
+                CAST(:end_override AS TIMESTAMPTZ),
+                (SELECT start_time + end_offset * INTERVAL '1 second' FROM f),
+                CAST(:end_time AS TIMESTAMPTZ)
+            ) AS w_end,
+            COALESCE((SELECT chamber_id FROM f), CAST(:chamber_id AS VARCHAR))
+                AS w_chamber
+    ),
+    g AS (
+        SELECT
+            array_agg(
+                (EXTRACT(EPOCH FROM datetime) * 1000000)::BIGINT ORDER BY datetime
+            ) AS gas_datetime,
+            array_agg("CH4" ORDER BY datetime) AS "gas_CH4",
+            array_agg("CO2" ORDER BY datetime) AS "gas_CO2",
+            array_agg("N2O" ORDER BY datetime) AS "gas_N2O",
+            array_agg("H2O" ORDER BY datetime) AS "gas_H2O",
+            array_agg("DIAG" ORDER BY datetime) AS "gas_DIAG"
+        FROM gas_table, w
+        WHERE instrument_serial = :serial
+        AND datetime >= w.w_start AND datetime <= w.w_end
+    ),
+    m AS (
+        SELECT air_temperature, air_pressure
+        FROM meteo_table, w
+        WHERE datetime BETWEEN w.w_start - INTERVAL '30 minutes'
+            AND w.w_start + INTERVAL '30 minutes'
+        AND (CAST(:meteo_source AS VARCHAR) IS NULL OR source = :meteo_source)
+        -- nearest to half an hour before the start, like get_single_meteo
+        ORDER BY ABS(EXTRACT(EPOCH FROM (
+            datetime - (w.w_start - INTERVAL '30 minutes')
+        )))
+        LIMIT 1
+    ),
+    v AS (
+        SELECT chamber_height
+        FROM volume_table, w
+        WHERE chamber_id = w.w_chamber
+        AND datetime BETWEEN w.w_start - INTERVAL '365 days'
+            AND w.w_start + INTERVAL '365 days'
+        ORDER BY ABS(EXTRACT(EPOCH FROM (datetime - w.w_start)))
+        LIMIT 1
+    )
+    SELECT
+        f.*,
+        g.*,
+        m.air_temperature AS meteo_air_temperature,
+        m.air_pressure AS meteo_air_pressure,
+        v.chamber_height AS volume_chamber_height
+    FROM w
+    CROSS JOIN g
+    LEFT JOIN f ON TRUE
+    LEFT JOIN m ON TRUE
+    LEFT JOIN v ON TRUE
+    """
+)
+
+
+def hydrate_cycle(
+    start_time, end_time, serial, chamber_id=None, meteo_source=None, conn=None
+):
+    """
+    Fetch everything needed to initiate one cycle with a single query: the
+    flux row, the gas measurements, the nearest meteo and chamber height.
+
+    Parameters
+    ----------
+    start_time : datetime
+        Start of the cycle.
+    end_time : datetime
+        End of the cycle, only used if the cycle is not in flux_table.
+    serial : str
+        Instrument serial.
+    chamber_id : str, optional
+        Used for the chamber height if the cycle is not in flux_table.
+    meteo_source : str, optional
+        Limit meteo to this source.
+    conn : sqlalchemy.Connection, optional
+        Reuse this connection instead of checking out a new one.
+
+    Returns
+    -------
+    CycleHydration
+        flux is a dict of the flux_table row or None, gas is a dict of
+        numpy arrays with datetime as int64 microseconds since epoch and
+        the gas columns as float32.
+    """
+    # buffered edits can have changed the end of the cycle
+    buffered = buffered_flux(start_time, serial)
+    end_override = None
+    if buffered is not None and buffered.get("end_offset") is not None:
+        end_override = start_time + pd.Timedelta(seconds=buffered["end_offset"])
+    params = {
+        "start_time": start_time,
+        "end_time": end_time,
+        "end_override": end_override,
+        "serial": serial,
+        "chamber_id": chamber_id,
+        "meteo_source": meteo_source,
+    }
+    if conn is not None:
+        row = conn.execute(hydrate_query, params).mappings().one()
+    else:
+        with engine.connect() as conn:
+            row = conn.execute(hydrate_query, params).mappings().one()
+
+    flux = None
+    if row["start_time"] is not None:
+        flux = {col: row[col] for col in Flux_tbl.columns.keys()}
+        if buffered is not None:
+            flux.update(buffered)
+
+    gas = {"datetime": np.asarray(row["gas_datetime"] or [], dtype="int64")}
+    for col in gas_view_cols:
+        # nulls become NaN, gas_arrays_to_df applies the final dtypes
+        gas[col] = np.asarray(row[f"gas_{col}"] or [], dtype="float32")
+
+    return CycleHydration(
+        flux,
+        gas,
+        row["meteo_air_temperature"],
+        row["meteo_air_pressure"],
+        row["volume_chamber_height"],
+    )
+
+
+def gas_arrays_to_df(gas, instrument=None):
+    """
+    Create the gas dataframe used by MeasurementCycle from hydrated arrays,
+    with the same columns and dtypes as gas_table_to_df.
+    """
+    index = pd.DatetimeIndex(
+        pd.to_datetime(gas["datetime"], unit="us", utc=True), name="datetime"
+    )
+    dtypes = gas_dtypes(instrument)
+    return pd.DataFrame({col: gas[col] for col in dtypes}, index=index).astype(
+        dtypes
+    )
+
+
 def delete_fluxes(start, end):
     delete_st = delete(Flux_tbl).where(
         Flux_tbl.c.start_time > start, Flux_tbl.c.start_time < end
@@ -272,8 +610,7 @@ def delete_fluxes(start, end):
 
 
 def flux_range_to_df(start, end, chamber_ids, is_valid=None, serial=None):
-    logger.info(start)
-    logger.info(end)
+    logger.debug("Fluxes from %s to %s", start, end)
     select_st = select(Flux_tbl).where(
         Flux_tbl.c.start_time >= start,
         Flux_tbl.c.start_time <= end,
@@ -287,7 +624,7 @@ def flux_range_to_df(start, end, chamber_ids, is_valid=None, serial=None):
     with engine.connect() as conn:
         df = pd.read_sql(select_st, conn)
 
-    return df
+    return overlay_buffered_fluxes(df)
 
 
 class GasMeasurement(db.Model):
@@ -311,27 +648,47 @@ class GasMeasurement(db.Model):
 Gas_tbl = Table("gas_table", GasMeasurement.metadata)
 
 
-def mk_gas_table():
-    GasMeasurement.metadata.create_all(engine)
-
-
 # NOTE: move this down
-def gas_table_to_df(start=None, end=None, serial=None, conn=None):
+def gas_table_to_df(start=None, end=None, serial=None, conn=None, instrument=None):
+    """
+    Read gas measurements with compact dtypes.
+
+    Parameters
+    ----------
+    start, end : datetime, optional
+    serial : str, optional
+        Instrument serial, without it rows of all instruments are returned
+        with instrument_serial as a categorical column.
+    conn : sqlalchemy.Connection, optional
+    instrument : Instrument, optional
+        Only read the columns of the gases this instrument measures.
+
+    Returns
+    -------
+    pd.DataFrame
+        gas columns as float32 and DIAG as Int32, indexed by datetime
+    """
     if start is None:
         start = pd.to_datetime("1970-01-01", format="ISO8601")
     if end is None:
         end = pd.to_datetime("2040-01-01", format="ISO8601")
-    select_st = select(Gas_tbl).where(
+    dtypes = gas_dtypes(instrument)
+    cols = [Gas_tbl.c.datetime] + [Gas_tbl.c[col] for col in dtypes]
+    if serial is None:
+        # the same few serials repeat on every row
+        cols.append(Gas_tbl.c.instrument_serial)
+        dtypes = {**dtypes, "instrument_serial": "category"}
+    select_st = select(*cols).where(
         Gas_tbl.c.datetime >= start, Gas_tbl.c.datetime <= end
     )
     if serial is not None:
         select_st = select_st.where(Gas_tbl.c.instrument_serial == serial)
     if conn:
-        df = pd.read_sql(select_st, conn)
+        df = pd.read_sql(select_st, conn, dtype=dtypes)
         df.set_index("datetime", inplace=True)
     else:
         with engine.connect() as conn:
-            df = pd.read_sql(select_st, conn)
+            df = pd.read_sql(select_st, conn, dtype=dtypes)
             df.set_index("datetime", inplace=True)
 
     return df
@@ -347,16 +704,121 @@ def get_distinct_instrument():
     return distinct_values
 
 
-def df_to_gas_table(df):
+gas_view_cols = ["CH4", "CO2", "N2O", "H2O", "DIAG"]
+
+
+def gas_page_to_df(
+    start, end, serial=None, bucket_s=None, page_current=0, page_size=50, desc_order=False
+):
+    """
+    Read one page of gas_table, optionally averaged into bucket_s second
+    buckets so long time ranges can be browsed without reading every row.
+
+    Parameters
+    ----------
+    start, end : datetime
+        Time range to query, always required so the query stays bounded.
+    serial : str, optional
+        Instrument serial.
+    bucket_s : int, optional
+        Length of the averaging bucket in seconds, raw rows if None.
+    page_current : int
+        Zero based page number.
+    page_size : int
+        Rows per page.
+    desc_order : bool
+        Newest rows first.
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    if bucket_s:
+        dt_col = func.to_timestamp(
+            func.floor(func.extract("epoch", Gas_tbl.c.datetime) / bucket_s)
+            * bucket_s
+        ).label("datetime")
+        gas_cols = [
+            func.avg(Gas_tbl.c[col]).label(col)
+            for col in gas_view_cols
+            if col != "DIAG"
+        ]
+        # any non-zero DIAG in the bucket should stay visible
+        gas_cols.append(func.max(Gas_tbl.c.DIAG).label("DIAG"))
+        select_st = select(dt_col, Gas_tbl.c.instrument_serial, *gas_cols).group_by(
+            dt_col, Gas_tbl.c.instrument_serial
+        )
+    else:
+        dt_col = Gas_tbl.c.datetime
+        select_st = select(
+            dt_col,
+            Gas_tbl.c.instrument_serial,
+            *[Gas_tbl.c[col] for col in gas_view_cols],
+        )
+    select_st = select_st.where(
+        Gas_tbl.c.datetime >= start, Gas_tbl.c.datetime <= end
+    )
+    if serial is not None:
+        select_st = select_st.where(Gas_tbl.c.instrument_serial == serial)
+    select_st = (
+        select_st.order_by(dt_col.desc() if desc_order else dt_col.asc())
+        .limit(page_size)
+        .offset(page_current * page_size)
+    )
+    with engine.connect() as conn:
+        df = pd.read_sql(select_st, conn)
+    return df
+
+
+def df_to_gas_table(df, conn=None, metrics=None):
+    """
+    Push gas measurements that are not yet in gas_table.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+    conn : sqlalchemy.Connection, optional
+        Push in a transaction on this connection instead of a new one.
+    metrics : IngestMetrics, optional
+        Times the dedup, transfer and commit stages.
+
+    Returns
+    -------
+    tuple
+        pushed rows and duplicate rows as dataframes
+    """
     table_name = GasMeasurement.__tablename__
     primary_keys = get_primary_keys(table_name, engine)
-    df.drop_duplicates(subset=primary_keys, keep="first", inplace=True)
-    logger.debug(f"Pushing {len(df)} rows to local db.")
-    with engine.begin() as con:
-        df_copy, dupes = drop_pk_dupes(df, table_name, primary_keys, con)
-        if not df_copy.empty:
-            logger.debug(f"Pushing {len(df_copy)} to local DB")
-            df_copy.to_sql("gas_table", con=con, if_exists="append", index=False)
+    with timed(metrics, "dedup"):
+        df.drop_duplicates(subset=primary_keys, keep="first", inplace=True)
+    logger.debug("Pushing %s rows to local db.", len(df))
+    if conn is not None:
+        return push_gas_transaction(df, table_name, primary_keys, conn, metrics)
+    with engine.connect() as con:
+        return push_gas_transaction(df, table_name, primary_keys, con, metrics)
+
+
+def push_gas_transaction(df, table_name, primary_keys, con, metrics=None):
+    trans = con.begin()
+    try:
+        result = push_gas_df(df, table_name, primary_keys, con, metrics)
+    except Exception:
+        trans.rollback()
+        raise
+    with timed(metrics, "commit"):
+        trans.commit()
+    return result
+
+
+def push_gas_df(df, table_name, primary_keys, con, metrics=None):
+    df_copy, dupes = drop_pk_dupes(df, table_name, primary_keys, con, metrics)
+    if not df_copy.empty:
+        logger.debug("Pushing %s to local DB", len(df_copy))
+        with timed(metrics, "transfer"):
+            df_copy.to_sql(table_name, con=con, if_exists="append", index=False)
+    if metrics is not None:
+        metrics.count("pushed_rows", len(df_copy))
+        metrics.count("duplicate_rows", len(df) - len(df_copy))
     return df_copy, dupes
 
 
@@ -372,10 +834,6 @@ class Cycles(db.Model):
 Cycle_tbl = Table("cycle_table", Cycles.metadata)
 
 
-def mk_cycle_table():
-    Cycles.metadata.create_all(engine)
-
-
 def df_to_cycle_table(df):
     """
     Push dataframe into the cycles table, dataframe doesnt need to have all of
@@ -526,10 +984,6 @@ def apply_meteo_table_trigger():
             pass
 
 
-def mk_meteo_table():
-    Meteo.metadata.create_all(engine)
-
-
 def df_to_meteo_table(df):
     logger.debug(df)
     table = Meteo.__tablename__
@@ -583,10 +1037,6 @@ class Volume(db.Model):
 Volume_tbl = Table("volume_table", Volume.metadata)
 
 
-def mk_volume_table():
-    Volume.metadata.create_all(engine)
-
-
 def get_single_volume(timestamp, chamber_id):
     logger.debug("Running get single temp")
     start = timestamp - pd.Timedelta(days=365)
@@ -737,10 +1187,6 @@ class Instruments(db.Model):
 Instrument_tbl = Table("instrument_table", Instruments.metadata)
 
 
-def mk_instrument_table():
-    Instruments.metadata.create_all(engine)
-
-
 def add_instrument(model, serial, python_class, name=None):
     ins = Instrument_tbl.insert().values(
         serial=serial, model=model, python_class=python_class, name=name
@@ -779,20 +1225,21 @@ def instruments_to_df():
 
 
 def init_instruments():
-    """Initiate built in instruments"""
-    for class_key, InstrumentClass in instruments.items():
+    """Add the missing built in instruments in one transaction."""
+    builtin = {}
+    for InstrumentClass in instruments.values():
         instrument = InstrumentClass("")
-        serial = instrument.serial
-        model = instrument.model
-        python_class = instrument.__class__.__name__
-        if check_existing_instrument(serial, model, python_class):
-            logger.info("Instrument exists")
-            continue
-        ins = Instrument_tbl.insert().values(
-            serial=serial, model=model, python_class=python_class
-        )
-        with engine.begin() as conn:
-            conn.execute(ins)
+        key = (instrument.serial, instrument.model, InstrumentClass.__name__)
+        builtin[key] = dict(zip(("serial", "model", "python_class"), key))
+    select_st = select(
+        Instrument_tbl.c.serial, Instrument_tbl.c.model, Instrument_tbl.c.python_class
+    )
+    with engine.begin() as conn:
+        existing = {tuple(row) for row in conn.execute(select_st)}
+        missing = [row for key, row in builtin.items() if key not in existing]
+        if missing:
+            conn.execute(Instrument_tbl.insert(), missing)
+    logger.info(f"Added {len(missing)} built in instruments.")
 
 
 def check_existing_instrument(serial, model, python_class):
@@ -807,6 +1254,125 @@ def check_existing_instrument(serial, model, python_class):
         return True
 
 
+class IngestedFile(db.Model):
+    __tablename__ = "ingest_registry"
+    file_hash = db.Column(db.String(64), primary_key=True)
+    # gas, cycle, meteo or volume
+    kind = db.Column(db.String(16), nullable=False)
+    filename = db.Column(db.String, nullable=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    instrument_serial = db.Column(db.String(25), nullable=True)
+    meteo_source = db.Column(db.String, nullable=True)
+    start_time = db.Column(db.DateTime(timezone=True), nullable=True)
+    end_time = db.Column(db.DateTime(timezone=True), nullable=True)
+    in_rows = db.Column(db.Integer, nullable=True)
+    pushed_rows = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (db.Index("ix_ingest_registry_kind_span", "kind", "start_time"),)
+
+
+Ingest_tbl = Table("ingest_registry", IngestedFile.metadata)
+
+
+def get_ingested_file(file_hash):
+    """Registry row of a file with this sha256 hash as a dict, or None."""
+    select_st = select(Ingest_tbl).where(Ingest_tbl.c.file_hash == file_hash)
+    with engine.connect() as conn:
+        row = conn.execute(select_st).mappings().first()
+    return dict(row) if row else None
+
+
+def register_ingested_file(**values):
+    """Add a file to the registry, an already registered hash is kept."""
+    insert_st = (
+        pg_insert(Ingest_tbl)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=["file_hash"])
+    )
+    with engine.begin() as conn:
+        conn.execute(insert_st)
+
+
+def ingested_spans(kind, start, end, serial=None, meteo_source=None):
+    """
+    Time spans of registered files of kind overlapping start - end.
+
+    Returns
+    -------
+    list
+        (start_time, end_time) tuples ordered by start_time
+    """
+    select_st = (
+        select(Ingest_tbl.c.start_time, Ingest_tbl.c.end_time)
+        .where(
+            Ingest_tbl.c.kind == kind,
+            Ingest_tbl.c.start_time <= end,
+            Ingest_tbl.c.end_time >= start,
+        )
+        .order_by(Ingest_tbl.c.start_time)
+    )
+    if serial is not None:
+        select_st = select_st.where(Ingest_tbl.c.instrument_serial == serial)
+    if meteo_source is not None:
+        select_st = select_st.where(Ingest_tbl.c.meteo_source == meteo_source)
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(select_st)]
+
+
+def table_page_to_df(
+    table, page_current=0, page_size=50, sort_by=None, filters=None, cols=None
+):
+    """
+    Read one page of a table with LIMIT/OFFSET.
+
+    Parameters
+    ----------
+    table : sqlalchemy.Table
+    page_current : int
+        Zero based page number.
+    page_size : int
+        Rows per page.
+    sort_by : list, optional
+        dash_table sort_by list, [{"column_id": col, "direction": "asc"}]
+    filters : list, optional
+        SQLAlchemy where clauses.
+    cols : list, optional
+        Columns to select, defaults to all.
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    if cols:
+        select_st = select(*[table.c[col] for col in cols if col in table.c])
+    else:
+        select_st = select(table)
+    for clause in filters or []:
+        select_st = select_st.where(clause)
+
+    order_by = []
+    for sort in sort_by or []:
+        col = table.c.get(sort.get("column_id"))
+        if col is None:
+            continue
+        order_by.append(col.desc() if sort.get("direction") == "desc" else col.asc())
+    # sort by primary key last so that paging is deterministic
+    order_by.extend(col.asc() for col in table.primary_key.columns)
+    select_st = (
+        select_st.order_by(*order_by)
+        .limit(page_size)
+        .offset(page_current * page_size)
+    )
+    if table is Flux_tbl and flux_buffer.enabled:
+        # filters, sorting and paging run in the db, so edits can't be
+        # overlaid on the page
+        flux_buffer.flush()
+    with engine.connect() as conn:
+        df = pd.read_sql(select_st, conn)
+    return df
+
+
 def get_primary_keys(table_name, engine):
     """
     Retrieve the primary key columns of a SQL table.
@@ -827,8 +1393,13 @@ def get_primary_keys(table_name, engine):
     return primary_keys
 
 
-def drop_pk_dupes(df, table, primary_keys, con):
+def drop_pk_dupes(df, table, primary_keys, con, metrics=None):
     """Filter dataframe using primary keys from db table"""
+    with timed(metrics, "dedup"):
+        return _drop_pk_dupes(df, table, primary_keys, con)
+
+
+def _drop_pk_dupes(df, table, primary_keys, con):
     # Drop duplicate rows based on primary keys in the dataframe
     df.drop_duplicates(subset=primary_keys, keep="first", inplace=True)
 
@@ -860,10 +1431,6 @@ def drop_pk_dupes(df, table, primary_keys, con):
     # Create composite keys for detecting duplicates
     df["composite_key"] = list(zip(*[df[key] for key in primary_keys]))
     edf["composite_key"] = list(zip(*[edf[key] for key in primary_keys]))
-    print(df["composite_key"])
-    print(edf["composite_key"])
-    print(edf.dtypes)
-    print(df.dtypes)
 
     # Identify duplicates
     existing_keys = set(edf["composite_key"])
@@ -1,5 +1,10 @@
 import os
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from .metrics import pool_checked_out, pool_checkout_seconds, pool_timeouts
 
 
 class Config(object):
@@ -7,6 +12,25 @@ class Config(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
 
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports how long checkouts wait for a connection."""
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_timeouts.inc()
+            raise
+        finally:
+            pool_checkout_seconds.observe(time.perf_counter() - t0)
+
+
+# the in memory sqlite fallback keeps its default single connection pool
+poolclass = (
+    None if Config.SQLALCHEMY_DATABASE_URI.startswith("sqlite") else TimedQueuePool
+)
+
 # initiate sqlalchemy engine
 engine = create_engine(
     Config.SQLALCHEMY_DATABASE_URI,
@@ -14,4 +38,15 @@ engine = create_engine(
     max_overflow=5,
     pool_timeout=30,
     pool_recycle=1000,
+    poolclass=poolclass,
 )
+
+
+@event.listens_for(engine, "checkout")
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_checked_out.inc()
+
+
+@event.listens_for(engine, "checkin")
+def count_checkin(dbapi_connection, connection_record):
+    pool_checked_out.dec()
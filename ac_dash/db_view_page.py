@@ -1,5 +1,170 @@
-from dash import html, dcc
-from .data_mgt import Flux_tbl
+import pandas as pd
+from dash import html, dcc, dash_table
+from sqlalchemy import DateTime, String
+from .data_mgt import Flux_tbl, gas_view_cols, get_distinct_instrument
+
+page_size = 50
+
+# dash_table filter operators and the matching column method
+filter_operators = [
+    ["ge ", ">="],
+    ["le ", "<="],
+    ["lt ", "<"],
+    ["gt ", ">"],
+    ["ne ", "!="],
+    ["eq ", "="],
+    ["contains "],
+    ["datestartswith "],
+]
+
+gas_resolutions = [
+    {"label": "Raw data", "value": 0},
+    {"label": "10 second average", "value": 10},
+    {"label": "1 minute average", "value": 60},
+    {"label": "10 minute average", "value": 600},
+    {"label": "1 hour average", "value": 3600},
+]
+
+
+def split_filter_part(filter_part):
+    """
+    Split one part of a dash_table filter_query into column name, operator
+    and value. Adapted from the dash_table documentation.
+    """
+    for operator_type in filter_operators:
+        for operator in operator_type:
+            if operator not in filter_part:
+                continue
+            name_part, value_part = filter_part.split(operator, 1)
+            name = name_part[name_part.find("{") + 1 : name_part.rfind("}")]
+
+            value_part = value_part.strip()
+            v0 = value_part[0] if value_part else ""
+            if v0 == value_part[-1] and v0 in ("'", '"', "`"):
+                value = value_part[1:-1].replace("\\" + v0, v0)
+            else:
+                try:
+                    value = float(value_part)
+                except ValueError:
+                    value = value_part
+
+            # word operators need spaces after them in the filter string,
+            # but we don't want these later
+            return name, operator_type[0].strip(), value
+
+    return None, None, None
+
+
+def filter_query_to_clauses(table, filter_query):
+    """
+    Convert a dash_table filter_query into SQLAlchemy where clauses for
+    table, parts with unknown columns are ignored.
+    """
+    clauses = []
+    if not filter_query:
+        return clauses
+    for filter_part in filter_query.split(" && "):
+        col_name, operator, value = split_filter_part(filter_part)
+        col = table.c.get(col_name)
+        if col is None:
+            continue
+        if isinstance(col.type, DateTime) and operator != "datestartswith":
+            value = pd.to_datetime(value, utc=True)
+        elif isinstance(col.type, String) and operator != "contains":
+            value = str(value)
+
+        if operator == "ge":
+            clauses.append(col >= value)
+        elif operator == "le":
+            clauses.append(col <= value)
+        elif operator == "lt":
+            clauses.append(col < value)
+        elif operator == "gt":
+            clauses.append(col > value)
+        elif operator == "ne":
+            clauses.append(col != value)
+        elif operator == "eq":
+            clauses.append(col == value)
+        elif operator == "contains":
+            clauses.append(col.cast(String).ilike(f"%{value}%"))
+        elif operator == "datestartswith":
+            clauses.append(col.cast(String).startswith(str(value)))
+    return clauses
+
+
+def mk_db_table(index, columns, deletable=False, font_size="18px", editable=False):
+    """
+    DataTable that is paged, sorted and filtered in the db. Edits stay in
+    the browser, loading another page replaces them.
+    """
+    return dash_table.DataTable(
+        id={"type": "db-table", "index": index},
+        columns=[{"name": col, "id": col, "deletable": deletable} for col in columns],
+        data=[],
+        page_current=0,
+        page_size=page_size,
+        page_action="custom",
+        sort_action="custom",
+        sort_mode="multi",
+        sort_by=[],
+        filter_action="custom",
+        filter_query="",
+        editable=editable,
+        style_table={"width": "80%", "margin": "auto"},
+        style_data={"font-size": font_size},
+        style_header={"font-size": font_size},
+    )
+
+
+def mk_gas_view():
+    """Controls and table for viewing a limited range of gas data."""
+    end = pd.Timestamp.now(tz="UTC").floor("D")
+    start = end - pd.Timedelta(days=1)
+    serials = get_distinct_instrument()
+    return [
+        html.Div(
+            [
+                html.Label("Start"),
+                dcc.Input(
+                    id="gas-view-start", value=start.strftime("%Y-%m-%d %H:%M")
+                ),
+                html.Label("End"),
+                dcc.Input(id="gas-view-end", value=end.strftime("%Y-%m-%d %H:%M")),
+                dcc.Dropdown(
+                    id="gas-view-serial",
+                    options=[{"label": s, "value": s} for s in serials],
+                    value=serials[0] if serials else None,
+                    style={"width": "15vw"},
+                ),
+                dcc.Dropdown(
+                    id="gas-view-resolution",
+                    options=gas_resolutions,
+                    value=60,
+                    clearable=False,
+                    style={"width": "15vw"},
+                ),
+                html.Button("Show", id="gas-view-apply"),
+                html.Div(id="gas-view-warn"),
+            ],
+            style={"display": "flex", "gap": "10px", "align-items": "center"},
+        ),
+        dash_table.DataTable(
+            id="gas-db-table",
+            columns=[
+                {"name": col, "id": col}
+                for col in ["datetime", "instrument_serial", *gas_view_cols]
+            ],
+            data=[],
+            page_current=0,
+            page_size=page_size,
+            page_action="custom",
+            sort_action="custom",
+            sort_by=[],
+            style_table={"width": "80%", "margin": "auto"},
+            style_data={"font-size": "18px"},
+            style_header={"font-size": "18px"},
+        ),
+    ]
 
 
 def mk_db_view_page(columns=None):
@@ -0,0 +1,120 @@
+import io
+import logging
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Boolean, DateTime, Float, Integer
+
+from .data_mgt import Flux_tbl, flux_buffer, flux_export_query, iter_flux_chunks
+
+logger = logging.getLogger("defaultLogger")
+
+export_formats = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write only file object that collects written bytes until they are
+    drained, keeps track of the position so pyarrow can write the parquet
+    footer offsets correctly.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        b = bytes(b)
+        self._chunks.append(b)
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def arrow_type(column):
+    """Map a flux_table column to a pyarrow type."""
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    return pa.string()
+
+
+def flux_arrow_schema(cols=None):
+    """Fixed arrow schema for the exported columns, chunks are cast to it."""
+    cols = cols or [col.name for col in Flux_tbl.columns]
+    return pa.schema([(col, arrow_type(Flux_tbl.c[col])) for col in cols])
+
+
+def iter_flux_csv(select_st, chunksize=5000):
+    """Yield CSV encoded bytes, header is only written with the first chunk."""
+    header = True
+    for chunk in iter_flux_chunks(select_st, chunksize):
+        yield chunk.to_csv(index=False, header=header).encode()
+        header = False
+    if header:
+        # no rows, still return the header
+        yield ",".join(col.name for col in select_st.selected_columns).encode() + b"\n"
+
+
+def iter_flux_parquet(select_st, cols=None, chunksize=5000):
+    """Yield a parquet file in pieces, one row group per chunk."""
+    schema = flux_arrow_schema(cols)
+    sink = _ChunkSink()
+    with pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema) as writer:
+        for chunk in iter_flux_chunks(select_st, chunksize):
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            writer.write_table(table)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def stream_fluxes(fmt="csv", cols=None, chunksize=5000, **filters):
+    """
+    Return a generator of bytes for exporting flux_table in the given format.
+
+    Parameters
+    ----------
+    fmt : str
+        csv or parquet
+    cols : list, optional
+        Exported columns, defaults to all columns
+    chunksize : int
+        Number of rows fetched from the db per chunk
+    **filters
+        Passed to flux_export_query
+
+    Returns
+    -------
+    generator
+    """
+    if fmt not in export_formats:
+        raise ValueError(f"Unknown export format {fmt}.")
+    unknown = [col for col in cols or [] if col not in Flux_tbl.c]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    if flux_buffer.enabled:
+        # export what the reviewer sees in this process
+        flux_buffer.flush()
+    select_st = flux_export_query(cols=cols, **filters)
+    logger.debug(f"Exporting fluxes as {fmt}.")
+    if fmt == "parquet":
+        return iter_flux_parquet(select_st, cols, chunksize)
+    return iter_flux_csv(select_st, chunksize)
@@ -0,0 +1,59 @@
+import time
+
+import pandas as pd
+
+from .tools.equivalence import shadow_check
+from .tools.logger import get_logger, sampled
+from .metrics import observe_cycle_init
+from .measuring import instruments
+from .measurement import MeasurementCycle
+from .data_mgt import fluxes_to_table
+
+logger = get_logger("engine")
+
+# Batch flux calculation from cycle_table rows, used by the API and
+# manage.py. Kept apart from utils so the API app doesn't import dash.
+
+
+def init_from_cycle_table(
+    cycle_df, use_class=None, serial=None, conn=None, meteo_source=None
+):
+    instrument = instruments.get(use_class)(serial)
+    all_measurements = []
+    o = 0
+    for idx, row in cycle_df.iterrows():
+        o += 1
+        start = row.start_time
+        close = row.close_offset
+        open = row.open_offset
+        end = row.end_offset
+        id = row.chamber_id
+        if sampled("init_from_cycle_table", 100):
+            logger.info("Initiating %s", start)
+        t0 = time.perf_counter()
+        m = MeasurementCycle(
+            id,
+            start,
+            close,
+            open,
+            end,
+            instrument,
+            meteo_source=meteo_source,
+            conn=conn,
+        )
+        observe_cycle_init(m, time.perf_counter() - t0)
+        if m.data is not None and not m.data.empty:
+            # single_flux_to_table(m.attribute_df)
+            shadow_check(m)
+            all_measurements.append(m.attribute_df)
+        if o == 100:
+            o = 0
+            if len(all_measurements) == 0:
+                continue
+            df = pd.concat(all_measurements)
+            fluxes_to_table(df)
+            all_measurements = []
+            continue
+    if len(all_measurements) > 0:
+        df = pd.concat(all_measurements)
+        fluxes_to_table(df)
@@ -0,0 +1,278 @@
+import os
+import time
+import shutil
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from .measuring import instruments
+from .data_mgt import add_instrument, check_existing_instrument
+from .ingest import gas_file_exts, ingest_file, report_to_json
+from .ingest_metrics import IngestMetrics, record_metrics
+from .uploads import record_upload_result
+
+logger = logging.getLogger("defaultLogger")
+
+# Layout of the inbox directory:
+#
+#     <inbox>/gas/<python_class>/<serial>/   LI-COR output files or zips
+#     <inbox>/cycle/                         cycle csvs, protocol logs or zips
+#     <inbox>/meteo/<source>/                meteo csvs
+#     <inbox>/volume/                        chamber volume csvs
+#
+# Ingested files are moved to the archive and failed ones to the quarantine
+# with the same relative path, <file>.error next to a quarantined file has
+# the reason. Files of API uploads are named <upload_id>_<filename>, their
+# result is stored with the upload for GET /api/uploads/<upload_id>.
+
+INBOX_DIR = os.getenv("AC_DASH_INBOX", "inbox")
+inbox_kinds = ("gas", "cycle", "meteo", "volume")
+
+
+class InboxError(Exception):
+    pass
+
+
+def classify(rel_path):
+    """
+    Classify a file by its path relative to the inbox.
+
+    Returns
+    -------
+    tuple
+        kind and the keyword arguments for ingesting it
+    """
+    parts = rel_path.split(os.sep)
+    kind = parts[0]
+    ext = parts[-1].rsplit(".", 1)[-1].lower()
+    if kind == "gas":
+        if len(parts) != 4:
+            raise InboxError("Gas files go to gas/<python_class>/<serial>/")
+        python_class, serial = parts[1], parts[2]
+        if python_class not in instruments:
+            raise InboxError(f"Unknown instrument class {python_class}")
+        if ext not in gas_file_exts + ("zip",):
+            raise InboxError(f"Unsupported gas file type {ext}")
+        return kind, {"python_class": python_class, "serial": serial}
+    if kind == "cycle":
+        if ext not in ("csv", "log", "zip"):
+            raise InboxError(f"Unsupported cycle file type {ext}")
+        return kind, {}
+    if kind == "meteo":
+        if len(parts) != 3:
+            raise InboxError("Meteo files go to meteo/<source>/")
+        if ext != "csv":
+            raise InboxError(f"Unsupported meteo file type {ext}")
+        return kind, {"source": parts[1]}
+    if kind == "volume":
+        if ext != "csv":
+            raise InboxError(f"Unsupported volume file type {ext}")
+        return kind, {}
+    raise InboxError(f"Unknown inbox directory {kind}")
+
+
+def upload_result(report):
+    """Result of an ingested upload for record_upload_result."""
+    if report is None:
+        return {"state": "done", "skipped": True, "message": "Already ingested."}
+    message = (
+        f"Pushed {report['pushed_rows']}/{report['in_rows']} rows "
+        f"from {report['file']}."
+    )
+    if report.get("covered"):
+        message += " Time span of the file was already covered by earlier uploads."
+    return {"state": "done", "message": message, "report": report_to_json(report)}
+
+
+class Inbox:
+    """
+    Poll an inbox directory tree and ingest new files in a thread pool.
+
+    A file is picked up once its size and modification time haven't changed
+    between two scans and it is older than settle seconds, so files that are
+    still being copied are left alone.
+
+    Parameters
+    ----------
+    root : str
+        Inbox directory
+    chamber_map : dict
+        Maps protocol chamber ids to chamber ids
+    archive : str, optional
+        Where ingested files are moved, defaults to archive next to root
+    quarantine : str, optional
+        Where failed files are moved, defaults to quarantine next to root
+    workers : int
+        Files ingested at the same time
+    interval : float
+        Seconds between scans
+    settle : float
+        Minimum age of a file in seconds before it is ingested
+    """
+
+    def __init__(
+        self,
+        root,
+        chamber_map,
+        archive=None,
+        quarantine=None,
+        workers=2,
+        interval=5.0,
+        settle=10.0,
+    ):
+        self.root = os.path.abspath(root)
+        parent = os.path.dirname(self.root)
+        self.archive = os.path.abspath(archive or os.path.join(parent, "archive"))
+        self.quarantine = os.path.abspath(
+            quarantine or os.path.join(parent, "quarantine")
+        )
+        self.chamber_map = chamber_map
+        self.workers = workers
+        self.interval = interval
+        self.settle = settle
+        self._seen = {}
+        self.totals = {"files": 0, "failed": 0, "bytes": 0, "rows": 0}
+
+    def scan(self):
+        """Return paths of files that are ready to be ingested."""
+        ready = []
+        seen = {}
+        now = time.time()
+        for kind in inbox_kinds:
+            for dirpath, _, filenames in os.walk(os.path.join(self.root, kind)):
+                for filename in filenames:
+                    if filename.startswith("."):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    seen[path] = (stat.st_size, stat.st_mtime)
+                    if (
+                        self._seen.get(path) == seen[path]
+                        and now - stat.st_mtime >= self.settle
+                    ):
+                        ready.append(path)
+        self._seen = seen
+        return ready
+
+    def ingest(self, path):
+        """Ingest one file, returns the report."""
+        rel_path = os.path.relpath(path, self.root)
+        kind, kwargs = classify(rel_path)
+        instrument = None
+        if kind == "gas":
+            python_class = kwargs["python_class"]
+            instrument = instruments[python_class](kwargs["serial"])
+            if not check_existing_instrument(
+                instrument.serial, instrument.model, python_class
+            ):
+                add_instrument(instrument.model, instrument.serial, python_class)
+        metrics = IngestMetrics()
+        with open(path, "rb") as f:
+            report, known = ingest_file(
+                f,
+                kind,
+                rel_path,
+                instrument=instrument,
+                chamber_map=self.chamber_map,
+                source=kwargs.get("source"),
+                metrics=metrics,
+            )
+        if known is not None:
+            logger.info(f"Skipping {rel_path}, already ingested.")
+            return None
+        report["metrics"] = record_metrics(rel_path, metrics)
+        failed = [m["file"] for m in report.get("members", []) if m["error"]]
+        if failed:
+            raise InboxError(f"Failed to read members: {', '.join(failed)}")
+        return report
+
+    def move(self, path, target_root, error=None):
+        rel_path = os.path.relpath(path, self.root)
+        target = os.path.join(target_root, rel_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            stem, ext = os.path.splitext(target)
+            target = f"{stem}_{time.strftime('%Y%m%d%H%M%S')}{ext}"
+        shutil.move(path, target)
+        if error is not None:
+            with open(f"{target}.error", "w") as f:
+                f.write(error)
+        return target
+
+    def process(self, path):
+        """Ingest a file and move it, returns (size, rows, ok)."""
+        rel_path = os.path.relpath(path, self.root)
+        size = os.path.getsize(path)
+        try:
+            report = self.ingest(path)
+        except Exception as e:
+            logger.error(f"Failed to ingest {path}: {e}")
+            self.move(path, self.quarantine, traceback.format_exc())
+            record_upload_result(rel_path, {"state": "failed", "error": str(e)})
+            return size, 0, False
+        self.move(path, self.archive)
+        record_upload_result(rel_path, upload_result(report))
+        rows = report["pushed_rows"] if report else 0
+        if report:
+            logger.info(
+                f"Ingested {report['file']}, "
+                f"pushed {report['pushed_rows']}/{report['in_rows']} rows, "
+                f"stages {report['metrics']['stages_s']}."
+            )
+        return size, rows, True
+
+    def run_once(self, pool):
+        """Scan once and ingest the ready files, returns the batch totals."""
+        paths = self.scan()
+        if not paths:
+            return None
+        t0 = time.perf_counter()
+        batch = {"files": 0, "failed": 0, "bytes": 0, "rows": 0}
+        for size, rows, ok in pool.map(self.process, paths):
+            batch["files"] += 1
+            batch["failed"] += not ok
+            batch["bytes"] += size
+            batch["rows"] += rows
+        elapsed = max(time.perf_counter() - t0, 1e-9)
+        for key, value in batch.items():
+            self.totals[key] += value
+        logger.info(
+            f"Ingested {batch['files']} files ({batch['failed']} failed) in "
+            f"{elapsed:.1f} s, {batch['bytes'] / elapsed / 1e6:.2f} MB/s, "
+            f"{batch['rows'] / elapsed:.0f} rows/s. Total {self.totals['files']} "
+            f"files, {self.totals['rows']} rows."
+        )
+        return batch
+
+    def run(self, once=False):
+        """
+        Watch the inbox until interrupted.
+
+        Parameters
+        ----------
+        once : bool
+            Ingest what is in the inbox and return, settle is not waited for.
+        """
+        for kind in inbox_kinds:
+            os.makedirs(os.path.join(self.root, kind), exist_ok=True)
+        logger.info(
+            f"Watching {self.root}, archive {self.archive}, "
+            f"quarantine {self.quarantine}"
+        )
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            if once:
+                settle, self.settle = self.settle, 0
+                self.scan()
+                self.run_once(pool)
+                self.settle = settle
+                return self.totals
+            try:
+                while True:
+                    self.run_once(pool)
+                    time.sleep(self.interval)
+            except KeyboardInterrupt:
+                logger.info("Stopped watching the inbox.")
+        return self.totals
@@ -0,0 +1,750 @@
+import os
+import shutil
+import hashlib
+import logging
+import zipfile
+import tempfile
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .db import engine
+from .data_mgt import (
+    df_to_cycle_table,
+    df_to_meteo_table,
+    df_to_volume_table,
+    df_to_gas_table,
+    get_ingested_file,
+    ingested_spans,
+    register_ingested_file,
+)
+from .measuring import CHUNK_ROWS, DETECT_PREFIX_BYTES, match_instrument
+from .ingest_metrics import IngestMetrics, iter_timed, timed
+
+logger = logging.getLogger("defaultLogger")
+
+gas_file_exts = ("csv", "data", "dat")
+protocol_file_exts = ("log",)
+# processes parsing zip members, shared by all ingests of a gunicorn worker
+# and its inbox threads, 1 parses in this process
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+# where zip uploads and parsed members are spooled, the system temp dir
+SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR") or None
+HASH_BLOCK_SIZE = 1 << 20
+# gaps between registered files that still count as covered, instruments
+# write a new file every day so consecutive files are ~1 s apart
+COVERAGE_GAP = pd.Timedelta(minutes=1)
+
+
+def file_name(file):
+    """Name of an uploaded file or path, None for anonymous buffers."""
+    if isinstance(file, (str, os.PathLike)):
+        return os.fspath(file)
+    return getattr(file, "filename", None) or getattr(file, "name", None)
+
+
+def to_utc(series):
+    """Localize naive Finnish local times and convert them to UTC."""
+    return series.dt.tz_localize(
+        "Europe/Helsinki", ambiguous=True, nonexistent="shift_forward"
+    ).dt.tz_convert("UTC")
+
+
+def prepare_gas_chunk(df, instrument, metrics=None):
+    """Add instrument details and convert local time to UTC."""
+    with timed(metrics, "tz"):
+        df["instrument_serial"] = instrument.serial
+        df["instrument_model"] = instrument.model
+        df["datetime"] = to_utc(df["datetime"])
+    return df
+
+
+def mk_report(name=None):
+    return {"file": name, "in_rows": 0, "pushed_rows": 0, "start": None, "end": None}
+
+
+def mk_member_report(name):
+    report = mk_report(name)
+    report["error"] = None
+    return report
+
+
+def add_to_report(report, other):
+    """Sum row counts of other into report and extend the time span."""
+    report["in_rows"] += other["in_rows"]
+    report["pushed_rows"] += other["pushed_rows"]
+    for key, pick in (("start", min), ("end", max)):
+        values = [v for v in (report[key], other[key]) if v is not None]
+        report[key] = pick(values) if values else None
+    return report
+
+
+def frame_report(name, df, time_col, pushed_data):
+    """Report of a dataframe that was pushed in one go."""
+    report = mk_report(name)
+    report["in_rows"] = len(df)
+    report["pushed_rows"] = len(pushed_data)
+    if not df.empty:
+        report["start"] = df[time_col].min()
+        report["end"] = df[time_col].max()
+    return report
+
+
+def file_sha256(file):
+    """sha256 hex digest and size of a binary file, file is rewound."""
+    stream = getattr(file, "stream", file)
+    stream.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b""):
+        digest.update(block)
+        size += len(block)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
+
+def check_ingested(file):
+    """
+    Hash file and look it up from the ingest registry.
+
+    Returns
+    -------
+    tuple
+        file hash, size in bytes and the registry row of an identical file
+        that was already ingested or None
+    """
+    file_hash, size = file_sha256(file)
+    return file_hash, size, get_ingested_file(file_hash)
+
+
+def ingested_message(row):
+    return (
+        f"Identical file {row['filename']} was already ingested "
+        f"{row['created_at']:%Y-%m-%d %H:%M}, "
+        f"pushed {row['pushed_rows']}/{row['in_rows']}."
+    )
+
+
+def span_is_covered(kind, start, end, serial=None, meteo_source=None):
+    """True if registered files of kind together cover start - end."""
+    if start is None or end is None:
+        return False
+    reach = start
+    for span_start, span_end in ingested_spans(
+        kind, start, end, serial, meteo_source
+    ):
+        if span_start - reach > COVERAGE_GAP:
+            return False
+        reach = max(reach, span_end)
+        if reach >= end:
+            return True
+    return False
+
+
+def record_ingest(
+    file_hash, size, kind, report, serial=None, meteo_source=None
+):
+    """
+    Add an ingested file to the registry.
+
+    Archives with members that failed are not registered so that they are
+    read again when uploaded the next time.
+
+    Returns
+    -------
+    bool
+        True if the time span of the file was already covered by earlier
+        files, i.e. the file most likely didn't contain new data. Always
+        False for gas files without a serial, e.g. zips whose members were
+        detected separately, the span of other instruments says nothing
+        about them.
+    """
+    if any(member["error"] for member in report.get("members", [])):
+        return False
+    covered = False
+    if kind != "gas" or serial is not None:
+        covered = span_is_covered(
+            kind, report["start"], report["end"], serial, meteo_source
+        )
+    if covered:
+        logger.info(f"Time span of {report['file']} was already ingested.")
+    register_ingested_file(
+        file_hash=file_hash,
+        kind=kind,
+        filename=report["file"],
+        size=size,
+        instrument_serial=serial,
+        meteo_source=meteo_source,
+        start_time=report["start"],
+        end_time=report["end"],
+        in_rows=report["in_rows"],
+        pushed_rows=report["pushed_rows"],
+    )
+    return covered
+
+
+def report_to_json(report):
+    """Copy of a report with the timestamps as ISO strings."""
+    out = dict(report)
+    for key in ("start", "end"):
+        if out.get(key) is not None:
+            out[key] = out[key].isoformat()
+    if "members" in out:
+        out["members"] = [report_to_json(member) for member in out["members"]]
+    return out
+
+
+def push_gas_frame(df, report, conn=None, metrics=None):
+    """Push a prepared gas dataframe and add its counts to report."""
+    chunk = {
+        "in_rows": len(df),
+        "start": df["datetime"].min(),
+        "end": df["datetime"].max(),
+    }
+    if metrics is not None:
+        metrics.count("in_rows", len(df))
+    pushed_data, _ = df_to_gas_table(df, conn=conn, metrics=metrics)
+    chunk["pushed_rows"] = len(pushed_data)
+    add_to_report(report, chunk)
+    logger.debug(f"Pushed {chunk['pushed_rows']}/{chunk['in_rows']} rows.")
+    return report
+
+
+def file_size(file):
+    """Size of a path or a file object in bytes, the position is restored."""
+    if isinstance(file, (str, os.PathLike)):
+        return os.path.getsize(file)
+    stream = getattr(file, "stream", file)
+    pos = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(pos)
+    return size
+
+
+def ingest_measurement_file(file, instrument, chunk_rows=CHUNK_ROWS, metrics=None):
+    """
+    Stream an instrument output file into gas_table one chunk at a time.
+
+    Parameters
+    ----------
+    file : file-like
+        Binary file object, e.g. an uploaded file or an open zip member.
+    instrument : Instrument
+        Instrument the file is from.
+    chunk_rows : int
+        Rows read and pushed per chunk.
+    metrics : IngestMetrics, optional
+        Collects stage timings and row counts.
+
+    Returns
+    -------
+    dict
+        file, in_rows, pushed_rows, start and end of the data
+    """
+    report = mk_report(file_name(file))
+    stream = getattr(file, "stream", file)
+    if metrics is not None:
+        metrics.count("files")
+        metrics.count("bytes", file_size(stream))
+    chunks = instrument.read_output_chunks(stream, chunk_rows)
+    for df in iter_timed(chunks, metrics, "parse"):
+        if df.empty:
+            continue
+        df = prepare_gas_chunk(df, instrument, metrics)
+        push_gas_frame(df, report, metrics=metrics)
+    return report
+
+
+_pool = {"executor": None}
+_pool_lock = threading.Lock()
+
+
+def ingest_pool():
+    """
+    Process pool of this process, created on first use.
+
+    Workers are started by a forkserver, forking a gunicorn worker that
+    runs the write-behind flusher and the inbox threads could copy their
+    held logging or SQLAlchemy locks into the child.
+    """
+    with _pool_lock:
+        if _pool["executor"] is None:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["ac_dash.ingest"])
+            _pool["executor"] = ProcessPoolExecutor(
+                max_workers=INGEST_WORKERS, mp_context=context
+            )
+        return _pool["executor"]
+
+
+def reset_ingest_pool():
+    """Drop a pool that broke, e.g. when a worker was killed."""
+    with _pool_lock:
+        executor, _pool["executor"] = _pool["executor"], None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+@contextmanager
+def spooled_archive(file):
+    """
+    Path of a zip on disk for the worker processes, uploads and buffers are
+    copied to a temporary file block by block. file can be a path.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        yield os.fspath(file)
+        return
+    path = getattr(file, "name", None)
+    if isinstance(path, str) and os.path.isfile(path):
+        yield path
+        return
+    stream = getattr(file, "stream", file)
+    stream.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".zip", dir=SPOOL_DIR) as tmp:
+        shutil.copyfileobj(stream, tmp, HASH_BLOCK_SIZE)
+        tmp.flush()
+        stream.seek(0)
+        yield tmp.name
+
+
+def parse_gas_member(instrument, archive, name, spool_path, chunk_rows=CHUNK_ROWS):
+    """
+    Parse one measurement file of archive into a parquet spool file, one row
+    group per chunk, run in a worker process. Only one chunk is in memory at
+    a time and the data goes back to the parent through the file.
+
+    The instrument is detected from the file header when it is None.
+
+    Returns
+    -------
+    tuple
+        spool_path or None if the file had no data and the parse and tz
+        stage times
+    """
+    metrics = IngestMetrics()
+    writer = None
+    with zipfile.ZipFile(archive) as z, z.open(name) as f:
+        if instrument is None:
+            instrument_class, serial = match_instrument(f.read(DETECT_PREFIX_BYTES))
+            if not serial:
+                raise ValueError("File has no serial in the header.")
+            instrument = instrument_class(serial)
+            f.seek(0)
+        chunks = instrument.read_output_chunks(f, chunk_rows)
+        try:
+            for df in iter_timed(chunks, metrics, "parse"):
+                if df.empty:
+                    continue
+                df = prepare_gas_chunk(df, instrument, metrics)
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(spool_path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    return (spool_path if writer is not None else None), dict(metrics.seconds)
+
+
+def parse_spooled_gas_member(instrument, spool_paths, archive, name):
+    return parse_gas_member(instrument, archive, name, spool_paths[name])
+
+
+def iter_spooled_chunks(spool_path):
+    """Chunks of a spool file written by parse_gas_member, one at a time."""
+    spool = pq.ParquetFile(spool_path)
+    for i in range(spool.num_row_groups):
+        yield spool.read_row_group(i).to_pandas()
+
+
+def parse_protocol_member(chamber_map, archive, name):
+    """Parse one protocol log of archive, run in a worker process."""
+    with zipfile.ZipFile(archive) as z, z.open(name) as f:
+        return process_protocol_file(f, chamber_map)
+
+
+def iter_parsed_members(archive, exts, func, *args, workers=None):
+    """
+    Parse the members of the zip at archive with func in the shared pool.
+
+    Workers get the archive path and the member name and read the member
+    themselves, func(*args, archive, name), so no member data passes
+    through this process. At most two members per worker are in flight.
+
+    Yields
+    ------
+    tuple
+        member name, parsed result and the exception if parsing failed,
+        in order of completion
+    """
+    workers = workers or INGEST_WORKERS
+    with zipfile.ZipFile(archive) as z:
+        members = [m for m in z.namelist() if m.lower().endswith(exts)]
+    if workers <= 1 or len(members) <= 1:
+        for name in members:
+            try:
+                yield name, func(*args, archive, name), None
+            except Exception as e:
+                yield name, None, e
+        return
+
+    pool = ingest_pool()
+    queue = iter(members)
+    pending = {}
+
+    def submit():
+        for name in queue:
+            pending[pool.submit(func, *args, archive, name)] = name
+            if len(pending) >= workers * 2:
+                break
+
+    try:
+        submit()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    yield name, future.result(), None
+                except BrokenProcessPool as e:
+                    reset_ingest_pool()
+                    yield name, None, e
+                except Exception as e:
+                    yield name, None, e
+            submit()
+    finally:
+        # a consumer that stops early leaves no work running
+        for future in pending:
+            future.cancel()
+
+
+def process_measurement_zip(file, instrument, workers=None, metrics=None):
+    """
+    Ingest all measurement files in a zip.
+
+    Members are parsed in parallel, parsed data is pushed through one db
+    connection with one transaction per member. When instrument is None the
+    instrument of each member is detected from its header, so archives can
+    have files from several instruments.
+
+    Parameters
+    ----------
+    file : str, os.PathLike or file-like
+        Path of the zip or a binary file object, e.g. an upload.
+    instrument : Instrument or None
+    workers : int, optional
+        Parser processes, INGEST_WORKERS by default
+    metrics : IngestMetrics, optional
+        Collects stage timings and row counts.
+
+    Returns
+    -------
+    dict
+        Totals of the archive like ingest_measurement_file, members has the
+        report of each member with the error if it failed.
+    """
+    if metrics is not None:
+        metrics.count("bytes", file_size(file))
+    report = mk_report(file_name(file))
+    report["members"] = []
+    with spooled_archive(file) as archive, tempfile.TemporaryDirectory(
+        dir=SPOOL_DIR
+    ) as spool_dir, engine.connect() as conn:
+        with zipfile.ZipFile(archive) as z:
+            members = [m for m in z.namelist() if m.lower().endswith(gas_file_exts)]
+        spool_paths = {
+            name: os.path.join(spool_dir, f"{i}.parquet")
+            for i, name in enumerate(members)
+        }
+        parsed = iter_parsed_members(
+            archive,
+            gas_file_exts,
+            parse_spooled_gas_member,
+            instrument,
+            spool_paths,
+            workers=workers,
+        )
+        for i, (name, result, error) in enumerate(parsed, start=1):
+            member = mk_member_report(name)
+            spool_path = None
+            if error is None:
+                spool_path, seconds = result
+                if metrics is not None:
+                    metrics.merge(seconds, {"files": 1})
+            if spool_path is not None:
+                try:
+                    for df in iter_spooled_chunks(spool_path):
+                        push_gas_frame(df, member, conn, metrics)
+                except Exception as e:
+                    error = e
+                finally:
+                    os.remove(spool_path)
+            if error is not None:
+                member["error"] = str(error)
+                logger.error(f"Failed to ingest {name}: {error}")
+            add_to_report(report, member)
+            report["members"].append(member)
+            logger.info(
+                f"Processed {i}/{len(members)} {name}: "
+                f"pushed {member['pushed_rows']}/{member['in_rows']} rows."
+            )
+    return report
+
+
+protocol_cycle_cols = [
+    "chamber_id",
+    "start_time",
+    "close_offset",
+    "open_offset",
+    "end_offset",
+]
+protocol_pdargs = {
+    "sep": "\t",
+    "names": ["datetime", "id", "state"],
+    "dtype": {
+        "datetime": "str",
+        "id": "str",
+        "state": "str",
+    },
+    "usecols": ["datetime", "id", "state"],
+}
+
+
+def protocol_to_cycles(df, gap=pd.Timedelta(minutes=16)):
+    """
+    Derive measurement cycles from chamber protocol state changes.
+
+    A cycle is a run of rows of one chamber without a gap longer than gap.
+    It needs the states 10 (start/open), 11 (close) and 0 (end).
+
+    NOTE: grouping by chamber first is needed since each cycle's start time
+    is (almost always) the same as the end time of the previous cycle.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        datetime, id and state columns, state as int
+    gap : pd.Timedelta
+        Time between rows of a chamber that starts a new cycle.
+
+    Returns
+    -------
+    pd.DataFrame
+        chamber_id, start_time, close_offset, open_offset and end_offset
+        sorted by start time
+    """
+    df = df.sort_values(["id", "datetime"]).reset_index(drop=True)
+    new_chamber = df["id"].ne(df["id"].shift())
+    new_cycle = df.groupby("id", sort=False)["datetime"].diff() > gap
+    key = (new_chamber | new_cycle).cumsum()
+
+    dt = df["datetime"]
+    state = df["state"]
+    grouped = df.groupby(key, sort=False)
+    cycles = pd.DataFrame(
+        {
+            "chamber_id": grouped["id"].first(),
+            "first": grouped["datetime"].first(),
+            "states": grouped["state"].nunique(),
+            # first 10 is the start
+            "start_time": dt.where(state == 10).groupby(key).first(),
+            # first 11 is the close
+            "close": dt.where(state == 11).groupby(key).first(),
+            # second 10 is the opening, the last one to be sure
+            "open": dt.where(state == 10).groupby(key).last(),
+            # last 0 is the end
+            "end": dt.where(state == 0).groupby(key).last(),
+        }
+    )
+    # needs open, close and deactivate
+    cycles = cycles[cycles["states"] == 3].dropna(
+        subset=["start_time", "close", "open", "end"]
+    )
+    for col, offset in (
+        ("close", "close_offset"),
+        ("open", "open_offset"),
+        ("end", "end_offset"),
+    ):
+        cycles[offset] = (
+            (cycles[col] - cycles["start_time"]).dt.total_seconds().astype(int)
+        )
+    # if any of these are negative there's something wrong
+    offsets = ["close_offset", "open_offset", "end_offset"]
+    cycles = cycles[(cycles[offsets] >= 0).all(axis=1)]
+    cycles = cycles.sort_values("first", kind="stable")
+    return cycles[protocol_cycle_cols].reset_index(drop=True)
+
+
+def process_protocol_file(filedata, chamber_map):
+    df = pd.read_csv(filedata, **protocol_pdargs)
+    df["datetime"] = pd.to_datetime(df["datetime"], format="%d.%m.%Y %H:%M:%S")
+    df["state"] = df["state"].astype(int)
+    df["id"] = df["id"].astype(int)
+
+    dfa = protocol_to_cycles(df)
+    dfa["chamber_id"] = dfa["chamber_id"].astype(str).map(chamber_map)
+    dfa["start_time"] = to_utc(dfa["start_time"])
+
+    return dfa
+
+
+def process_protocol_zip(file, chamber_map, workers=None):
+    """
+    Parse all protocol logs in a zip in parallel, file is a path of the zip
+    or a binary file object.
+
+    Returns
+    -------
+    tuple
+        cycles of all logs as one dataframe and a list of per member reports
+        with the number of cycles and the error if parsing failed
+    """
+    dfa = []
+    members = []
+    with spooled_archive(file) as archive:
+        parsed = iter_parsed_members(
+            archive,
+            protocol_file_exts,
+            parse_protocol_member,
+            chamber_map,
+            workers=workers,
+        )
+        for name, df, error in parsed:
+            member = {"file": name, "cycles": 0, "error": None}
+            if error is not None:
+                member["error"] = str(error)
+                logger.error(f"Failed to parse {name}: {error}")
+            else:
+                member["cycles"] = len(df)
+                dfa.append(df)
+            members.append(member)
+            logger.info(f"Processed {len(members)} logs, {name}")
+    if not dfa:
+        return pd.DataFrame(columns=protocol_cycle_cols), members
+    return pd.concat(dfa, ignore_index=True), members
+
+
+def ingest_cycle_file(file, chamber_map, name=None):
+    """
+    Push cycles from a cycle csv, protocol log or a zip of protocol logs.
+
+    Parameters
+    ----------
+    file : file-like
+    chamber_map : dict
+    name : str, optional
+        Original file name, the type is read from its extension
+
+    Returns
+    -------
+    dict
+        report like ingest_measurement_file, zips have the member reports
+    """
+    name = name or file_name(file) or ""
+    ext = name.rsplit(".", 1)[-1].lower()
+    members = None
+    if ext == "csv":
+        df = pd.read_csv(file)
+        df["start_time"] = to_utc(pd.to_datetime(df["start_time"], format="ISO8601"))
+    elif ext == "log":
+        df = process_protocol_file(file, chamber_map)
+    elif ext == "zip":
+        df, members = process_protocol_zip(file, chamber_map)
+    else:
+        raise ValueError(f"Unsupported cycle file {name}")
+    pushed_data = df_to_cycle_table(df)
+    report = frame_report(name, df, "start_time", pushed_data)
+    if members is not None:
+        report["members"] = members
+    return report
+
+
+def ingest_meteo_file(file, source):
+    """Push a meteo csv with datetime in local time."""
+    df = pd.read_csv(file)
+    df["datetime"] = to_utc(pd.to_datetime(df["datetime"], format="ISO8601"))
+    df["source"] = source
+    pushed_data = df_to_meteo_table(df)
+    return frame_report(file_name(file), df, "datetime", pushed_data)
+
+
+def ingest_volume_file(file):
+    """Push a chamber volume csv with datetime in local time."""
+    df = pd.read_csv(file)
+    df["datetime"] = to_utc(pd.to_datetime(df["datetime"], format="ISO8601"))
+    df["chamber_id"] = df["chamber_id"].astype(str)
+    df["chamber_height"] = df["chamber_height"].astype(float)
+    pushed_data = df_to_volume_table(df)
+    return frame_report(file_name(file), df, "datetime", pushed_data)
+
+
+def ingest_file(
+    file,
+    kind,
+    name,
+    instrument=None,
+    chamber_map=None,
+    source=None,
+    metrics=None,
+    force=False,
+):
+    """
+    Ingest an open binary file unless it is already in the ingest registry.
+
+    Parameters
+    ----------
+    file : file-like
+    kind : str
+        gas, cycle, meteo or volume
+    name : str
+        Original file name, the file type is read from its extension
+    instrument : Instrument, optional
+        Instrument of gas files
+    chamber_map : dict, optional
+        Chamber id mapping for protocol logs
+    source : str, optional
+        Source of meteo files
+    metrics : IngestMetrics, optional
+        Collects stage timings of gas files
+    force : bool, optional
+        Ingest the file even if it is in the registry
+
+    Returns
+    -------
+    tuple
+        report and None, or None and the registry row of an identical file
+        that was already ingested. report["covered"] tells if earlier files
+        already covered its time span.
+    """
+    file_hash, size, known = check_ingested(file)
+    if known is not None and not force:
+        return None, known
+    if kind == "gas":
+        if name.lower().endswith(".zip"):
+            report = process_measurement_zip(file, instrument, metrics=metrics)
+        else:
+            report = ingest_measurement_file(file, instrument, metrics=metrics)
+    elif kind == "cycle":
+        report = ingest_cycle_file(file, chamber_map, name)
+    elif kind == "meteo":
+        report = ingest_meteo_file(file, source)
+    elif kind == "volume":
+        report = ingest_volume_file(file)
+    else:
+        raise ValueError(f"Unknown file kind {kind}")
+    report["file"] = name
+    report["covered"] = record_ingest(
+        file_hash,
+        size,
+        kind,
+        report,
+        serial=instrument.serial if instrument is not None else None,
+        meteo_source=source,
+    )
+    return report, None
@@ -0,0 +1,128 @@
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+from .metrics import observe_ingest
+from .tools.stats_store import StatsStore
+
+# stages of the gas ingest pipeline in order
+ingest_stages = ("parse", "tz", "dedup", "transfer", "commit")
+# number of ingests kept for /api/ingest_metrics
+HISTORY_SIZE = 100
+
+
+def new_ingest_totals():
+    return {"seconds": defaultdict(float), "counters": defaultdict(int)}
+
+
+# totals of all ingests under the key None and the latest ingests
+_store = StatsStore(new_ingest_totals, HISTORY_SIZE)
+
+
+class IngestMetrics:
+    """
+    Wall time per ingest stage and volume counters of one ingest.
+
+    NOTE: zip members are parsed in parallel, their parse and tz times are
+    summed over the workers and can be larger than the wall time.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t0)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.seconds[name] += seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def merge(self, seconds=None, counters=None):
+        """Add stage times and counters from e.g. a worker process."""
+        with self._lock:
+            for name, value in (seconds or {}).items():
+                self.seconds[name] += value
+            for name, value in (counters or {}).items():
+                self.counters[name] += value
+
+    def to_dict(self):
+        with self._lock:
+            stages = {
+                name: round(self.seconds[name], 4)
+                for name in ingest_stages
+                if name in self.seconds
+            }
+            return {
+                "wall_s": round(time.perf_counter() - self._start, 4),
+                "stages_s": stages,
+                "counters": dict(self.counters),
+            }
+
+
+def timed(metrics, name):
+    """Context manager timing a stage, does nothing without metrics."""
+    if metrics is None:
+        return nullcontext()
+    return metrics.stage(name)
+
+
+def iter_timed(iterable, metrics, name):
+    """Yield from iterable and time the time spent producing the items."""
+    iterator = iter(iterable)
+    while True:
+        with timed(metrics, name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def record_metrics(name, metrics):
+    """Keep the metrics of a finished ingest for the metrics endpoint."""
+    entry = {"file": name, "finished": time.time(), **metrics.to_dict()}
+    observe_ingest(metrics)
+
+    def add(totals):
+        for stage, value in metrics.seconds.items():
+            totals["seconds"][stage] += value
+        for counter, value in metrics.counters.items():
+            totals["counters"][counter] += value
+
+    _store.update(None, add, entry)
+    return entry
+
+
+def metrics_summary():
+    """
+    Totals and the latest ingests of this process.
+
+    NOTE: every gunicorn worker keeps its own history.
+    """
+
+    def summarize(totals, history):
+        totals = totals.get(None) or new_ingest_totals()
+        return {
+            "totals": {
+                "stages_s": {
+                    name: round(value, 4) for name, value in totals["seconds"].items()
+                },
+                "counters": dict(totals["counters"]),
+            },
+            "recent": history,
+        }
+
+    return _store.read(summarize)
@@ -38,6 +38,13 @@ upload_style = style = {
 }
 
 
+def mk_graph_names(left_settings, right_settings):
+    return [
+        [f"{gas}-plot" for gas in left_settings["value"]],
+        [f"{attribute}-graph" for attribute in right_settings["value"]],
+    ]
+
+
 def mk_main_page(left_settings, right_settings, settings):
     db_instruments = get_instrument_rows_as_dicts()
 
@@ -64,10 +71,7 @@ def mk_main_page(left_settings, right_settings, settings):
         )
         for graph_name in right_settings["value"]
     ]
-    graph_names = [
-        [f"{gas}-plot" for gas in left_settings["value"]],
-        [f"{attribute}-graph" for attribute in right_settings["value"]],
-    ]
+    graph_names = mk_graph_names(left_settings, right_settings)
 
     main_page = html.Div(
         [
@@ -299,8 +303,18 @@ def mk_settings_page(settings_elems, settings_json):
             html.H1("Settings Page"),
             html.Div(
                 [
-                    html.Button("Download calculated fluxes", id="dl-all-button"),
-                    dcc.Download(id="dl-all"),
+                    # streamed by FluxApi, doesn't go through a callback so
+                    # the table is never held in memory
+                    html.A(
+                        html.Button("Download calculated fluxes", id="dl-all-button"),
+                        href="/api/fluxes/?format=csv",
+                        download="calculated_fluxes.csv",
+                    ),
+                    html.A(
+                        html.Button("Download as parquet", id="dl-parquet-button"),
+                        href="/api/fluxes/?format=parquet",
+                        download="calculated_fluxes.parquet",
+                    ),
                 ],
                 style={"padding-bottom": "20px"},
             ),
@@ -333,14 +347,10 @@ def create_layout(layout_json, url):
     left_graphs = settings_json["gas_graphs"]
     right_graphs = settings_json["attribute_graphs"]
 
-    settings_dropdowns, stored_settings = mk_settings(settings_json)
-    settings_page = mk_settings_page(settings_dropdowns, settings_json)
-
-    main_page, graph_names, graphs = mk_main_page(
-        left_graphs,
-        right_graphs,
-        settings_json,
-    )
+    _, stored_settings = mk_settings(settings_json)
+    # the pages query the db, display_page builds them per request so
+    # importing the app runs no queries
+    graph_names = mk_graph_names(left_graphs, right_graphs)
     stored_settings["graph_names"] = graph_names
     logout = html.A("Log out", href="/logout")
 
@@ -368,9 +378,16 @@ def create_layout(layout_json, url):
                 href=f"{url}changepw",
                 style={"padding-right": "15px"},
             ),
+            # shown to admins by show_profiling_link
+            dcc.Link(
+                "Profiling",
+                id="profiling-link",
+                href=f"{url}profiling",
+                style={"display": "none"},
+            ),
             html.Div(logout),
             html.Div(id="page-content"),
         ]
     )
 
-    return layout, main_page, settings_page, graph_names
+    return layout, graph_names
@@ -1,7 +1,5 @@
 import time
-from plotly.graph_objs import Scattergl
 from numpy import isnan
-import plotly.graph_objs as go
 import pandas as pd
 import numpy as np
 from pprint import pprint
@@ -12,20 +10,20 @@ from .tools.gas_funcs import (
     calculate_gas_flux,
     calculate_slope,
 )
-from .data_mgt import get_single_meteo
 from .validation import check_valid_early, check_valid_deferred
 from .data_mgt import (
     gas_table_to_df,
-    flux_to_df,
     single_flux_to_table,
-    get_single_volume,
+    hydrate_cycle,
+    gas_arrays_to_df,
+    CycleHydration,
 )
 from .tools.filter import get_datetime_index
 from .validation import parse_error_codes, error_codes
 from .measuring import instruments
-import logging
+from .tools.logger import get_logger
 
-logger = logging.getLogger("defaultLogger")
+logger = get_logger("engine")
 
 
 class MeasurementCycle:
@@ -40,6 +38,7 @@ class MeasurementCycle:
         data=None,
         conn=None,
         meteo_source=None,
+        hydration=None,
     ):
         self.chamber_id = id
         self.instrument = instrument
@@ -75,8 +74,21 @@ class MeasurementCycle:
         self.updated_height = False
         self.quality_r = 1
         self.quality_r2 = 1
+        # flux row, gas data, meteo and chamber height in one query
+        if hydration is None:
+            hydration = hydrate_cycle(
+                self.start_time,
+                self.end,
+                self.instrument.serial,
+                self.chamber_id,
+                meteo_source,
+                conn,
+            )
+        self._gas_data = gas_arrays_to_df(hydration.gas, self.instrument)
         # init from db if data found
-        if self.check_db():
+        self.from_db = False
+        if self.check_db(hydration.flux):
+            self.from_db = True
             self.lag_end = self.open + pd.Timedelta(seconds=160)
             if self.updated_height:
                 for gas in self.flux_gases:
@@ -86,10 +98,9 @@ class MeasurementCycle:
 
             return
         # BUG: this assumes that a row always has both temp and pressure
-        self.air_temperature, self.air_pressure = get_single_meteo(
-            self.start_time, meteo_source
-        )
-        self.chamber_height = get_single_volume(self.start_time, self.chamber_id)
+        self.air_temperature = hydration.air_temperature
+        self.air_pressure = hydration.air_pressure
+        self.chamber_height = hydration.chamber_height
         logger.debug("No flux in db")
 
         # used to look for the drop indicating the opening of the chamber for
@@ -112,6 +123,45 @@ class MeasurementCycle:
 
         self.get_max(conn=conn)
 
+    @classmethod
+    def from_frame(
+        cls,
+        id,
+        start,
+        close_offset,
+        open_offset,
+        end_offset,
+        instrument,
+        data,
+        air_temperature=None,
+        air_pressure=None,
+        chamber_height=None,
+    ):
+        """
+        Initiate a cycle from gas data without the database, e.g. for
+        benchmarks.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            Gas measurements of the cycle with a UTC datetime index and the
+            instrument's gas columns
+        """
+        gas = {col: data[col].to_numpy() for col in instrument.gas_dtypes}
+        gas["datetime"] = data.index.as_unit("us").asi8
+        hydration = CycleHydration(
+            None, gas, air_temperature, air_pressure, chamber_height
+        )
+        return cls(
+            id,
+            start,
+            close_offset,
+            open_offset,
+            end_offset,
+            instrument,
+            hydration=hydration,
+        )
+
     def manual_lag(self, lag):
         return self.get_max(manual_lag=lag)
 
@@ -124,7 +174,7 @@ class MeasurementCycle:
         if not isinstance(value, (int, np.int64, np.int32)):
             raise ValueError("Error code must be integer.")
 
-        logger.info(value)
+        logger.debug("Setting error code %s", value)
         if value == 0:
             self._error_code = 0  # Reset error code
             self.error_string = ""
@@ -135,8 +185,7 @@ class MeasurementCycle:
             # self._error_code += 1024
         self._error_code = self.set_error_code(value)
         self.error_string = ", ".join(parse_error_codes(self._error_code, error_codes))
-        logger.info(self.error_code)
-        logger.info(self.error_string)
+        logger.debug("Error code %s: %s", self._error_code, self._error_string)
 
     @property
     def error_string(self):
@@ -222,7 +271,7 @@ class MeasurementCycle:
                 self.error_code += 1024
             if value is True:
                 self.error_code = 0
-            logger.info(f"set manual_is_valid to {value}")
+            logger.info("set manual_is_valid to %s", value)
 
         else:
             raise ValueError("is_valid_manual must be a boolean.")
@@ -364,14 +413,18 @@ class MeasurementCycle:
     def validity_checks(self):
         pass
 
-    def check_db(self, conn=None):
+    def check_db(self, flux):
         """
         Initiate measurement from the db representation
+
+        Parameters
+        ----------
+        flux : dict or None
+            flux_table row from hydrate_cycle
         """
-        df = flux_to_df(self.start_time, self.instrument.serial, conn)
-        if df is None or df.empty:
+        if flux is None:
             return False
-        vals = df.iloc[0]
+        vals = flux
 
         start = vals.get("start_time")
 
@@ -421,12 +474,12 @@ class MeasurementCycle:
             "calc_offset_e",
             {f"{gas}": vals.get(f"{gas}_offset_e") for gas in self.flux_gases},
         )
-        self.data = gas_table_to_df(
-            self.start_time, self.end, serial=self.instrument.serial, conn=conn
-        )
-        self.calc_data = gas_table_to_df(
-            self.close, self.open, serial=self.instrument.serial, conn=conn
-        )
+        self.data = self._gas_data
+        self._gas_data = None
+        # gas_table_to_df(close, open) included the row at open
+        close = self.data.index.searchsorted(self.close, side="left")
+        open = self.data.index.searchsorted(self.open, side="right")
+        self.calc_data = self.data.iloc[close:open]
         self.check_no_data()
 
         # logger.debug(self.data)
@@ -441,7 +494,7 @@ class MeasurementCycle:
         pass
 
     def init_measurements(self, all_data):
-        logger.debug(f"Initiating measurement at  {self.start_time}")
+        logger.debug("Initiating measurement at  %s", self.start_time)
         logger.debug(self.start_time)
         logger.debug(self.end)
         start, end = get_datetime_index(all_data, self)
@@ -452,7 +505,7 @@ class MeasurementCycle:
 
         data_len = len(self.data)
         expected_len = (self.end - self.start_time).total_seconds()
-        logger.debug(f"Got data dataframe of length {data_len}")
+        logger.debug("Got data dataframe of length %s", data_len)
         if data_len < expected_len * 0.5:
             self.is_valid = False
             return
@@ -469,20 +522,29 @@ class MeasurementCycle:
             self.is_valid = False
             return
 
-        logger.debug(f"Got calc dataframe length {len(self.calc_data)}")
+        logger.debug("Got calc dataframe length %s", len(self.calc_data))
         self.get_max()
         self.error_code = 0
         self.error_code += check_valid_deferred(self)
 
     def get_data(self, ifdb_dict, conn=None):
         if self.data is None or self.data.empty:
-            logger.debug(f"Getting data from {self.start_time} to {self.end}")
-            self.data = gas_table_to_df(
-                self.start_time, self.end, self.instrument.serial, conn
-            )
+            logger.debug("Getting data from %s to %s", self.start_time, self.end)
+            if getattr(self, "_gas_data", None) is not None:
+                # already fetched by hydrate_cycle
+                self.data = self._gas_data
+                self._gas_data = None
+            else:
+                self.data = gas_table_to_df(
+                    self.start_time,
+                    self.end,
+                    self.instrument.serial,
+                    conn,
+                    instrument=self.instrument,
+                )
             if self.data is None or self.data.empty:
                 return
-            logger.debug(f"Data length {len(self.data)}")
+            logger.debug("Data length %s", len(self.data))
             # self.data.index = pd.to_datetime(self.data["datetime"])
 
             self.error_code += check_valid_early(self)
@@ -528,7 +590,7 @@ class MeasurementCycle:
 
         self.error_code = 0
         self.error_code += check_valid_deferred(self)
-        logger.info(self.error_code)
+        logger.debug("Error code %s", self.error_code)
 
     def get_lagtime(self):
         if self.has_errors is True:
@@ -543,7 +605,7 @@ class MeasurementCycle:
         if data.empty:
             logger.debug("No data for finding lag")
             return
-        logger.debug(f"lag_end dataframe length {len(data)}")
+        logger.debug("lag_end dataframe length %s", len(data))
 
         lagtime_idx = data["CH4"].idxmax()
         logger.debug(lagtime_idx)
@@ -573,7 +635,7 @@ class MeasurementCycle:
             ten_s = pd.Timedelta(seconds=10) + back
             start = open - ten_s
             end = lag_end - ten_s
-            logger.debug(f"Find between {start} {end} ")
+            logger.debug("Find between %s %s ", start, end)
             data = self.get_lag_df(start, end).copy()
             if data.empty:
                 continue
@@ -598,7 +660,7 @@ class MeasurementCycle:
         pass
 
     def calculate_flux(self, gas):
-        logger.debug(f"Calculating {gas} flux.")
+        logger.debug("Calculating %s flux.", gas)
 
         flux = 0
         slope = 0
@@ -608,11 +670,11 @@ class MeasurementCycle:
         self.e = self.start_time + pd.Timedelta(seconds=self.calc_offset_e.get(gas))
         logger.debug(self.s)
         logger.debug(self.e)
-        logger.debug(f"Data length: {len(self.data)}")
+        logger.debug("Data length: %s", len(self.data))
         start, end = get_datetime_index(self.data, self, s_key="s", e_key="e")
         data = self.data.iloc[start:end].copy()
 
-        logger.debug(f"Flux calculation data length: {len(data)}")
+        logger.debug("Flux calculation data length: %s", len(data))
         nullcheck = data[gas].isnull().values.all()
         if data.empty or len(data) == 0 or nullcheck:
             slope = 0
@@ -645,14 +707,14 @@ class MeasurementCycle:
         self.r[gas] = r
         self.r2[gas] = r**2
 
-        logger.debug(f"{gas} flux: {flux}")
+        logger.debug("%s flux: %s", gas, flux)
 
     def get_max_r(self, gas):
         self.max_r_ran += 1
-        logger.debug(f"Running get_max_r for time {self.max_r_ran}")
+        logger.debug("Running get_max_r for time %s", self.max_r_ran)
 
         df = self.calc_data.copy()
-        logger.debug(f"Data length: {len(df)}")
+        logger.debug("Data length: %s", len(df))
         if df.empty:
             logger.debug("No data for calc")
             return
@@ -756,11 +818,14 @@ class MeasurementCycle:
         max_r_offset_e = int((max_r_idx_e - self.start_time).total_seconds())
 
         logger.debug(
-            f"Max R: {max_r}, Offset Start: {max_r_offset_s}, Offset End: {max_r_offset_e}"
+            "Max R: %s, Offset Start: %s, Offset End: %s",
+            max_r,
+            max_r_offset_s,
+            max_r_offset_e,
         )
         logger.debug(max_r_offset_e)
         logger.debug(max_r_offset_s)
-        logger.debug(f"Calculated {len(all_r)} values of r.")
+        logger.debug("Calculated %s values of r.", len(all_r))
 
         self.r[gas] = max_r
         self.r2[gas] = max_r**2
@@ -770,7 +835,7 @@ class MeasurementCycle:
     def calculate_r(self, gas):
         self.s = self.start_time + pd.Timedelta(seconds=self.calc_offset_s.get(gas))
         self.e = self.start_time + pd.Timedelta(seconds=self.calc_offset_e.get(gas))
-        logger.debug(f"Data length: {len(self.data)}")
+        logger.debug("Data length: %s", len(self.data))
         start, end = get_datetime_index(self.data, self, s_key="s", e_key="e")
         data = self.data.iloc[start:end].copy()
         if data.empty:
@@ -781,7 +846,10 @@ class MeasurementCycle:
         self.r2[gas] = r**2
 
     def mk_gas_plot(self, gas, color_key="blue", zoom_to_calc=0):
-        logger.debug(f"Running for {gas}.")
+        # plotly is only needed by the dash app, not by API workers
+        import plotly.graph_objs as go
+
+        logger.debug("Running for %s.", gas)
         color_dict = {"blue": "rgb(14,168,213,0)", "green": "rgba(27,187,11,1)"}
         logger.debug(self.data)
         if self.data[gas].empty or self.data is None or self.data[gas].isnull().all():
@@ -928,9 +996,9 @@ class MeasurementCycle:
             or self.has_errors is True
             or self.is_valid_manual is False
         ):
-            logger.debug(f"measurement.is_valid: {self.is_valid}")
-            logger.debug(f"measurement.has_errors: {self.has_errors}")
-            logger.debug(f"measurement.is_valid_manual: {self.is_valid_manual}")
+            logger.debug("measurement.is_valid: %s", self.is_valid)
+            logger.debug("measurement.has_errors: %s", self.has_errors)
+            logger.debug("measurement.is_valid_manual: %s", self.is_valid_manual)
             fig.update_layout(
                 {
                     "plot_bgcolor": "rgba(255, 223, 223, 1)",
@@ -1,350 +1,411 @@
-from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
 import pandas as pd
-
-
-class Instrument(ABC):
-    """
-    Abstract base class for instruments.
-    Defines the required methods and attributes for any instrument.
-    """
-
-    def __init__(self, model, serial):
-        self.model = model
-        self.serial = serial
-
-    @property
-    @abstractmethod
-    def gases(self):
-        """List of gases measured by the instrument."""
-        pass
-
-    @property
-    @abstractmethod
-    def flux_gases(self):
-        """List of gases measured by the instrument."""
-        pass
-
-    @property
-    @abstractmethod
-    def units(self):
-        """Units for the gases measured."""
-        pass
-
-    @abstractmethod
-    def read_output_file(self, file_path):
-        """Function to read the instrument's output file."""
-        pass
-
-    @abstractmethod
-    def __repr__(self):
-        pass
-
-
-class LI7810(Instrument):
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pc
+
+# default number of rows per chunk when streaming output files
+CHUNK_ROWS = 100_000
+# pyarrow reads files in blocks of this many bytes
+ARROW_BLOCK_SIZE = 1 << 22
+# bytes read from the start of a file to detect the instrument
+DETECT_PREFIX_BYTES = 64 * 1024
+
+# dtypes of gas columns by unit, float32 keeps ~7 significant digits which is
+# more than the analyzers resolve in ppm or ppb
+unit_dtypes = {"ppm": "float32", "ppb": "float32"}
+DIAG_DTYPE = "Int32"
+
+# registered instrument classes by python class name
+instruments = {}
+# python class name: instrument model
+class_model_key = {}
+
+
+@dataclass(frozen=True)
+class InstrumentSpec:
     """
-    Implementation for LI-COR LI-7810 gas analyzer.
+    Declaration of an instrument and its output file.
 
     Attributes
     ----------
-    gases : list
-    List of measured gases
-
+    model : str
+        Instrument model, e.g. LI-7810
+    gases : tuple
+        Measured gases
+    flux_gases : tuple
+        Gases fluxes are calculated for
     units : dict
-    Dictionary of measured gases and their units
-
+        gas: unit
+    date_cols : tuple
+        Columns joined with a space and parsed as the datetime column
+    date_format : str
+        strptime format of the joined date columns, ISO8601 for timestamps
+        that don't have one fixed format
+    separator : str
+    header_rows : int
+        Rows before the column names
+    unit_rows : int
+        Rows between the column names and the data
+    header_model : str, optional
+        Value of the Model: header line, used to detect the instrument
+    diag_col : str
     """
 
-    def __init__(self, serial):
-        # Ensure the base class attributes are initialized
-        model = "LI-7810"
-        super().__init__(model, serial)
-        self._gases = ["CO2", "CH4", "H2O"]
-        self._flux_gases = ["CO2", "CH4"]
-        self._units = {"CO2": "ppm", "CH4": "ppb", "H2O": "ppm"}
-        self.pd_kwargs = {
-            "skiprows": [0, 1, 2, 3, 4, 6],
-            "sep": "\t",
-            "usecols": ["DATE", "TIME", "DIAG", "H2O", "CO2", "CH4"],
-            "dtype": {
-                "CH4": "float",
-                "CO2": "float",
-                "H2O": "float",
-                "DATE": "str",
-                "TIME": "str",
-                "DIAG": "int",
-            },
-            # "index_col": "datetime",
-            # pandas will combine these columns and parse the dates with
-            # date_fromat
-            "parse_dates": {"datetime": ["DATE", "TIME"]},
-            "date_format": "%Y-%m-%d %H:%M:%S",
-        }
-        self.diag_col = "DIAG"
-
-    @property
-    def gases(self):
-        return self._gases
+    model: str
+    gases: tuple
+    flux_gases: tuple
+    units: dict = field(default_factory=dict)
+    date_cols: tuple = ("datetime",)
+    date_format: str = "%Y-%m-%d %H:%M:%S"
+    separator: str = ","
+    header_rows: int = 0
+    unit_rows: int = 0
+    header_model: str = None
+    diag_col: str = "DIAG"
 
     @property
-    def flux_gases(self):
-        return self._flux_gases
+    def columns(self):
+        """Columns read from the file when ingesting, others are skipped."""
+        return tuple(self.date_cols) + (self.diag_col,) + tuple(self.gases)
 
     @property
-    def units(self):
-        return self._units
+    def dtypes(self):
+        dtypes = {gas: "float" for gas in self.gases}
+        dtypes[self.diag_col] = "int"
+        dtypes.update({col: "str" for col in self.date_cols})
+        return dtypes
 
-    def read_output_file(self, file_path):
-        return pd.read_csv(file_path, **self.pd_kwargs)
 
-    def __repr__(self):
-        return f"{self.model}, {self.serial}"
+arrow_types = {
+    "float": pa.float64(),
+    "int": pa.int64(),
+    "str": pa.string(),
+}
 
 
-class LI7810_reduced(Instrument):
+class SpecReader:
     """
-    Implementation for LI-COR LI-7810 gas analyzer and the reduced output file used at oulanka.
-
-    Attributes
-    ----------
-    gases : list
-    List of measured gases
-
-    units : dict
-    Dictionary of measured gases and their units
+    Reads output files of an InstrumentSpec with the pyarrow CSV reader.
 
+    Gases and DIAG are parsed straight into their types and fixed format
+    timestamps with pyarrow strptime, so no python objects are created per
+    row. read keeps the columns the spec doesn't declare, with the types
+    pyarrow infers. chunks feeds gas_table, which has no place for them, so
+    it converts only the spec columns.
     """
 
-    def __init__(self, serial):
-        # Ensure the base class attributes are initialized
-        model = "LI-7810"
-        super().__init__(model, serial)
-        self._gases = ["CO2", "CH4", "H2O"]
-        self._flux_gases = ["CO2", "CH4"]
-        self._units = {"CO2": "ppm", "CH4": "ppb", "H2O": "ppm"}
-        self.pd_kwargs = {
-            "sep": ",",
-            "dtype": {
-                "CH4": "float",
-                "CO2": "float",
-                "H2O": "float",
-                "DIAG": "int",
-                "datetime": "str",
-            },
-            # "index_col": "datetime",
-            # pandas will combine these columns and parse the dates with
-            # date_fromat
-            "parse_dates": ["datetime"],
-            "date_format": "%Y-%m-%d %H:%M:%S",
-        }
-        self.diag_col = "DIAG"
-
-    @property
-    def gases(self):
-        return self._gases
-
-    @property
-    def flux_gases(self):
-        return self._flux_gases
+    def __init__(self, spec):
+        self.spec = spec
+        self.read_options = pa_csv.ReadOptions(
+            skip_rows=spec.header_rows,
+            skip_rows_after_names=spec.unit_rows,
+            block_size=ARROW_BLOCK_SIZE,
+        )
+        self.parse_options = pa_csv.ParseOptions(delimiter=spec.separator)
+        column_types = {col: arrow_types[dtype] for col, dtype in spec.dtypes.items()}
+        self.convert_options = pa_csv.ConvertOptions(
+            include_columns=list(spec.columns), column_types=column_types
+        )
+        self.all_convert_options = pa_csv.ConvertOptions(column_types=column_types)
+
+    def to_frame(self, batches):
+        """Dataframe with a datetime column from record batches."""
+        date_cols = list(self.spec.date_cols)
+        table = pa.Table.from_batches(batches)
+        if len(date_cols) > 1:
+            dates = pc.binary_join_element_wise(
+                *[table[col] for col in date_cols], " "
+            )
+        else:
+            dates = table[date_cols[0]]
+        table = table.drop_columns(date_cols)
+        if self.spec.date_format == "ISO8601":
+            df = table.to_pandas()
+            df["datetime"] = pd.to_datetime(dates.to_pandas(), format="ISO8601")
+            return df
+        dates = pc.strptime(dates, format=self.spec.date_format, unit="s")
+        return table.append_column("datetime", dates).to_pandas()
+
+    def read(self, file):
+        """Read the whole file with all of its columns."""
+        table = pa_csv.read_csv(
+            file,
+            read_options=self.read_options,
+            parse_options=self.parse_options,
+            convert_options=self.all_convert_options,
+        )
+        return self.to_frame(table.to_batches())
+
+    def chunks(self, file, chunk_rows=CHUNK_ROWS):
+        """
+        Yield the spec columns of the file in dataframes of about chunk_rows
+        rows.
+        """
+        reader = pa_csv.open_csv(
+            file,
+            read_options=self.read_options,
+            parse_options=self.parse_options,
+            convert_options=self.convert_options,
+        )
+        batches, rows = [], 0
+        for batch in reader:
+            batches.append(batch)
+            rows += batch.num_rows
+            if rows >= chunk_rows:
+                yield self.to_frame(batches)
+                batches, rows = [], 0
+        if rows:
+            yield self.to_frame(batches)
+
+
+def register_instrument(spec):
+    """
+    Class decorator that registers an Instrument subclass with its spec.
 
-    @property
-    def units(self):
-        return self._units
+    The class name is the python_class stored in instrument_table.
+    """
 
-    def read_output_file(self, file_path):
-        return pd.read_csv(file_path, **self.pd_kwargs)
+    def register(cls):
+        cls.spec = spec
+        cls.reader = SpecReader(spec)
+        # signature used by detect_instrument
+        cls.header_model = spec.header_model
+        cls.separator = spec.separator
+        cls.signature_columns = frozenset(spec.columns)
+        instruments[cls.__name__] = cls
+        class_model_key[cls.__name__] = spec.model
+        return cls
 
-    def __repr__(self):
-        return f"{self.model}, {self.serial}"
+    return register
 
 
-class LI7820(Instrument):
+class Instrument:
     """
-    Implementation for LI-COR LI-7820 gas analyzer.
-
-    Attributes
-    ----------
-    gases : list
-    List of measured gases
-
-    units : dict
-    Dictionary of measured gases and their units
+    Base class for instruments, subclasses are declared with
+    register_instrument and get their attributes and readers from the spec.
 
+    header_model, separator and signature_columns describe the output file
+    for detect_instrument: the value of the Model: header line (None for
+    files without the LI-COR header), the column separator and the columns
+    the header row has to contain.
     """
 
+    spec = None
+    reader = None
+    header_model = None
+    separator = ","
+    signature_columns = frozenset()
+
     def __init__(self, serial):
-        model = "LI-7820"
-        super().__init__(model, serial)
-        self._gases = ["N2O", "H2O"]
-        self._flux_gases = ["N2O"]
-        self._units = {"N2O": "ppb", "H2O": "ppm"}
-        self.pd_kwargs = {
-            "skiprows": [0, 1, 2, 3, 4, 6],
-            "sep": "\t",
-            "usecols": ["DATE", "TIME", "DIAG", "H2O", "N2O"],
-            "dtype": {
-                "N2O": "float",
-                "H2O": "float",
-                "DATE": "str",
-                "TIME": "str",
-                "DIAG": "int",
-            },
-            # "index_col": "datetime",
-            # pandas will combine these columns and parse the dates with
-            # date_fromat
-            "parse_dates": {"datetime": ["DATE", "TIME"]},
-            "date_format": "%Y-%m-%d %H:%M:%S",
-        }
-        self.diag_col = "DIAG"
+        self.model = self.spec.model
+        self.serial = serial
+        self.diag_col = self.spec.diag_col
 
     @property
     def gases(self):
-        return self._gases
+        """List of gases measured by the instrument."""
+        return list(self.spec.gases)
 
     @property
     def flux_gases(self):
-        return self._flux_gases
+        """List of gases fluxes are calculated for."""
+        return list(self.spec.flux_gases)
 
     @property
     def units(self):
-        return self._units
-
-    def read_output_file(self, file_path):
-        return pd.read_csv(file_path, **self.pd_kwargs)
+        """Units for the gases measured."""
+        return dict(self.spec.units)
 
-    def __repr__(self):
-        return f"{self.model}, {self.serial}"
+    @property
+    def gas_dtypes(self):
+        """Compact dtypes of the gas and DIAG columns from gases and units."""
+        dtypes = {
+            gas: unit_dtypes.get(self.units.get(gas), "float64") for gas in self.gases
+        }
+        dtypes[self.diag_col] = DIAG_DTYPE
+        return dtypes
 
+    def read_output_file(self, file_path):
+        """Read the instrument's output file, with the undeclared columns."""
+        return self.reader.read(file_path)
 
-class LI7820_reduced(Instrument):
-    """
-    Implementation for LI-COR LI-7820 gas analyzer and the reduced output file used at oulanka.
+    def read_output_chunks(self, file_path, chunk_rows=CHUNK_ROWS):
+        """
+        Read the instrument's output file in chunks of chunk_rows rows so
+        that the whole file is never in memory.
 
-    Attributes
-    ----------
-    gases : list
-    List of measured gases
+        Yields
+        ------
+        pd.DataFrame
+            The spec columns, the ones gas_table stores.
+        """
+        yield from self.reader.chunks(file_path, chunk_rows)
 
-    units : dict
-    Dictionary of measured gases and their units
+    def __repr__(self):
+        return f"{self.model}, {self.serial}"
 
-    """
 
-    def __init__(self, serial):
-        # Ensure the base class attributes are initialized
-        model = "LI-7820"
-        super().__init__(model, serial)
-        self._gases = ["N2O", "H2O"]
-        self._flux_gases = ["N2O"]
-        self._units = {"N2O": "ppb", "H2O": "ppm"}
-        self.pd_kwargs = {
-            "sep": ",",
-            "dtype": {
-                "datetime": "str",
-                "DIAG": "int",
-                "H2O": "float",
-                "N2O": "float",
-            },
-            # "index_col": "datetime",
-            # pandas will combine these columns and parse the dates with
-            # date_fromat
-            # "parse_dates": ["datetime"],
-            # "date_format": "ISO8601",
-            # "date_format": "%Y-%m-%d %H:%M:%S",
-        }
-        self.diag_col = "DIAG"
+# LI-COR raw output files have 5 header rows, the column names on the DATAH
+# row and units on the DATAU row
+licor_raw = {
+    "date_cols": ("DATE", "TIME"),
+    "separator": "\t",
+    "header_rows": 5,
+    "unit_rows": 1,
+}
 
-    @property
-    def gases(self):
-        return self._gases
 
-    @property
-    def flux_gases(self):
-        return self._flux_gases
+@register_instrument(
+    InstrumentSpec(
+        model="LI-7810",
+        gases=("CO2", "CH4", "H2O"),
+        flux_gases=("CO2", "CH4"),
+        units={"CO2": "ppm", "CH4": "ppb", "H2O": "ppm"},
+        header_model="LI-7810",
+        **licor_raw,
+    )
+)
+class LI7810(Instrument):
+    """LI-COR LI-7810 gas analyzer."""
 
-    @property
-    def units(self):
-        return self._units
 
-    def read_output_file(self, file_path):
-        df = pd.read_csv(file_path, **self.pd_kwargs)
-        print(df)
-        df["datetime"] = pd.to_datetime(df["datetime"], format="ISO8601")
-        return df
-
-    def __repr__(self):
-        return f"{self.model}, {self.serial}"
+@register_instrument(
+    InstrumentSpec(
+        model="LI-7810",
+        gases=("CO2", "CH4", "H2O"),
+        flux_gases=("CO2", "CH4"),
+        units={"CO2": "ppm", "CH4": "ppb", "H2O": "ppm"},
+    )
+)
+class LI7810_reduced(Instrument):
+    """LI-COR LI-7810 gas analyzer and the reduced output file used at oulanka."""
+
+
+@register_instrument(
+    InstrumentSpec(
+        model="LI-7820",
+        gases=("N2O", "H2O"),
+        flux_gases=("N2O",),
+        units={"N2O": "ppb", "H2O": "ppm"},
+        header_model="LI-7820",
+        **licor_raw,
+    )
+)
+class LI7820(Instrument):
+    """LI-COR LI-7820 gas analyzer."""
+
+
+@register_instrument(
+    InstrumentSpec(
+        model="LI-7820",
+        gases=("N2O", "H2O"),
+        flux_gases=("N2O",),
+        units={"N2O": "ppb", "H2O": "ppm"},
+        date_format="ISO8601",
+    )
+)
+class LI7820_reduced(Instrument):
+    """LI-COR LI-7820 gas analyzer and the reduced output file used at oulanka."""
+
+
+@register_instrument(
+    InstrumentSpec(
+        model="LI-custom",
+        gases=("CH4", "CO2", "N2O", "H2O"),
+        flux_gases=("CH4", "CO2", "N2O"),
+        units={"CO2": "ppm", "CH4": "ppb", "H2O": "ppm", "N2O": "ppb"},
+        date_format="ISO8601",
+    )
+)
+class LIcustom(Instrument):
+    """Combined output of several LI-COR analyzers."""
 
 
-class LIcustom(Instrument):
+def gas_dtypes(instrument=None):
     """
-    Implementation for LI-COR LI-7820 gas analyzer.
+    dtypes of a gas dataframe read from gas_table.
 
-    Attributes
+    Parameters
     ----------
-    gases : list
-    List of measured gases
+    instrument : Instrument, optional
+        Only the columns this instrument measures, otherwise all gas columns
+        of all instruments.
+
+    Returns
+    -------
+    dict
+        column: dtype
+    """
+    if instrument is not None:
+        return instrument.gas_dtypes
+    dtypes = {}
+    for instrument_class in instruments.values():
+        dtypes.update(instrument_class("").gas_dtypes)
+    return dtypes
 
-    units : dict
-    Dictionary of measured gases and their units
 
+def match_instrument(prefix):
     """
+    Match the start of an output file against the instrument signatures.
 
-    def __init__(self, serial):
-        model = "LI-custom"
-        super().__init__(model, serial)
-        self._gases = ["CH4", "CO2", "N2O", "H2O"]
-        self._flux_gases = ["CH4", "CO2", "N2O"]
-        self._units = {"CO2": "ppm", "CH4": "ppb", "H2O": "ppm", "N2O": "ppb"}
-        self.pd_kwargs = {
-            "sep": ",",
-            "dtype": {
-                "N2O": "float",
-                "H2O": "float",
-                "CH4": "float",
-                "CO2": "float",
-                "DATETIME": "str",
-                "DIAG": "int",
-            },
-            # "index_col": "datetime",
-            # pandas will combine these columns and parse the dates with
-            # date_fromat
-            # "parse_dates": {"datetime": ["DATE", "TIME"]},
-            # "date_format": "%Y-%m-%d %H:%M:%S",
+    Parameters
+    ----------
+    prefix : bytes
+        First bytes of the file, a partial last line is ignored.
+
+    Returns
+    -------
+    tuple
+        Instrument class and the serial from the header, None if the file
+        has no header
+    """
+    lines = prefix.decode("utf-8", errors="replace").splitlines()
+    if len(lines) > 1 and not prefix.endswith(b"\n"):
+        lines = lines[:-1]
+    header = {}
+    for line in lines:
+        key, sep, value = line.partition("\t")
+        if not sep or not key.endswith(":"):
+            break
+        header[key] = value.strip()
+    model = header.get("Model:")
+    # LI-COR files have the column names on the DATAH row
+    column_line = next(
+        (line for line in lines if line.startswith("DATAH")),
+        lines[len(header)] if len(lines) > len(header) else "",
+    )
+
+    candidates = []
+    for instrument_class in instruments.values():
+        if instrument_class.header_model != model:
+            continue
+        columns = {
+            col.strip().lower()
+            for col in column_line.split(instrument_class.separator)
         }
-        self.diag_col = "DIAG"
+        signature = {col.lower() for col in instrument_class.signature_columns}
+        if signature <= columns:
+            candidates.append(instrument_class)
+    if not candidates:
+        raise ValueError("Couldn't detect the instrument from the file header.")
+    # the most specific signature wins, e.g. LIcustom over LI7810_reduced
+    best = max(candidates, key=lambda cls: len(cls.signature_columns))
+    return best, header.get("SN:")
 
-    @property
-    def gases(self):
-        return self._gases
-
-    @property
-    def flux_gases(self):
-        return self._flux_gases
-
-    @property
-    def units(self):
-        return self._units
-
-    def read_output_file(self, file_path):
-        df = pd.read_csv(file_path, **self.pd_kwargs)
-        df["datetime"] = pd.to_datetime(df["datetime"], format="ISO8601")
-        return df
-
-    def __repr__(self):
-        return f"{self.model}, {self.serial}"
 
+def detect_instrument(file, prefix_bytes=DETECT_PREFIX_BYTES):
+    """
+    Detect the instrument of an output file from its first prefix_bytes
+    bytes, the file position is restored.
 
-instruments = {
-    "LI7810": LI7810,
-    "LI7810_reduced": LI7810_reduced,
-    "LI7820": LI7820,
-    "LI7820_reduced": LI7820_reduced,
-    "LIcustom": LIcustom,
-}
-class_model_key = {
-    "LI7810": "LI-7810",
-    "LI7810_reduced": "LI-7810",
-    "LI7820": "LI-7820",
-    "LI7820_reduced": "LI-7820",
-    "LIcustom": "LI-custom",
-}
+    Returns
+    -------
+    tuple
+        Instrument class and serial or None
+    """
+    stream = getattr(file, "stream", file)
+    pos = stream.tell()
+    prefix = stream.read(prefix_bytes)
+    stream.seek(pos)
+    return match_instrument(prefix)
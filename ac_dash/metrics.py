@@ -0,0 +1,147 @@
+import os
+import hmac
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Prometheus metrics of the app. Under gunicorn every worker writes its
+# values to files in PROMETHEUS_MULTIPROC_DIR and /metrics sums them, the
+# directory has to exist and be emptied before the server starts, see
+# gunicorn.conf.py. Without it the metrics are those of the one process.
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# bearer token required by /metrics, without one the endpoint is off unless
+# AC_DASH_METRICS_OPEN opens it, e.g. when only the internal network can
+# reach the server
+METRICS_TOKEN = os.getenv("AC_DASH_METRICS_TOKEN")
+METRICS_OPEN = os.getenv("AC_DASH_METRICS_OPEN", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+cache_lookups = Counter(
+    "ac_dash_cache_lookups_total",
+    "Lookups of in-process caches by result",
+    ["cache", "result"],
+)
+cycle_inits = Counter(
+    "ac_dash_cycle_inits_total",
+    "Initiated measurement cycles, from flux_table or calculated",
+    ["source"],
+)
+cycle_init_seconds = Histogram(
+    "ac_dash_cycle_init_seconds",
+    "Time to initiate one measurement cycle",
+    ["source"],
+    buckets=latency_buckets,
+)
+ingest_rows = Counter(
+    "ac_dash_ingest_rows_total",
+    "Gas rows ingested, pushed or dropped as duplicates",
+    ["result"],
+)
+ingest_bytes = Counter("ac_dash_ingest_bytes_total", "Bytes of ingested gas files")
+ingest_stage_seconds = Histogram(
+    "ac_dash_ingest_stage_seconds",
+    "Time per stage of one gas file ingest",
+    ["stage"],
+    buckets=latency_buckets,
+)
+pool_checkout_seconds = Histogram(
+    "ac_dash_db_pool_checkout_seconds",
+    "Wait for a connection from the pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+pool_timeouts = Counter(
+    "ac_dash_db_pool_timeouts_total", "Pool checkouts that timed out"
+)
+pool_checked_out = Gauge(
+    "ac_dash_db_pool_checked_out",
+    "Connections checked out of the pool",
+    multiprocess_mode="livesum",
+)
+callback_seconds = Histogram(
+    "ac_dash_callback_seconds",
+    "Dash callback latency including serialization",
+    ["callback"],
+    buckets=latency_buckets,
+)
+# calls made while callback profiling is on, the profiling page reads these
+profiled_prefix = "ac_dash_profiled_callback_"
+profiled_seconds = Histogram(
+    f"{profiled_prefix}seconds",
+    "Latency of profiled dash callback calls",
+    ["callback"],
+    buckets=latency_buckets,
+)
+profiled_errors = Counter(
+    f"{profiled_prefix}errors", "Profiled calls that raised", ["callback"]
+)
+profiled_queries = Counter(
+    f"{profiled_prefix}queries",
+    "Queries of profiled calls, counted while query profiling is on",
+    ["callback"],
+)
+profiled_query_seconds = Counter(
+    f"{profiled_prefix}query_seconds", "Query time of profiled calls", ["callback"]
+)
+profiled_payload_bytes = Counter(
+    f"{profiled_prefix}payload_bytes", "Response size of profiled calls", ["callback"]
+)
+profiled_stage_seconds = Counter(
+    f"{profiled_prefix}stage_seconds",
+    "Time in the stages of profiled calls",
+    ["callback", "stage"],
+)
+
+
+def observe_ingest(metrics):
+    """Add the stage times and counters of a finished IngestMetrics."""
+    for stage, seconds in metrics.seconds.items():
+        ingest_stage_seconds.labels(stage).observe(seconds)
+    counters = metrics.counters
+    ingest_rows.labels("pushed").inc(counters.get("pushed_rows", 0))
+    ingest_rows.labels("duplicate").inc(counters.get("duplicate_rows", 0))
+    ingest_bytes.inc(counters.get("bytes", 0))
+
+
+def observe_cycle_init(m, seconds):
+    source = "flux_table" if m.from_db else "calculated"
+    cycle_inits.labels(source).inc()
+    cycle_init_seconds.labels(source).observe(seconds)
+
+
+def metrics_registry():
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def init_metrics(server):
+    """Add the /metrics endpoint in the prometheus text format."""
+    from flask import Response, request
+
+    @server.route("/metrics")
+    def metrics_endpoint():
+        if METRICS_TOKEN:
+            auth = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(auth, f"Bearer {METRICS_TOKEN}"):
+                return Response("Unauthorized", status=401)
+        elif not METRICS_OPEN:
+            return Response("Not Found", status=404)
+        return Response(
+            generate_latest(metrics_registry()), mimetype=CONTENT_TYPE_LATEST
+        )
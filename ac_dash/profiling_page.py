@@ -0,0 +1,137 @@
+import pandas as pd
+from dash import html, dcc, dash_table
+
+from .tools.profiling import profiling_summary
+from .tools.query_profiler import query_summary
+
+callback_cols = [
+    "callback",
+    "calls",
+    "errors",
+    "mean_ms",
+    "p95_ms",
+    "mean_queries",
+    "mean_query_ms",
+    "mean_payload_bytes",
+    "stages",
+]
+slow_cols = [
+    "started",
+    "callback",
+    "ms",
+    "queries",
+    "query_ms",
+    "payload_bytes",
+    "stages",
+    "error",
+]
+query_cols = ["fingerprint", "count", "total_ms", "mean_ms", "max_ms", "mean_rows"]
+violation_cols = ["time", "scope", "queries", "budget", "ms", "top"]
+
+
+def format_time(timestamp):
+    return pd.Timestamp(timestamp, unit="s", tz="UTC").isoformat(timespec="seconds")
+
+
+def format_stages(stages_ms):
+    return ", ".join(
+        f"{name} {ms}" for name, ms in sorted(stages_ms.items(), key=lambda x: -x[1])
+    )
+
+
+def profiling_rows(summary):
+    """Rows of the callback and slow callback tables from profiling_summary."""
+    callbacks = [
+        {
+            "callback": name,
+            **{col: stats.get(col) for col in callback_cols[1:-1]},
+            "stages": format_stages(stats["mean_stages_ms"]),
+        }
+        for name, stats in sorted(
+            summary["callbacks"].items(), key=lambda x: -x[1]["total_ms"]
+        )
+    ]
+    slow = [
+        {
+            **{col: entry.get(col) for col in slow_cols},
+            "started": format_time(entry["started"]),
+            "stages": format_stages(entry["stages_ms"]),
+        }
+        for entry in summary["slow"]
+    ]
+    return callbacks, slow
+
+
+def query_rows(summary):
+    """Rows of the query fingerprint and budget violation tables."""
+    violations = [
+        {
+            **{col: entry.get(col) for col in violation_cols},
+            "time": format_time(entry["time"]),
+            "top": "; ".join(
+                f"{top['count']}x {top['fingerprint'][:120]}" for top in entry["top"]
+            ),
+        }
+        for entry in summary["violations"]
+    ]
+    return summary["fingerprints"], violations
+
+
+def mk_table(id, cols, rows):
+    return dash_table.DataTable(
+        id=id,
+        columns=[{"name": col, "id": col} for col in cols],
+        data=rows,
+        sort_action="native",
+        style_cell={"textAlign": "left", "font-size": "14px"},
+    )
+
+
+def mk_profiling_page():
+    summary = profiling_summary()
+    callbacks, slow = profiling_rows(summary)
+    queries = query_summary()
+    fingerprints, violations = query_rows(queries)
+    toggles = [
+        name
+        for name, enabled in (
+            ("callbacks", summary["enabled"]),
+            ("queries", queries["enabled"]),
+        )
+        if enabled
+    ]
+    return html.Div(
+        [
+            html.H1("Callback profiling"),
+            html.P(
+                "Times of the dash callbacks of all workers since the last "
+                "reset, stages in ms. Stages can be nested so they don't add "
+                "up to the total. Queries are counted while query profiling "
+                "is on, the query tables are those of this worker."
+            ),
+            dcc.Checklist(
+                id="profiling-toggle",
+                options=[
+                    {"label": "Callback profiling", "value": "callbacks"},
+                    {"label": "Query profiling", "value": "queries"},
+                ],
+                value=toggles,
+            ),
+            html.Button("Refresh", id="profiling-refresh"),
+            html.Button("Reset", id="profiling-reset"),
+            html.H3("Callbacks"),
+            html.Div(
+                mk_table("profiling-callbacks", callback_cols, callbacks),
+                id="profiling-callbacks-div",
+            ),
+            html.H3(f"Callbacks slower than {summary['slow_callback_ms']:.0f} ms"),
+            html.Div(
+                mk_table("profiling-slow", slow_cols, slow),
+                id="profiling-slow-div",
+            ),
+            html.H3("Queries by fingerprint"),
+            mk_table("profiling-queries", query_cols, fingerprints),
+            html.H3(f"Requests over the query budget of {queries['budget']}"),
+            mk_table("profiling-violations", violation_cols, violations),
+        ]
+    )
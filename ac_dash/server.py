@@ -6,24 +6,13 @@ from flask_login import UserMixin, LoginManager
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import text
 from .db import engine
+from .tools.query_profiler import init_query_profiler
+from .metrics import init_metrics
 
 
 from .users_mgt.users_mgt import (
     db,
     User as base,
-    mk_user_table,
-    add_user,
-    show_users,
-)
-
-from .data_mgt import (
-    mk_flux_table,
-    mk_gas_table,
-    mk_cycle_table,
-    mk_volume_table,
-    mk_instrument_table,
-    apply_volume_table_trigger,
-    init_instruments,
 )
 
 
@@ -33,6 +22,10 @@ logger = logging.getLogger("defaultLogger")
 server = Flask(__name__, static_folder="static")
 server.config.from_object(os.getenv("FLASK_CONFIG", "default_config_module"))
 api = Api(server)
+# per request query fingerprints when query profiling is on
+init_query_profiler(server)
+# prometheus metrics at /metrics
+init_metrics(server)
 
 # initiate DB
 db.init_app(server)
@@ -43,15 +36,7 @@ class User(UserMixin, base):
     pass
 
 
-mk_user_table()
-mk_flux_table()
-mk_gas_table()
-mk_cycle_table()
-mk_volume_table()
-mk_instrument_table()
-apply_volume_table_trigger()
-
-init_instruments()
+# tables, triggers and instruments are created by manage.py bootstrap
 
 
 # initiate login manager
@@ -1,7 +1,6 @@
 import logging
 import json
 from dash import dcc, html
-from .utils import load_config
 from .data_mgt import get_distinct_meteo_source, get_instrument_rows_as_dicts
 
 logger = logging.getLogger("defaultLogger")
@@ -20,7 +19,6 @@ upload_style = style = {
     "margin": "10px",
     "padding": "10px",  # Add space inside the box
 }
-_, _, settings, _ = load_config()
 
 
 def mk_init_tabs():
@@ -162,6 +160,18 @@ def mk_init_tabs():
                                                         style=upload_style,
                                                     ),
                                                 ),
+                                                # large files are sent in parts by
+                                                # assets/chunked_upload.js
+                                                html.Button(
+                                                    "Upload a large file",
+                                                    id="chunked-upload-gas",
+                                                    className="chunked-upload",
+                                                    **{
+                                                        "data-kind": "gas",
+                                                        "data-status": "chunked-upload-gas-status",
+                                                    },
+                                                ),
+                                                html.Div(id="chunked-upload-gas-status"),
                                             ],
                                             style={
                                                 "display": "flex",
@@ -0,0 +1,315 @@
+import io
+import gc
+import os
+import json
+import time
+import logging
+import platform
+import subprocess
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from .synthetic import (
+    SyntheticSite,
+    day_cycles,
+    gas_frame,
+    protocol_frame,
+    write_protocol_file,
+)
+
+logger = logging.getLogger("defaultLogger")
+
+# cycle layouts, offsets in seconds from the cycle start
+cycle_sizes = {
+    "short": {"close_offset": 180, "open_offset": 480, "end_offset": 540},
+    "long": {"close_offset": 300, "open_offset": 1500, "end_offset": 1620},
+}
+# noise multipliers of the synthetic gas series
+noise_levels = {"clean": 1.0, "noisy": 8.0}
+flux_benchmarks = (
+    "init",
+    "get_max",
+    "get_max_r",
+    "get_lagtime",
+    "check_valid_deferred",
+    "calculate_flux",
+)
+percentiles = (50, 90, 99)
+BENCHMARK_SERIAL = "BENCHMARK"
+
+
+def synthetic_cycles(size, noise, n_cycles, seed=0):
+    """
+    Fixed synthetic cycles of one size and noise level.
+
+    Returns
+    -------
+    list
+        MeasurementCycle constructor arguments for from_frame
+    """
+    from ..measuring import instruments
+
+    site = SyntheticSite(
+        chambers=12, noise=noise_levels[noise], seed=seed, **cycle_sizes[size]
+    )
+    day = site.first_day
+    cycles = day_cycles(site, day).head(n_cycles)
+    gas = gas_frame(site, day, cycles)
+    gas.index = pd.DatetimeIndex(
+        gas.pop("datetime").dt.tz_localize("UTC"), name="datetime"
+    )
+    instrument = instruments["LI7810"](BENCHMARK_SERIAL)
+    args = []
+    for cycle in cycles.itertuples():
+        start = cycle.start_time.tz_localize("UTC")
+        end = start + pd.Timedelta(seconds=site.end_offset)
+        data = gas.iloc[gas.index.searchsorted(start) : gas.index.searchsorted(end)]
+        args.append(
+            {
+                "id": str(cycle.id),
+                "start": start,
+                "close_offset": site.close_offset,
+                "open_offset": site.open_offset,
+                "end_offset": site.end_offset,
+                "instrument": instrument,
+                "data": data,
+            }
+        )
+    return args
+
+
+def latency_stats(seconds):
+    """Percentiles, mean and evaluations per second of per call latencies."""
+    seconds = np.asarray(seconds)
+    total = seconds.sum()
+    stats = {
+        f"p{p}_ms": round(float(np.percentile(seconds, p)) * 1000, 4)
+        for p in percentiles
+    }
+    stats["mean_ms"] = round(float(seconds.mean()) * 1000, 4)
+    stats["evals_per_s"] = round(len(seconds) / total, 2) if total else None
+    stats["n"] = len(seconds)
+    return stats
+
+
+def run_benchmark(func, items, repeat=1):
+    """
+    Time func on every item and measure the peak memory of one pass.
+
+    Memory is measured in a separate pass since tracemalloc slows down
+    the timed calls.
+    """
+    seconds = []
+    for _ in range(repeat):
+        for item in items:
+            setup = func(item)
+            gc.disable()
+            t0 = time.perf_counter()
+            setup()
+            seconds.append(time.perf_counter() - t0)
+            gc.enable()
+
+    tracemalloc.start()
+    for item in items:
+        func(item)()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = latency_stats(seconds)
+    stats["peak_memory_kb"] = round(peak / 1024, 1)
+    return stats
+
+
+def flux_case(name, cycle_args):
+    """
+    Return a function that resets the cycle of the given arguments and
+    returns the benchmarked call, so only the call itself is timed. Cycles
+    are initiated once, except for the init benchmark.
+    """
+    from ..measurement import MeasurementCycle
+    from ..validation import check_valid_deferred
+
+    if name == "init":
+        return lambda args: lambda: MeasurementCycle.from_frame(**args)
+
+    cycles = {id(args): MeasurementCycle.from_frame(**args) for args in cycle_args}
+
+    def prepare(args):
+        m = cycles[id(args)]
+        if name == "get_max":
+            m.got_lag = None
+            m.lagtime = 0
+            return m.get_max
+        if name == "get_lagtime":
+            m.got_lag = None
+            return m.get_lagtime
+        if name == "check_valid_deferred":
+            return lambda: check_valid_deferred(m)
+        gas = m.flux_gases[0]
+        if name == "get_max_r":
+            return lambda: m.get_max_r(gas)
+        return lambda: m.calculate_flux(gas)
+
+    return prepare
+
+
+def flux_benchmarks_for(size, noise, n_cycles, repeat, names=flux_benchmarks):
+    cycle_args = synthetic_cycles(size, noise, n_cycles)
+    results = {}
+    for name in names:
+        logger.info(f"Benchmarking {name} on {size} {noise} cycles.")
+        results[f"{name}[{size},{noise}]"] = run_benchmark(
+            flux_case(name, cycle_args), cycle_args, repeat
+        )
+    return results
+
+
+def protocol_benchmark(days, repeat, chamber_map):
+    """Parse synthetic protocol logs of one day each with process_protocol_file."""
+    from ..ingest import process_protocol_file
+
+    site = SyntheticSite(days=days)
+    logs = []
+    for day in site.day_starts:
+        log = io.StringIO()
+        write_protocol_file(protocol_frame(site, day_cycles(site, day)), log)
+        logs.append(log.getvalue())
+
+    def prepare(text):
+        return lambda: process_protocol_file(io.StringIO(text), chamber_map)
+
+    return {"process_protocol_file[day]": run_benchmark(prepare, logs, repeat)}
+
+
+def gas_table_benchmark(days):
+    """
+    Push synthetic days of 1 Hz data with df_to_gas_table.
+
+    NOTE: needs the database, the rows are pushed with the serial BENCHMARK
+    and deleted afterwards.
+    """
+    from sqlalchemy import text
+    from ..db import engine
+    from ..data_mgt import df_to_gas_table
+    from ..ingest import prepare_gas_chunk
+    from ..measuring import instruments
+
+    instrument = instruments["LI7810"](BENCHMARK_SERIAL)
+    site = SyntheticSite(days=days)
+    frames = [
+        prepare_gas_chunk(gas_frame(site, day, day_cycles(site, day)), instrument)
+        for day in site.day_starts
+    ]
+
+    def prepare(df):
+        # a copy, df_to_gas_table drops duplicates in place
+        df = df.copy()
+        return lambda: df_to_gas_table(df)
+
+    try:
+        # the peak memory pass pushes only duplicates
+        stats = run_benchmark(prepare, frames)
+    finally:
+        with engine.begin() as conn:
+            conn.execute(
+                text("DELETE FROM gas_table WHERE instrument_serial = :serial"),
+                {"serial": BENCHMARK_SERIAL},
+            )
+    if stats["evals_per_s"]:
+        stats["rows_per_s"] = round(len(frames[0]) * stats["evals_per_s"], 1)
+    return {"df_to_gas_table[day]": stats}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(
+    chamber_map,
+    n_cycles=20,
+    repeat=3,
+    sizes=tuple(cycle_sizes),
+    noises=tuple(noise_levels),
+    protocol_days=3,
+    db=False,
+):
+    """
+    Run the flux engine benchmarks on every size and noise level, the
+    protocol parser and optionally df_to_gas_table.
+
+    Returns
+    -------
+    dict
+        run metadata and the stats of every benchmark
+    """
+    results = {}
+    for size in sizes:
+        for noise in noises:
+            results.update(flux_benchmarks_for(size, noise, n_cycles, repeat))
+    results.update(protocol_benchmark(protocol_days, repeat, chamber_map))
+    if db:
+        results.update(gas_table_benchmark(protocol_days))
+    return {
+        "commit": git_commit(),
+        "created": pd.Timestamp.now(tz="UTC").isoformat(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "n_cycles": n_cycles,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(baseline, current, key="p50_ms"):
+    """
+    Relative change of key for the benchmarks in both runs, negative is
+    faster.
+    """
+    changes = {}
+    for name, stats in current["results"].items():
+        base = baseline["results"].get(name)
+        if not base or not base.get(key) or stats.get(key) is None:
+            continue
+        changes[name] = round(stats[key] / base[key] - 1, 4)
+    return changes
+
+
+def format_results(run, changes=None):
+    """Results as a text table."""
+    lines = [
+        f"commit {run['commit']}, python {run['python']}, pandas {run['pandas']}",
+        f"{'benchmark':<45}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+        f"{'evals/s':>10}{'peak kB':>10}" + (f"{'change':>9}" if changes else ""),
+    ]
+    for name, stats in run["results"].items():
+        line = (
+            f"{name:<45}{stats['p50_ms']:>10}{stats['p90_ms']:>10}"
+            f"{stats['p99_ms']:>10}{stats['evals_per_s']:>10}"
+            f"{stats['peak_memory_kb']:>10}"
+        )
+        if changes and name in changes:
+            line += f"{changes[name]:>+9.1%}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def save_results(run, path):
+    with open(path, "w") as f:
+        json.dump(run, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,233 @@
+import os
+import math
+import logging
+import importlib
+from collections import Counter
+from functools import lru_cache
+
+import pandas as pd
+
+logger = logging.getLogger("defaultLogger")
+
+# An engine takes the MeasurementCycle.from_frame arguments of a cycle and
+# returns the fields below as a dict, per gas fields as {gas: value}. The
+# reference engine is the MeasurementCycle path, candidates are loaded from
+# "module:function" strings.
+
+# "module:function" of the engine that shadows live cycle inits
+SHADOW_ENGINE = os.getenv("AC_DASH_SHADOW_ENGINE")
+gas_fields = ("calc_offset_s", "calc_offset_e", "slope", "r", "flux")
+cycle_fields = ("error_code", "lagtime")
+# field: (relative, absolute) tolerance, offsets and codes have to match
+tolerances = {
+    "calc_offset_s": (0, 0),
+    "calc_offset_e": (0, 0),
+    "slope": (1e-9, 1e-12),
+    "r": (1e-9, 1e-12),
+    "flux": (1e-9, 1e-12),
+    "error_code": (0, 0),
+    "lagtime": (0, 0),
+}
+# mismatches kept per run for the report
+MAX_DETAILS = 100
+
+
+def cycle_result(m):
+    """Fields of an initiated MeasurementCycle."""
+    result = {
+        field: {gas: getattr(m, field).get(gas) for gas in m.flux_gases}
+        for field in gas_fields
+    }
+    result["error_code"] = m.error_code
+    result["lagtime"] = m.lagtime
+    return result
+
+
+def reference_engine(args):
+    from ..measurement import MeasurementCycle
+
+    return cycle_result(MeasurementCycle.from_frame(**args))
+
+
+def load_engine(path):
+    """Import an engine from a "module:function" string."""
+    if path in (None, "", "reference"):
+        return reference_engine
+    module, sep, func = path.partition(":")
+    if not sep:
+        raise ValueError(f"Engine {path} is not module:function.")
+    return getattr(importlib.import_module(module), func)
+
+
+def values_match(reference, candidate, rtol, atol):
+    if reference is None or candidate is None:
+        return reference is None and candidate is None
+    try:
+        reference, candidate = float(reference), float(candidate)
+    except (TypeError, ValueError):
+        return reference == candidate
+    if math.isnan(reference) or math.isnan(candidate):
+        return math.isnan(reference) and math.isnan(candidate)
+    return abs(reference - candidate) <= atol + rtol * abs(reference)
+
+
+def compare_results(reference, candidate, tols=tolerances):
+    """
+    Per field differences of two engine results.
+
+    Returns
+    -------
+    list
+        dicts with field, gas (None for cycle fields), reference,
+        candidate and diff of every value outside its tolerance
+    """
+    mismatches = []
+    pairs = [
+        (field, gas, reference[field].get(gas), candidate.get(field, {}).get(gas))
+        for field in gas_fields
+        for gas in reference[field]
+    ]
+    pairs += [
+        (field, None, reference[field], candidate.get(field))
+        for field in cycle_fields
+    ]
+    for field, gas, ref, cand in pairs:
+        rtol, atol = tols[field]
+        if values_match(ref, cand, rtol, atol):
+            continue
+        try:
+            diff = float(cand) - float(ref)
+        except (TypeError, ValueError):
+            diff = None
+        mismatches.append(
+            {
+                "field": field,
+                "gas": gas,
+                "reference": ref,
+                "candidate": cand,
+                "diff": diff,
+            }
+        )
+    return mismatches
+
+
+def run_equivalence(corpus, candidate, reference=reference_engine, tols=tolerances):
+    """
+    Run the reference and the candidate engine on every cycle of corpus.
+
+    Parameters
+    ----------
+    corpus : iterable
+        from_frame arguments of the cycles
+    candidate : callable
+    reference : callable
+
+    Returns
+    -------
+    dict
+        number of cycles, mismatched cycles, candidate errors, mismatches
+        per field and the first MAX_DETAILS mismatches
+    """
+    report = {
+        "cycles": 0,
+        "mismatched_cycles": 0,
+        "errors": 0,
+        "fields": Counter(),
+        "details": [],
+    }
+    for args in corpus:
+        report["cycles"] += 1
+        expected = reference(args)
+        key = {"chamber_id": args["id"], "start_time": str(args["start"])}
+        try:
+            got = candidate(args)
+        except Exception as e:
+            report["errors"] += 1
+            logger.error(f"Candidate engine failed on {key}: {e}")
+            if len(report["details"]) < MAX_DETAILS:
+                report["details"].append({**key, "error": repr(e)})
+            continue
+        mismatches = compare_results(expected, got, tols)
+        if not mismatches:
+            continue
+        report["mismatched_cycles"] += 1
+        for mismatch in mismatches:
+            report["fields"][mismatch["field"]] += 1
+            if len(report["details"]) < MAX_DETAILS:
+                report["details"].append({**key, **mismatch})
+    report["fields"] = dict(report["fields"])
+    return report
+
+
+def synthetic_corpus(n_cycles=20):
+    """Benchmark cycles of every size and noise level."""
+    from .benchmark import cycle_sizes, noise_levels, synthetic_cycles
+
+    for size in cycle_sizes:
+        for noise in noise_levels:
+            yield from synthetic_cycles(size, noise, n_cycles)
+
+
+def db_corpus(start, end, use_class, serial, conn=None):
+    """Cycles between start and end with their gas data from the database."""
+    from ..measuring import instruments
+    from ..data_mgt import cycle_table_to_df, gas_table_to_df
+
+    instrument = instruments[use_class](serial)
+    for row in cycle_table_to_df(start, end, conn).itertuples():
+        cycle_end = row.start_time + pd.Timedelta(seconds=int(row.end_offset))
+        data = gas_table_to_df(row.start_time, cycle_end, serial, conn, instrument)
+        if data is None or data.empty:
+            continue
+        yield {
+            "id": row.chamber_id,
+            "start": row.start_time,
+            "close_offset": row.close_offset,
+            "open_offset": row.open_offset,
+            "end_offset": row.end_offset,
+            "instrument": instrument,
+            "data": data,
+        }
+
+
+@lru_cache(maxsize=1)
+def shadow_engine():
+    """The engine in AC_DASH_SHADOW_ENGINE or None."""
+    if not SHADOW_ENGINE:
+        return None
+    engine = load_engine(SHADOW_ENGINE)
+    logger.info(f"Shadowing cycle inits with {SHADOW_ENGINE}.")
+    return engine
+
+
+def shadow_check(m):
+    """
+    Run the shadow engine on an initiated cycle and log differences to the
+    reference result. Never raises, the reference result is what is saved.
+    """
+    engine = shadow_engine()
+    # cycles initiated from flux_table have the saved results
+    if engine is None or m.from_db or m.data is None or m.data.empty:
+        return None
+    args = {
+        "id": m.chamber_id,
+        "start": m.start_time,
+        "close_offset": m.close_offset,
+        "open_offset": m.open_offset,
+        "end_offset": m._end_offset,
+        "instrument": m.instrument,
+        "data": m.data,
+        "air_temperature": None if m.default_temperature else m.air_temperature,
+        "air_pressure": None if m.default_pressure else m.air_pressure,
+        "chamber_height": None if m.default_height else m.chamber_height,
+    }
+    try:
+        mismatches = compare_results(cycle_result(m), engine(args))
+    except Exception as e:
+        logger.error(f"Shadow engine failed on {m.chamber_id} {m.start_time}: {e}")
+        return None
+    for mismatch in mismatches:
+        logger.warning(
+            f"Shadow engine mismatch on {m.chamber_id} {m.start_time}: {mismatch}"
+        )
+    return mismatches
@@ -2,15 +2,18 @@
 
 import pandas as pd
 import logging
+from .logger import get_logger
 
-logger = logging.getLogger("defaultLogger")
+logger = get_logger("engine")
 
 
 def get_datetime_index(df, filter_tuple, s_key="start", e_key="end"):
     # start = df.index.searchsorted(filter_tuple.s_key, side="left")
     # end = df.index.searchsorted(filter_tuple.e_key, side="left")
-    logger.debug(getattr(filter_tuple, s_key))
-    logger.debug(getattr(filter_tuple, e_key))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "%s to %s", getattr(filter_tuple, s_key), getattr(filter_tuple, e_key)
+        )
     start = df.index.searchsorted(getattr(filter_tuple, s_key), side="left")
     end = df.index.searchsorted(getattr(filter_tuple, e_key), side="left")
     return start, end
@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 
 import numpy as np
-import logging
+from .logger import get_logger
 
-logger = logging.getLogger("defaultLogger")
+logger = get_logger("engine")
 
 # molar masses
 masses = {"CH4": 16, "CO2": 44, "H2O": 18, "N2O": 44}
@@ -28,11 +28,13 @@ def calculate_gas_flux(measurement, gas, slope, height):
         one column for the dataframe with the calculated gas
         flux
     """
-    logger.debug("CALCULATING FLUX")
-    logger.debug(measurement)
-    logger.debug(gas)
-    logger.debug(slope)
-    logger.debug(height)
+    logger.debug(
+        "Calculating %s flux of %s, slope %s, height %s",
+        gas,
+        measurement,
+        slope,
+        height,
+    )
     # this value must in m
     h = height
     # molar_mass
@@ -0,0 +1,438 @@
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urljoin, urlparse
+
+import numpy as np
+import requests
+
+logger = logging.getLogger("defaultLogger")
+
+# Load test of a running server with concurrent reviewers. Every reviewer is
+# a thread with its own session that logs in through /auth/login and
+# replays the callbacks a browser sends while reviewing cycles. The dash
+# payloads are built from _dash-dependencies and the components of the
+# layout and of the page responses, like the dash renderer builds them.
+
+# the load test only runs against these hosts
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1", "0.0.0.0")
+# review session replayed by every reviewer, in order
+default_steps = (
+    "range",
+    "next",
+    "next",
+    "drag",
+    "prev",
+    "toggle_valid",
+    "next",
+    "db_view",
+    "api_fluxes",
+)
+# steps that write fluxes to the database
+write_steps = ("drag", "toggle_valid")
+percentiles = (50, 90, 99)
+TIMEOUT = 120
+
+
+class LoadTestError(Exception):
+    pass
+
+
+def check_local(base_url):
+    host = urlparse(base_url).hostname
+    if host not in LOCAL_HOSTS:
+        raise LoadTestError(f"Refusing to load test {host}, only local servers.")
+
+
+def stringify_id(id):
+    """Component id as dash writes it in callback specs."""
+    if isinstance(id, dict):
+        return json.dumps(id, sort_keys=True, separators=(",", ":"))
+    return id
+
+
+def parse_id(id):
+    if isinstance(id, str) and id.startswith("{"):
+        return json.loads(id)
+    return id
+
+
+def split_outputs(output):
+    """(id, property) pairs of a callback output string."""
+    if output.startswith(".."):
+        parts = output[2:-2].split("...")
+    else:
+        parts = [output]
+    return [tuple(part.rsplit(".", 1)) for part in parts]
+
+
+def walk_components(node):
+    """Yield (id, props) of every component with an id in a layout tree."""
+    if isinstance(node, list):
+        for child in node:
+            yield from walk_components(child)
+        return
+    if not isinstance(node, dict) or "props" not in node:
+        return
+    props = node["props"]
+    if props.get("id") is not None:
+        yield props["id"], props
+    for value in props.values():
+        if isinstance(value, (dict, list)):
+            yield from walk_components(value)
+
+
+def is_wildcard(value):
+    return isinstance(value, list) and value[:1] in (["ALL"], ["MATCH"], ["ALLSMALLER"])
+
+
+def matches(pattern, id):
+    if not isinstance(id, dict) or set(pattern) != set(id):
+        return False
+    return all(is_wildcard(v) or id[k] == v for k, v in pattern.items())
+
+
+class DashClient:
+    """One reviewer: a logged in session and the state of its dash app."""
+
+    def __init__(self, base_url, dash_url="/ac_dash/"):
+        self.base_url = base_url.rstrip("/")
+        self.dash_url = dash_url
+        self.session = requests.Session()
+        self.components = {}
+        self.values = {}
+        self.callbacks = {}
+
+    def url(self, path):
+        return urljoin(f"{self.base_url}/", path.lstrip("/"))
+
+    def login(self, username, password):
+        r = self.session.post(
+            self.url("/auth/login"),
+            json={"username": username, "password": password},
+            timeout=TIMEOUT,
+        )
+        if r.status_code != 200:
+            raise LoadTestError(f"Login failed with {r.status_code}.")
+
+    def get(self, path, **params):
+        r = self.session.get(self.url(path), params=params, timeout=TIMEOUT)
+        r.raise_for_status()
+        return r
+
+    def add_components(self, tree):
+        for id, props in walk_components(tree):
+            self.components[stringify_id(id)] = (id, props)
+
+    def load(self):
+        """Fetch the layout and the callbacks like the browser on page load."""
+        self.add_components(self.get(f"{self.dash_url}_dash-layout").json())
+        for dep in self.get(f"{self.dash_url}_dash-dependencies").json():
+            for id, prop in split_outputs(dep["output"]):
+                self.callbacks.setdefault(f"{id}.{prop.split('@')[0]}", dep)
+
+    def value(self, id, prop):
+        key = (stringify_id(id), prop)
+        if key in self.values:
+            return self.values[key]
+        props = self.components.get(key[0], (None, {}))[1]
+        return props.get(prop)
+
+    def expand(self, spec, with_value=True):
+        """Payload entries of a callback input, state or output spec."""
+        pattern = parse_id(spec["id"])
+        prop = spec["property"]
+        if isinstance(pattern, dict):
+            items = [
+                {"id": id, "property": prop}
+                for id, _ in self.components.values()
+                if matches(pattern, id)
+            ]
+        else:
+            items = [{"id": pattern, "property": prop}]
+        if with_value:
+            for item in items:
+                item["value"] = self.value(item["id"], prop.split("@")[0])
+        return items if isinstance(pattern, dict) else items[0]
+
+    def call(self, output, changed):
+        """
+        Run the callback of output after setting the changed props.
+
+        Parameters
+        ----------
+        output : str
+            "id.property" of one of the callback's outputs
+        changed : dict
+            {(id, property): value} of the inputs that triggered it
+        """
+        dep = self.callbacks.get(output)
+        if dep is None:
+            raise LoadTestError(f"No callback for {output}.")
+        for (id, prop), value in changed.items():
+            self.values[(stringify_id(id), prop)] = value
+        outputs = [
+            self.expand({"id": id, "property": prop}, with_value=False)
+            for id, prop in split_outputs(dep["output"])
+        ]
+        payload = {
+            "output": dep["output"],
+            "outputs": outputs if dep["output"].startswith("..") else outputs[0],
+            "inputs": [self.expand(spec) for spec in dep["inputs"]],
+            "state": [self.expand(spec) for spec in dep.get("state", [])],
+            "changedPropIds": [f"{stringify_id(id)}.{prop}" for id, prop in changed],
+        }
+        r = self.session.post(
+            self.url(f"{self.dash_url}_dash-update-component"),
+            json=payload,
+            timeout=TIMEOUT,
+        )
+        # 204 is PreventUpdate
+        if r.status_code == 204:
+            return {}
+        r.raise_for_status()
+        response = r.json().get("response", {})
+        for id, props in response.items():
+            for prop, value in props.items():
+                self.values[(id, prop)] = value
+                if prop == "children":
+                    self.add_components(value)
+        return response
+
+    def click(self, id):
+        """Changed props of the next click on a button."""
+        return {(id, "n_clicks"): (self.value(id, "n_clicks") or 0) + 1}
+
+
+class Reviewer:
+    """Replays the review steps with one DashClient."""
+
+    def __init__(self, client, start, end):
+        self.client = client
+        self.start = start
+        self.end = end
+
+    def open_page(self, page=""):
+        return self.client.call(
+            "page-content.children",
+            {("url", "pathname"): f"{self.client.dash_url}{page}"},
+        )
+
+    def instrument(self):
+        client = self.client
+        value = client.value("used-instrument-select", "value")
+        if value is None:
+            options = client.value("used-instrument-select", "options") or []
+            if not options:
+                raise LoadTestError("No instruments to review.")
+            value = options[0]["value"] if isinstance(options[0], dict) else options[0]
+        return value
+
+    def graph(self, changed):
+        return self.client.call("stored-chamber.data", changed)
+
+    def step_range(self):
+        client = self.client
+        client.call(
+            "date-store.data",
+            {
+                ("range-pick", "start_date"): self.start,
+                ("range-pick", "end_date"): self.end,
+            },
+        )
+        changed = client.click("parse-range")
+        changed[("used-instrument-select", "value")] = self.instrument()
+        return self.graph(changed)
+
+    def step_next(self):
+        return self.graph(self.client.click("next-button"))
+
+    def step_prev(self):
+        return self.graph(self.client.click("prev-button"))
+
+    def step_toggle_valid(self):
+        button = {"type": "logic-button", "index": "toggle-valid"}
+        return self.graph(self.client.click(button))
+
+    def step_drag(self):
+        """Move the flux calculation area of the first gas graph by 5 s."""
+        client = self.client
+        graphs = [
+            id
+            for id, _ in client.components.values()
+            if isinstance(id, dict) and id.get("type") == "gas-graph"
+        ]
+        if not graphs:
+            raise LoadTestError("No gas graphs on the page.")
+        figure = client.value(graphs[0], "figure") or {}
+        shapes = figure.get("layout", {}).get("shapes", [])
+        if len(shapes) < 2:
+            return {}
+        shape = shapes[1]
+        fmt = "%Y-%m-%d %H:%M:%S"
+        x0 = datetime.fromisoformat(str(shape["x0"])[:19]) + timedelta(seconds=5)
+        x1 = datetime.fromisoformat(str(shape["x1"])[:19])
+        relayout = {
+            "shapes[1].x0": x0.strftime(fmt),
+            "shapes[1].x1": x1.strftime(fmt),
+            "shapes[1].y0": shape.get("y0"),
+            "shapes[1].y1": shape.get("y1"),
+        }
+        return self.graph({(graphs[0], "relayoutData"): relayout})
+
+    def step_db_view(self):
+        self.open_page("db_view")
+        return self.client.call(
+            "flux-db-tab.children", {("db-view-tabs", "value"): "flux-db-tab"}
+        )
+
+    def step_api_fluxes(self):
+        return self.client.get("/api/fluxes", start=self.start, end=self.end)
+
+
+def latency_stats(seconds):
+    seconds = np.asarray(seconds)
+    stats = {
+        f"p{p}_ms": round(float(np.percentile(seconds, p)) * 1000, 2)
+        for p in percentiles
+    }
+    stats["mean_ms"] = round(float(seconds.mean()) * 1000, 2)
+    stats["n"] = len(seconds)
+    return stats
+
+
+def run_reviewer(base_url, username, password, start, end, steps, deadline, results):
+    """Replay steps until deadline, appends (step, seconds, error) to results."""
+
+    def timed(name, func):
+        t0 = time.perf_counter()
+        error = None
+        try:
+            func()
+        except (requests.RequestException, LoadTestError, ValueError) as e:
+            error = f"{type(e).__name__}: {e}"
+        results.append((name, time.perf_counter() - t0, error))
+        return error is None
+
+    client = DashClient(base_url)
+    reviewer = Reviewer(client, start, end)
+    if not timed("login", lambda: client.login(username, password)):
+        return
+    if not timed("load", client.load) or not timed("page", reviewer.open_page):
+        return
+    while time.monotonic() < deadline:
+        for step in steps:
+            if time.monotonic() >= deadline:
+                break
+            timed(step, getattr(reviewer, f"step_{step}"))
+
+
+def run_level(concurrency, duration, **kwargs):
+    """Run concurrency reviewers for duration seconds."""
+    results = []
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(
+            target=run_reviewer,
+            kwargs={**kwargs, "deadline": deadline, "results": results},
+            daemon=True,
+        )
+        for _ in range(concurrency)
+    ]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - t0
+    level = {
+        "concurrency": concurrency,
+        "wall_s": round(wall, 2),
+        "requests": len(results),
+        "errors": sum(error is not None for _, _, error in results),
+        "throughput_rps": round(len(results) / wall, 2) if wall else None,
+        "steps": {},
+        "sample_errors": sorted({error for _, _, error in results if error})[:10],
+    }
+    by_step = {}
+    for name, seconds, error in results:
+        by_step.setdefault(name, ([], [0]))
+        by_step[name][0].append(seconds)
+        by_step[name][1][0] += error is not None
+    for name, (seconds, errors) in by_step.items():
+        level["steps"][name] = {**latency_stats(seconds), "errors": errors[0]}
+    return level
+
+
+def run_loadtest(
+    base_url,
+    username,
+    password,
+    start,
+    end,
+    levels=(1, 2, 4, 8),
+    duration=30,
+    steps=default_steps,
+):
+    """
+    Ramp the number of concurrent reviewers through levels.
+
+    Parameters
+    ----------
+    base_url : str
+        server root, e.g. http://localhost:5000
+    start, end : str
+        date range the reviewers select, YYYY-MM-DD
+    levels : tuple
+        concurrent reviewers of each step of the ramp
+    duration : float
+        seconds per level
+
+    Returns
+    -------
+    list
+        per level throughput, errors and latency percentiles per step
+    """
+    check_local(base_url)
+    unknown = [step for step in steps if not hasattr(Reviewer, f"step_{step}")]
+    if unknown:
+        raise LoadTestError(f"Unknown steps: {', '.join(unknown)}")
+    report = []
+    for concurrency in levels:
+        logger.info(f"Load testing with {concurrency} reviewers for {duration} s.")
+        report.append(
+            run_level(
+                concurrency,
+                duration,
+                base_url=base_url,
+                username=username,
+                password=password,
+                start=start,
+                end=end,
+                steps=steps,
+            )
+        )
+    return report
+
+
+def format_report(report):
+    lines = []
+    for level in report:
+        lines.append(
+            f"{level['concurrency']} reviewers: {level['requests']} requests, "
+            f"{level['errors']} errors, {level['throughput_rps']} req/s"
+        )
+        lines.append(
+            f"  {'step':<15}{'n':>7}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}"
+            f"{'errors':>8}"
+        )
+        for name, stats in level["steps"].items():
+            lines.append(
+                f"  {name:<15}{stats['n']:>7}{stats['p50_ms']:>10}"
+                f"{stats['p90_ms']:>10}{stats['p99_ms']:>10}{stats['errors']:>8}"
+            )
+        for error in level["sample_errors"]:
+            lines.append(f"  ! {error}")
+    return "\n".join(lines)
@@ -3,6 +3,21 @@
 import os
 import logging
 import logging.config
+import itertools
+from collections import defaultdict
+
+# Subsystems log to children of defaultLogger, e.g. defaultLogger.engine, and
+# have their own level so the flux engine can stay quiet while the rest of
+# the app logs at DEBUG. Hot paths log with %-style arguments, which are only
+# formatted when the record is emitted, guard anything that is expensive to
+# compute with logger.isEnabledFor and sample per item messages.
+
+# per subsystem levels, e.g. "engine=DEBUG,db=WARNING"
+LOG_LEVELS = os.getenv("AC_DASH_LOG_LEVELS", "")
+# engine logs per cycle and per gas, its debug output is opt in
+default_levels = {"engine": "INFO", "db": "INFO"}
+
+_sample_counters = defaultdict(itertools.count)
 
 
 class CustomFormatter(logging.Formatter):
@@ -30,6 +45,55 @@ class CustomFormatter(logging.Formatter):
         return formatted_time
 
 
+def parse_levels(value):
+    """{subsystem: level} from "engine=DEBUG,db=WARNING"."""
+    levels = {}
+    for item in value.split(","):
+        name, sep, level = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def subsystem_levels():
+    return {**default_levels, **parse_levels(LOG_LEVELS)}
+
+
+def apply_levels(logger, subsystem):
+    level = subsystem_levels().get(subsystem)
+    if level is not None:
+        logger.setLevel(getattr(logging, level, logging.INFO))
+
+
+def get_logger(subsystem):
+    """Logger of a subsystem with its level from AC_DASH_LOG_LEVELS."""
+    logger = logging.getLogger(f"defaultLogger.{subsystem}")
+    apply_levels(logger, subsystem)
+    return logger
+
+
+def sampled(key, every):
+    """
+    True on the first and then every nth call with key, for messages that
+    would be logged per item. Approximate when called from many threads.
+    """
+    return next(_sample_counters[key]) % every == 0
+
+
+class lazy:
+    """Calls func only when the log record is formatted."""
+
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
 def init_logger(log_level=None):
     """
     Initiates logger from logging.ini and optionally takes logging level
@@ -43,5 +107,8 @@ def init_logger(log_level=None):
         logger.setLevel(getattr(logging, log_level.upper()))
     for handler in logger.handlers:
         handler.setFormatter(CustomFormatter(handler.formatter._fmt))
+    # fileConfig resets the levels of the subsystem loggers
+    for subsystem in subsystem_levels():
+        apply_levels(logging.getLogger(f"defaultLogger.{subsystem}"), subsystem)
 
     return logger
@@ -0,0 +1,322 @@
+import os
+import time
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from ..metrics import (
+    callback_seconds,
+    metrics_registry,
+    profiled_errors,
+    profiled_payload_bytes,
+    profiled_prefix,
+    profiled_queries,
+    profiled_query_seconds,
+    profiled_seconds,
+    profiled_stage_seconds,
+)
+from .query_profiler import current_query_log, rename_scope
+from .shared_state import (
+    SharedLog,
+    SharedSwitch,
+    read_shared_json,
+    write_shared_json,
+)
+
+logger = logging.getLogger("defaultLogger")
+
+# Callback profiling. Registered Dash callbacks are wrapped with
+# profile_callback, stages inside a callback are timed with profile_stage.
+# When profiling is off a wrapped callback costs a switch read and a
+# histogram observation, profile_stage one attribute lookup. Queries are
+# counted by the query profiler, so they are only known while it is on.
+#
+# The switch, the totals and the slow callback log are shared by the
+# gunicorn workers: the totals are prometheus metrics and the switch and
+# the log are files next to them, see shared_state.
+
+PROFILING = os.getenv("AC_DASH_PROFILING", "false").lower() in ("1", "true", "yes")
+# callbacks slower than this go to the slow callback log
+SLOW_CALLBACK_MS = float(os.getenv("AC_DASH_SLOW_CALLBACK_MS", "1000"))
+SLOW_LOG_SIZE = 200
+
+_switch = SharedSwitch("callback_profiling")
+_slow_log = SharedLog("slow_callbacks", SLOW_LOG_SIZE)
+_local = threading.local()
+# metric values at the last reset, used when the values are not shared
+_baseline = {"samples": []}
+
+
+class CallbackProfile:
+    """
+    Wall time per stage, database queries and response size of one callback
+    call.
+
+    NOTE: stages can be nested, e.g. measurement_init is part of
+    handle_triggers, so stage times don't add up to the total.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = defaultdict(float)
+        self.queries = None
+        self.payload_bytes = None
+        self.query_ms = None
+        self.error = None
+        self.seconds = 0.0
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._t0
+
+    def to_dict(self):
+        return {
+            "callback": self.name,
+            "started": self.started,
+            "ms": round(self.seconds * 1000, 2),
+            "stages_ms": {k: round(v * 1000, 2) for k, v in self.stages.items()},
+            "queries": self.queries,
+            "query_ms": self.query_ms,
+            "payload_bytes": self.payload_bytes,
+            "error": self.error,
+        }
+
+
+def current_profile():
+    return getattr(_local, "profile", None)
+
+
+def is_enabled():
+    return _switch.is_on()
+
+
+def set_enabled(value):
+    """Switch profiling on or off in all workers."""
+    value = bool(value)
+    if value == _switch.is_on():
+        return
+    _switch.set(value)
+    logger.info(f"Callback profiling {'on' if value else 'off'}.")
+
+
+@contextmanager
+def profile_stage(name):
+    """Time a stage of the callback that is being profiled."""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.stages[name] += time.perf_counter() - t0
+
+
+def profile_body(func):
+    """
+    Time the body of a callback as the callback stage, the rest of the
+    profiled time is dash decoding the request and serializing the response.
+    Goes between @app.callback and the function.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with profile_stage("callback"):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def record(profile):
+    if "callback" in profile.stages:
+        profile.stages["serialization"] = max(
+            profile.seconds - profile.stages["callback"], 0.0
+        )
+    name = profile.name
+    profiled_seconds.labels(name).observe(profile.seconds)
+    if profile.error is not None:
+        profiled_errors.labels(name).inc()
+    profiled_queries.labels(name).inc(profile.queries or 0)
+    profiled_query_seconds.labels(name).inc((profile.query_ms or 0.0) / 1000)
+    profiled_payload_bytes.labels(name).inc(profile.payload_bytes or 0)
+    for stage, seconds in profile.stages.items():
+        profiled_stage_seconds.labels(name, stage).inc(seconds)
+    entry = profile.to_dict()
+    if entry["ms"] >= SLOW_CALLBACK_MS:
+        _slow_log.append(entry)
+        logger.warning(
+            f"Slow callback {profile.name}: {entry['ms']} ms, "
+            f"{profile.queries} queries, stages {entry['stages_ms']}"
+        )
+    return entry
+
+
+def profile_callback(name, func):
+    """
+    Wrap a Dash callback so its calls are profiled when profiling is on.
+    The latency goes to the prometheus histogram either way.
+    """
+    latency = callback_seconds.labels(name)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _switch.is_on():
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                latency.observe(time.perf_counter() - t0)
+        profile = CallbackProfile(name)
+        _local.profile = profile
+        # the query profiler's request scope is this callback
+        query_log = current_query_log()
+        rename_scope(name)
+        try:
+            # dash returns the serialized response
+            result = func(*args, **kwargs)
+            if isinstance(result, (str, bytes)):
+                profile.payload_bytes = len(result)
+            return result
+        except Exception as e:
+            # PreventUpdate is an exception too
+            profile.error = type(e).__name__
+            raise
+        finally:
+            _local.profile = None
+            if query_log is not None:
+                profile.queries = query_log.queries
+                profile.query_ms = round(query_log.seconds * 1000, 2)
+            profile.finish()
+            latency.observe(profile.seconds)
+            record(profile)
+
+    return wrapper
+
+
+def instrument_app(app):
+    """
+    Wrap all callbacks registered to app. Call after the callbacks are
+    registered.
+    """
+    for output, entry in app.callback_map.items():
+        func = entry.get("callback")
+        if func is None or getattr(func, "profiled", False):
+            continue
+        name = getattr(func, "__name__", None) or output
+        entry["callback"] = profile_callback(name, func)
+        entry["callback"].profiled = True
+    if PROFILING:
+        set_enabled(True)
+
+
+def profiled_samples():
+    """Values of the profiled callback metrics, summed over the workers."""
+    samples = {}
+    for family in metrics_registry().collect():
+        if not family.name.startswith(profiled_prefix):
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_created"):
+                continue
+            key = (sample.name, tuple(sorted(sample.labels.items())))
+            samples[key] = samples.get(key, 0.0) + sample.value
+    return samples
+
+
+def baseline_samples():
+    samples = read_shared_json("profiling_baseline", _baseline)["samples"]
+    return {(name, tuple(map(tuple, labels))): value for name, labels, value in samples}
+
+
+def bucket_quantile(buckets, q):
+    """Upper bound of the histogram bucket holding quantile q, None if inf."""
+    buckets = sorted(buckets)
+    if not buckets or not buckets[-1][1]:
+        return None
+    target = q * buckets[-1][1]
+    for le, count in buckets:
+        if count >= target:
+            return None if le == float("inf") else le
+    return None
+
+
+def profiling_summary():
+    """
+    Per callback totals since the last reset and the slow callback log of
+    all workers. p95_ms is the upper bound of the latency bucket that has
+    the 95th percentile.
+    """
+    baseline = baseline_samples()
+    stats = defaultdict(
+        lambda: {"stages_ms": defaultdict(float), "buckets": defaultdict(float)}
+    )
+    for (name, labels), value in profiled_samples().items():
+        value -= baseline.get((name, labels), 0.0)
+        labels = dict(labels)
+        entry = stats[labels["callback"]]
+        metric = name[len(profiled_prefix) :]
+        if metric == "seconds_count":
+            entry["calls"] = round(value)
+        elif metric == "seconds_sum":
+            entry["total_ms"] = round(value * 1000, 2)
+        elif metric == "seconds_bucket":
+            entry["buckets"][float(labels["le"])] += value
+        elif metric == "errors_total":
+            entry["errors"] = round(value)
+        elif metric == "queries_total":
+            entry["queries"] = round(value)
+        elif metric == "query_seconds_total":
+            entry["query_ms"] = round(value * 1000, 2)
+        elif metric == "payload_bytes_total":
+            entry["payload_bytes"] = round(value)
+        elif metric == "stage_seconds_total":
+            entry["stages_ms"][labels["stage"]] += value * 1000
+
+    callbacks = {}
+    for name, entry in stats.items():
+        calls = entry.get("calls", 0)
+        if not calls:
+            continue
+        p95 = bucket_quantile(entry["buckets"].items(), 0.95)
+        totals = {
+            "calls": calls,
+            "errors": entry.get("errors", 0),
+            "total_ms": entry.get("total_ms", 0.0),
+            "queries": entry.get("queries", 0),
+            "query_ms": entry.get("query_ms", 0.0),
+            "payload_bytes": entry.get("payload_bytes", 0),
+        }
+        callbacks[name] = {
+            **totals,
+            "p95_ms": None if p95 is None else p95 * 1000,
+            "mean_ms": round(totals["total_ms"] / calls, 2),
+            "mean_queries": round(totals["queries"] / calls, 2),
+            "mean_query_ms": round(totals["query_ms"] / calls, 2),
+            "mean_payload_bytes": round(totals["payload_bytes"] / calls),
+            "mean_stages_ms": {
+                k: round(v / calls, 2) for k, v in entry["stages_ms"].items()
+            },
+        }
+    return {
+        "enabled": _switch.is_on(),
+        "slow_callback_ms": SLOW_CALLBACK_MS,
+        "callbacks": callbacks,
+        "slow": _slow_log.entries()[::-1],
+    }
+
+
+def reset_profiling():
+    """
+    Start the totals from zero in all workers. Prometheus counters only
+    grow, so the current values are kept as the baseline of the summary.
+    """
+    samples = [
+        [name, labels, value] for (name, labels), value in profiled_samples().items()
+    ]
+    if not write_shared_json("profiling_baseline", {"samples": samples}):
+        _baseline["samples"] = samples
+    _slow_log.clear()
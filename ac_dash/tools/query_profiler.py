@@ -0,0 +1,264 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .shared_state import SharedSwitch
+from .stats_store import StatsStore
+
+logger = logging.getLogger("defaultLogger")
+
+# Query profiling. Listeners on the Engine class see the queries of both
+# our engine and the flask_sqlalchemy one. Queries are grouped by their
+# fingerprint, the statement with literals and IN lists replaced, per
+# scope: a flask request, which is also every dash callback, or a
+# query_scope block. The listeners are only attached while profiling is on,
+# the switch is shared by the gunicorn workers and each one attaches or
+# removes its listeners when a request starts.
+
+QUERY_PROFILING = os.getenv("AC_DASH_QUERY_PROFILING", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# queries allowed per request before a violation is logged, 0 is no budget
+QUERY_BUDGET = int(os.getenv("AC_DASH_QUERY_BUDGET", "0"))
+# fingerprints kept in the process wide totals
+MAX_FINGERPRINTS = 500
+VIOLATION_LOG_SIZE = 100
+
+_switch = SharedSwitch("query_profiling")
+_state = {"attached": False}
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def new_fingerprint_stats():
+    return {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0}
+
+
+# totals per fingerprint and the budget violation log
+_store = StatsStore(
+    new_fingerprint_stats, VIOLATION_LOG_SIZE, max_keys=MAX_FINGERPRINTS
+)
+
+string_re = re.compile(r"'(?:[^']|'')*'")
+number_re = re.compile(r"\b\d+(?:\.\d+)?\b")
+param_re = re.compile(r"%\(\w+\)s|%s|\?|(?<![:\w]):\w+")
+in_list_re = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+values_re = re.compile(r"\bVALUES\s*(?:\([^()]*\)\s*,?\s*)+", re.IGNORECASE)
+space_re = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement):
+    """Statement with literals and parameters as ? and lists collapsed."""
+    fp = string_re.sub("?", statement)
+    fp = param_re.sub("?", fp)
+    fp = number_re.sub("?", fp)
+    fp = in_list_re.sub("IN (...)", fp)
+    fp = values_re.sub("VALUES (...) ", fp)
+    return space_re.sub(" ", fp).strip()
+
+
+class QueryLog:
+    """Queries of one scope by fingerprint."""
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.seconds = 0.0
+        self.fingerprints = defaultdict(lambda: [0, 0.0, 0])
+
+    def add(self, fp, seconds, rows):
+        self.queries += 1
+        self.seconds += seconds
+        entry = self.fingerprints[fp]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += rows
+
+    def top(self, n=5):
+        """Most repeated fingerprints, an N+1 pattern is on top."""
+        ranked = sorted(self.fingerprints.items(), key=lambda x: (-x[1][0], -x[1][1]))
+        return [
+            {
+                "fingerprint": fp,
+                "count": count,
+                "ms": round(seconds * 1000, 2),
+                "rows": rows,
+            }
+            for fp, (count, seconds, rows) in ranked[:n]
+        ]
+
+    def to_dict(self):
+        return {
+            "scope": self.name,
+            "queries": self.queries,
+            "ms": round(self.seconds * 1000, 2),
+            "top": self.top(),
+        }
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_t0 = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    t0 = getattr(context, "_query_t0", None)
+    seconds = time.perf_counter() - t0 if t0 is not None else 0.0
+    rows = max(getattr(cursor, "rowcount", 0) or 0, 0)
+    fp = fingerprint(statement)
+    log = getattr(_local, "log", None)
+    if log is not None:
+        log.add(fp, seconds, rows)
+
+    def add(stats):
+        stats["count"] += 1
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        stats["rows"] += rows
+
+    _store.update(fp, add)
+
+
+def is_query_profiling():
+    return _switch.is_on()
+
+
+def sync_listeners():
+    """Attach or remove the engine listeners of this process to follow the switch."""
+    value = _switch.is_on()
+    if value == _state["attached"]:
+        return value
+    with _lock:
+        if value != _state["attached"]:
+            if value:
+                event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+                event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+            else:
+                event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+                event.remove(Engine, "after_cursor_execute", after_cursor_execute)
+            _state["attached"] = value
+    return value
+
+
+def set_query_profiling(value):
+    """Switch query profiling on or off in all workers."""
+    value = bool(value)
+    if value == _switch.is_on():
+        return
+    _switch.set(value)
+    sync_listeners()
+    logger.info(f"Query profiling {'on' if value else 'off'}.")
+
+
+def start_scope(name):
+    log = QueryLog(name)
+    _local.log = log
+    return log
+
+
+def end_scope(budget=None):
+    """Finish the current scope and log it if it went over budget."""
+    log = getattr(_local, "log", None)
+    _local.log = None
+    if log is None:
+        return None
+    budget = QUERY_BUDGET if budget is None else budget
+    if budget and log.queries > budget:
+        entry = {"time": time.time(), "budget": budget, **log.to_dict()}
+        _store.append(entry)
+        logger.warning(
+            f"{log.name} ran {log.queries} queries, budget {budget}, "
+            f"{entry['ms']} ms. Most repeated: {entry['top'][:3]}"
+        )
+    return log
+
+
+@contextmanager
+def query_scope(name, budget=None):
+    """Collect the queries of a block, e.g. in a manage command."""
+    if not sync_listeners():
+        yield None
+        return
+    previous = getattr(_local, "log", None)
+    log = start_scope(name)
+    try:
+        yield log
+    finally:
+        end_scope(budget)
+        _local.log = previous
+
+
+def current_query_log():
+    return getattr(_local, "log", None)
+
+
+def init_query_profiler(server):
+    """Start a query scope for every request of the flask server."""
+    from flask import request
+
+    @server.before_request
+    def start_request_scope():
+        if sync_listeners():
+            start_scope(f"{request.method} {request.path}")
+
+    @server.teardown_request
+    def end_request_scope(exc=None):
+        # also when profiling was switched off during the request
+        end_scope()
+
+    if QUERY_PROFILING:
+        set_query_profiling(True)
+
+
+def rename_scope(name):
+    """Name the current scope, e.g. after the dash callback it runs."""
+    log = getattr(_local, "log", None)
+    if log is not None:
+        log.name = name
+
+
+def query_summary(n=50):
+    """
+    Slowest fingerprints in total and the latest budget violations of this
+    process.
+
+    NOTE: every gunicorn worker keeps its own.
+    """
+
+    def summarize(totals, violations):
+        ranked = sorted(totals.items(), key=lambda x: -x[1]["seconds"])[:n]
+        fingerprints = [
+            {
+                "fingerprint": fp,
+                "count": stats["count"],
+                "total_ms": round(stats["seconds"] * 1000, 2),
+                "mean_ms": round(stats["seconds"] * 1000 / stats["count"], 3),
+                "max_ms": round(stats["max_seconds"] * 1000, 2),
+                "mean_rows": round(stats["rows"] / stats["count"], 1),
+            }
+            for fp, stats in ranked
+        ]
+        return fingerprints, violations[::-1]
+
+    fingerprints, violations = _store.read(summarize)
+    return {
+        "enabled": _switch.is_on(),
+        "budget": QUERY_BUDGET,
+        "fingerprints": fingerprints,
+        "violations": violations,
+    }
+
+
+def reset_queries():
+    _store.reset()
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+
+from ..metrics import MULTIPROC_DIR
+
+# State that all gunicorn workers see, kept as files in
+# PROMETHEUS_MULTIPROC_DIR next to the prometheus values. gunicorn.conf.py
+# empties the directory on start. Without the directory the state lives in
+# this process, like the metrics.
+
+# seconds a process trusts the last look at a switch file
+SWITCH_CHECK_INTERVAL = 1.0
+
+
+def shared_path(name, directory=MULTIPROC_DIR):
+    return os.path.join(directory, name) if directory else None
+
+
+class SharedSwitch:
+    """
+    On/off switch, on while the file <name>.on exists.
+
+    The file is looked at at most once per SWITCH_CHECK_INTERVAL, so reading
+    the switch on a hot path costs a clock read and a switch made in one
+    worker reaches the others within that time.
+    """
+
+    def __init__(self, name, directory=MULTIPROC_DIR):
+        self.path = shared_path(f"{name}.on", directory)
+        self._value = False
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+
+    def is_on(self):
+        if self.path is None:
+            return self._value
+        now = time.monotonic()
+        if now - self._checked >= SWITCH_CHECK_INTERVAL:
+            self._value = os.path.exists(self.path)
+            self._checked = now
+        return self._value
+
+    def set(self, value):
+        value = bool(value)
+        with self._lock:
+            if self.path is not None:
+                if value:
+                    open(self.path, "a").close()
+                else:
+                    try:
+                        os.remove(self.path)
+                    except FileNotFoundError:
+                        pass
+                self._checked = time.monotonic()
+            self._value = value
+
+
+class SharedLog:
+    """
+    Latest json entries, appended to the file <name>.jsonl.
+
+    Appends of one short line are atomic so the workers don't need a lock.
+    Reading parses the tail of the file, only the last size entries are
+    returned. A file over max_bytes is cut down to them, an entry appended
+    by another worker at the same time can be lost.
+    """
+
+    def __init__(self, name, size, max_bytes=4 << 20, directory=MULTIPROC_DIR):
+        self.path = shared_path(f"{name}.jsonl", directory)
+        self.size = size
+        self.max_bytes = max_bytes
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def append(self, entry):
+        if self.path is None:
+            with self._lock:
+                self._entries.append(entry)
+            return
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry, default=str) + "\n")
+            full = f.tell() > self.max_bytes
+        if full:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                for entry in self.entries():
+                    f.write(json.dumps(entry, default=str) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def entries(self, tail_bytes=1 << 20):
+        if self.path is None:
+            with self._lock:
+                return list(self._entries)
+        try:
+            with open(self.path, "rb") as f:
+                end = f.seek(0, os.SEEK_END)
+                f.seek(max(end - tail_bytes, 0))
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines[-self.size :]:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # the first line of the tail can be cut
+                continue
+        return entries
+
+    def clear(self):
+        if self.path is None:
+            with self._lock:
+                self._entries.clear()
+            return
+        try:
+            os.truncate(self.path, 0)
+        except FileNotFoundError:
+            pass
+
+
+def read_shared_json(name, default=None, directory=MULTIPROC_DIR):
+    path = shared_path(f"{name}.json", directory)
+    if path is None:
+        return default
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def write_shared_json(name, value, directory=MULTIPROC_DIR):
+    """Replace the file <name>.json, readers never see a partial file."""
+    path = shared_path(f"{name}.json", directory)
+    if path is None:
+        return False
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+    return True
@@ -0,0 +1,58 @@
+import threading
+from collections import deque
+
+# Totals by key and a log of the latest entries, kept in memory by the
+# callback, query and ingest profilers. A store belongs to one process,
+# every gunicorn worker keeps its own.
+
+
+class StatsStore:
+    """
+    Thread safe totals by key and a bounded log of entries.
+
+    Parameters
+    ----------
+    new_totals : callable
+        Returns the empty totals of a new key.
+    log_size : int
+        Entries kept in the log, older ones are dropped.
+    max_keys : int, optional
+        Keys kept, updates of new keys are dropped once there are this many.
+    """
+
+    def __init__(self, new_totals, log_size, max_keys=None):
+        self.new_totals = new_totals
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._log = deque(maxlen=log_size)
+
+    def update(self, key, func, entry=None):
+        """
+        Call func with the totals of key and append entry to the log, both
+        under the lock.
+        """
+        with self._lock:
+            totals = self._totals.get(key)
+            if totals is None and (
+                self.max_keys is None or len(self._totals) < self.max_keys
+            ):
+                totals = self._totals[key] = self.new_totals()
+            if totals is not None:
+                func(totals)
+            if entry is not None:
+                self._log.append(entry)
+
+    def append(self, entry):
+        with self._lock:
+            self._log.append(entry)
+
+    def read(self, func):
+        """Return func(totals, log) computed under the lock."""
+        with self._lock:
+            return func(self._totals, list(self._log))
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            self._log.clear()
@@ -0,0 +1,388 @@
+import io
+import os
+import logging
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("defaultLogger")
+
+# Synthetic data in the formats the ingest expects, all times are Finnish
+# local time like the real files. The layout is the one of the inbox:
+#
+#     <out>/gas/LI7810/<serial>/<YYYY-MM-DD>.data   LI-7810 output, one per day
+#     <out>/cycle/protocol_<YYYY-MM-DD>.log         chamber protocol, one per day
+#     <out>/meteo/<source>/meteo.csv                air temperature, pressure
+#     <out>/volume/volume.csv                       chamber heights
+
+# ambient concentrations in the units of the LI-7810
+ambient = {"CO2": 420.0, "CH4": 2000.0, "H2O": 10000.0}
+# sd of the measurement noise
+noise_sd = {"CO2": 0.5, "CH4": 1.0, "H2O": 20.0}
+# columns of the LI-7810 output, units on the DATAU row
+licor_columns = {
+    "SECONDS": "s",
+    "NANOSECONDS": "ns",
+    "NDX": "",
+    "DIAG": "",
+    "REMARK": "",
+    "DATE": "date",
+    "TIME": "time",
+    "H2O": "ppm",
+    "CO2": "ppm",
+    "CH4": "ppb",
+}
+
+
+@dataclass
+class SyntheticSite:
+    """
+    Parameters of a synthetic measurement site.
+
+    Chambers are measured one after another by a single analyzer, each cycle
+    starts when the previous one ends. Gas concentrations rise linearly with
+    the chamber slope from close_offset + lag until open_offset.
+
+    Attributes
+    ----------
+    chambers : int
+        Number of chambers, protocol ids 1..chambers
+    days : int
+    start : str
+        First day
+    serial : str
+        Serial of the LI-7810
+    close_offset, open_offset, end_offset : int
+        Seconds from the cycle start
+    lag : tuple
+        Range of the lag between closing and the gas reaching the analyzer
+    slopes : dict
+        Range of slopes per gas in units per second, chamber slopes are drawn
+        from it and vary by slope_sd between cycles
+    slope_sd : float
+        Relative sd of the cycle slopes
+    noise : float
+        Multiplier of the measurement noise
+    gap_rate : float
+        Fraction of gas rows dropped in gaps of up to max_gap seconds
+    max_gap : int
+    diag_rate : float
+        Fraction of rows with a DIAG error
+    meteo_interval : str
+        Frequency of the meteo rows
+    volume_interval : str
+        Frequency of the chamber height measurements
+    seed : int
+    """
+
+    chambers: int = 12
+    days: int = 1
+    start: str = "2024-06-01"
+    serial: str = "TG10-01000"
+    close_offset: int = 180
+    open_offset: int = 480
+    end_offset: int = 540
+    lag: tuple = (10, 40)
+    slopes: dict = field(
+        default_factory=lambda: {
+            "CO2": (-0.05, 0.3),
+            "CH4": (-0.05, 0.5),
+            "H2O": (0.0, 2.0),
+        }
+    )
+    slope_sd: float = 0.1
+    noise: float = 1.0
+    gap_rate: float = 0.001
+    max_gap: int = 120
+    diag_rate: float = 0.0005
+    meteo_interval: str = "10min"
+    volume_interval: str = "7D"
+    seed: int = 0
+
+    def __post_init__(self):
+        # protocol_to_cycles splits the rows of a chamber into cycles by gaps
+        if self.chambers * self.end_offset <= 16 * 60:
+            raise ValueError(
+                "chambers * end_offset has to be longer than 16 minutes."
+            )
+        self.rng = np.random.default_rng(self.seed)
+        self.first_day = pd.Timestamp(self.start).normalize()
+        self.chamber_slopes = {
+            gas: self.rng.uniform(low, high, self.chambers)
+            for gas, (low, high) in self.slopes.items()
+        }
+
+    @property
+    def day_starts(self):
+        return pd.date_range(self.first_day, periods=self.days, freq="D")
+
+
+def day_cycles(site, day):
+    """
+    Cycles of one day, the rotation starts over at midnight.
+
+    Returns
+    -------
+    pd.DataFrame
+        chamber id, start time, lag and the slope of every gas
+    """
+    starts = pd.date_range(
+        day,
+        day + pd.Timedelta(days=1) - pd.Timedelta(seconds=site.end_offset),
+        freq=f"{site.end_offset}s",
+    )
+    n = len(starts)
+    chamber = np.arange(n) % site.chambers
+    cycles = pd.DataFrame(
+        {
+            "id": chamber + 1,
+            "start_time": starts,
+            "lag": site.rng.integers(site.lag[0], site.lag[1] + 1, n),
+        }
+    )
+    for gas, slopes in site.chamber_slopes.items():
+        variation = site.rng.normal(1.0, site.slope_sd, n)
+        cycles[f"{gas}_slope"] = slopes[chamber] * variation
+    return cycles
+
+
+def protocol_frame(site, cycles):
+    """Protocol rows of the cycles: start, close, open and end states."""
+    events = []
+    for offset, state in (
+        (0, 10),
+        (site.close_offset, 11),
+        (site.open_offset, 10),
+        (site.end_offset, 0),
+    ):
+        events.append(
+            pd.DataFrame(
+                {
+                    "datetime": cycles["start_time"] + pd.Timedelta(seconds=offset),
+                    "id": cycles["id"],
+                    "state": state,
+                }
+            )
+        )
+    # the end of a cycle is logged before the start of the next one
+    df = pd.concat(events).sort_values(["datetime", "state"], kind="stable")
+    return df.reset_index(drop=True)
+
+
+def gas_frame(site, day, cycles):
+    """
+    1 Hz gas series of one day with the chamber slopes, noise, gaps and
+    DIAG errors.
+    """
+    rng = site.rng
+    n = 24 * 60 * 60
+    seconds = np.arange(n)
+    starts = (cycles["start_time"] - day).dt.total_seconds().to_numpy().astype(int)
+    idx = np.searchsorted(starts, seconds, side="right") - 1
+    elapsed = seconds - starts[idx]
+    closed_at = site.close_offset + cycles["lag"].to_numpy()[idx]
+    rising = (elapsed >= closed_at) & (elapsed < site.open_offset)
+    rise_s = np.where(rising, elapsed - closed_at, 0)
+
+    data = {}
+    # slow diurnal variation of the ambient level
+    diurnal = np.sin(2 * np.pi * seconds / n)
+    for gas, level in ambient.items():
+        slope = cycles[f"{gas}_slope"].to_numpy()[idx]
+        noise = rng.normal(0, noise_sd[gas] * site.noise, n)
+        data[gas] = level * (1 + 0.01 * diurnal) + slope * rise_s + noise
+
+    diag = np.zeros(n, dtype=int)
+    errors = rng.random(n) < site.diag_rate
+    diag[errors] = rng.choice([2, 4, 16, 64], errors.sum())
+
+    keep = np.ones(n, dtype=bool)
+    n_gaps = int(n * site.gap_rate / max(site.max_gap / 2, 1))
+    for gap_start in rng.integers(0, n, n_gaps):
+        keep[gap_start : gap_start + rng.integers(1, site.max_gap + 1)] = False
+
+    df = pd.DataFrame(
+        {
+            "datetime": day + pd.to_timedelta(seconds, unit="s"),
+            "DIAG": diag,
+            **data,
+        }
+    )
+    return df[keep].reset_index(drop=True)
+
+
+def meteo_frame(site):
+    """Air temperature in °C and pressure in hPa for the whole period."""
+    rng = site.rng
+    index = pd.date_range(
+        site.first_day,
+        site.first_day + pd.Timedelta(days=site.days),
+        freq=site.meteo_interval,
+        inclusive="left",
+    )
+    hours = (index - site.first_day).total_seconds().to_numpy() / 3600
+    temperature = 12 + 6 * np.sin(2 * np.pi * (hours - 9) / 24)
+    pressure = 1010 + np.cumsum(rng.normal(0, 0.05, len(index)))
+    return pd.DataFrame(
+        {
+            "datetime": index,
+            "air_temperature": temperature + rng.normal(0, 0.3, len(index)),
+            "air_pressure": pressure,
+        }
+    )
+
+
+def volume_frame(site, chamber_map):
+    """Chamber heights in meters measured every volume_interval."""
+    rng = site.rng
+    days = pd.date_range(
+        site.first_day,
+        site.first_day + pd.Timedelta(days=site.days),
+        freq=site.volume_interval,
+        inclusive="left",
+    ) + pd.Timedelta(hours=12)
+    rows = []
+    for day in days:
+        for i in range(site.chambers):
+            corners = rng.normal(0.3, 0.02, 5)
+            rows.append(
+                {
+                    "datetime": day,
+                    "chamber_id": chamber_map.get(str(i + 1), str(i + 1)),
+                    "nw": corners[0],
+                    "sw": corners[1],
+                    "se": corners[2],
+                    "ne": corners[3],
+                    "mid": corners[4],
+                    "has_snow": 0,
+                    "chamber_height": corners.mean(),
+                    "unit": "m",
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+def write_licor_file(df, path, serial, model="LI-7810"):
+    """Write a gas frame like the output file of a LI-COR analyzer."""
+    dt = df["datetime"]
+    out = pd.DataFrame(
+        {
+            "DATAH": "DATA",
+            "SECONDS": dt.astype("int64") // 10**9,
+            "NANOSECONDS": 0,
+            "NDX": np.arange(len(df)),
+            "DIAG": df["DIAG"],
+            "REMARK": "",
+            "DATE": dt.dt.strftime("%Y-%m-%d"),
+            "TIME": dt.dt.strftime("%H:%M:%S"),
+            "H2O": df["H2O"],
+            "CO2": df["CO2"],
+            "CH4": df["CH4"],
+        }
+    )
+    with open(path, "w") as f:
+        f.write(f"Model:\t{model}\n")
+        f.write(f"SN:\t{serial}\n")
+        f.write("Software version:\t2.3.4\n")
+        f.write(f"Timestamp:\t{dt.iloc[0]:%Y-%m-%d %H:%M:%S}\n")
+        f.write("Timezone:\tEurope/Helsinki\n")
+        f.write("\t".join(["DATAH", *licor_columns]) + "\n")
+        f.write("\t".join(["DATAU", *licor_columns.values()]) + "\n")
+        out.to_csv(f, sep="\t", header=False, index=False, float_format="%.4f")
+
+
+def write_protocol_file(df, path):
+    """Write protocol rows in the tab separated protocol log format."""
+    out = df.assign(datetime=df["datetime"].dt.strftime("%d.%m.%Y %H:%M:%S"))
+    out[["datetime", "id", "state"]].to_csv(
+        path, sep="\t", header=False, index=False
+    )
+
+
+def generate_files(site, out_dir, chamber_map, meteo_source="synthetic"):
+    """
+    Write the gas, protocol, meteo and volume files of the site.
+
+    Returns
+    -------
+    dict
+        kind: list of written paths
+    """
+    dirs = {
+        "gas": os.path.join(out_dir, "gas", "LI7810", site.serial),
+        "cycle": os.path.join(out_dir, "cycle"),
+        "meteo": os.path.join(out_dir, "meteo", meteo_source),
+        "volume": os.path.join(out_dir, "volume"),
+    }
+    paths = {kind: [] for kind in dirs}
+    for path in dirs.values():
+        os.makedirs(path, exist_ok=True)
+    for day in site.day_starts:
+        cycles = day_cycles(site, day)
+        gas_path = os.path.join(dirs["gas"], f"{day:%Y-%m-%d}.data")
+        write_licor_file(gas_frame(site, day, cycles), gas_path, site.serial)
+        protocol_path = os.path.join(dirs["cycle"], f"protocol_{day:%Y-%m-%d}.log")
+        write_protocol_file(protocol_frame(site, cycles), protocol_path)
+        paths["gas"].append(gas_path)
+        paths["cycle"].append(protocol_path)
+        logger.info(f"Wrote synthetic data of {day:%Y-%m-%d}.")
+
+    meteo_path = os.path.join(dirs["meteo"], "meteo.csv")
+    meteo_frame(site).to_csv(meteo_path, index=False, date_format="%Y-%m-%dT%H:%M:%S")
+    paths["meteo"].append(meteo_path)
+    volume_path = os.path.join(dirs["volume"], "volume.csv")
+    volume_frame(site, chamber_map).to_csv(
+        volume_path, index=False, date_format="%Y-%m-%dT%H:%M:%S"
+    )
+    paths["volume"].append(volume_path)
+    return paths
+
+
+def push_to_db(site, chamber_map, meteo_source="synthetic"):
+    """
+    Push the site's data straight into the database without writing files.
+
+    Returns
+    -------
+    dict
+        kind: pushed rows
+    """
+    from ..measuring import instruments
+    from ..ingest import prepare_gas_chunk, process_protocol_file, to_utc
+    from ..data_mgt import (
+        add_instrument,
+        check_existing_instrument,
+        df_to_cycle_table,
+        df_to_gas_table,
+        df_to_meteo_table,
+        df_to_volume_table,
+    )
+
+    instrument = instruments["LI7810"](site.serial)
+    if not check_existing_instrument(instrument.serial, instrument.model, "LI7810"):
+        add_instrument(instrument.model, instrument.serial, "LI7810")
+
+    pushed = {"gas": 0, "cycle": 0, "meteo": 0, "volume": 0}
+    for day in site.day_starts:
+        cycles = day_cycles(site, day)
+        df = prepare_gas_chunk(gas_frame(site, day, cycles), instrument)
+        pushed_gas, _ = df_to_gas_table(df)
+        pushed["gas"] += len(pushed_gas)
+        # through the log parser so the cycles match ingested logs
+        log = io.StringIO()
+        write_protocol_file(protocol_frame(site, cycles), log)
+        log.seek(0)
+        pushed["cycle"] += len(
+            df_to_cycle_table(process_protocol_file(log, chamber_map))
+        )
+        logger.info(f"Pushed synthetic data of {day:%Y-%m-%d}.")
+
+    meteo = meteo_frame(site)
+    meteo["datetime"] = to_utc(meteo["datetime"])
+    meteo["source"] = meteo_source
+    pushed["meteo"] = len(df_to_meteo_table(meteo))
+    volume = volume_frame(site, chamber_map)
+    volume["datetime"] = to_utc(volume["datetime"])
+    pushed["volume"] = len(df_to_volume_table(volume))
+    return pushed
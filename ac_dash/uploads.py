@@ -0,0 +1,245 @@
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import logging
+import tempfile
+
+logger = logging.getLogger("defaultLogger")
+
+UPLOAD_DIR = os.getenv(
+    "AC_DASH_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "ac_dash_uploads")
+)
+# size of the parts the browser sends
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# unfinished uploads older than this are removed
+UPLOAD_MAX_AGE = 24 * 60 * 60
+COPY_BLOCK_SIZE = 1024 * 1024
+upload_kinds = ("gas", "cycle", "meteo", "volume")
+upload_id_re = re.compile(r"^[0-9a-f]{32}$")
+# finished uploads are moved to the inbox as <upload_id>_<filename>
+inbox_name_re = re.compile(r"^([0-9a-f]{32})_")
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def upload_paths(upload_id):
+    """Paths of the data and metadata files of an upload."""
+    if not upload_id or not upload_id_re.match(upload_id):
+        raise UploadError("Invalid upload id.")
+    base = os.path.join(UPLOAD_DIR, upload_id)
+    return f"{base}.part", f"{base}.json"
+
+
+def read_meta(upload_id):
+    _, meta_path = upload_paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadError(f"No upload {upload_id}.", 404)
+
+
+def write_meta(upload_id, meta):
+    """Replace the metadata of an upload, readers never see a partial file."""
+    _, meta_path = upload_paths(upload_id)
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def upload_offset(upload_id):
+    """Number of bytes received so far."""
+    part_path, _ = upload_paths(upload_id)
+    try:
+        return os.path.getsize(part_path)
+    except FileNotFoundError:
+        raise UploadError(f"No upload {upload_id}.", 404)
+
+
+def create_upload(meta):
+    """
+    Start a new upload.
+
+    Parameters
+    ----------
+    meta : dict
+        filename, size and kind of the file, plus what is needed to ingest
+        it, e.g. python_class and serial of gas files
+
+    Returns
+    -------
+    str
+        upload id
+    """
+    filename = os.path.basename(str(meta.get("filename") or ""))
+    if not filename:
+        raise UploadError("Provide filename.")
+    try:
+        size = int(meta.get("size"))
+    except (TypeError, ValueError):
+        raise UploadError("Provide size in bytes.")
+    if size <= 0:
+        raise UploadError(f"No data in file {filename}")
+    if meta.get("kind") not in upload_kinds:
+        raise UploadError(f"kind has to be one of {', '.join(upload_kinds)}.")
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    remove_stale_uploads()
+    if shutil.disk_usage(UPLOAD_DIR).free < size:
+        raise UploadError("Not enough disk space for the upload.", 507)
+    upload_id = uuid.uuid4().hex
+    part_path, meta_path = upload_paths(upload_id)
+    meta = {**meta, "filename": filename, "size": size, "created": time.time()}
+    open(part_path, "wb").close()
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    logger.debug(f"Started upload {upload_id} of {filename}, {size} bytes.")
+    return upload_id
+
+
+def append_chunk(upload_id, offset, stream):
+    """
+    Append the bytes in stream to the upload at offset.
+
+    offset has to match the bytes received so far, otherwise the client is
+    out of sync and has to ask for the offset again.
+
+    Returns
+    -------
+    int
+        new offset
+    """
+    meta = read_meta(upload_id)
+    part_path, _ = upload_paths(upload_id)
+    with open(part_path, "ab") as f:
+        # one writer per upload, gunicorn workers share the directory
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            current = f.seek(0, os.SEEK_END)
+            if offset != current:
+                raise UploadError(
+                    f"Offset {offset} doesn't match received {current} bytes.", 409
+                )
+            while True:
+                block = stream.read(COPY_BLOCK_SIZE)
+                if not block:
+                    break
+                if current + len(block) > meta["size"]:
+                    # drop the chunk, the received data stays consistent
+                    f.truncate(offset)
+                    raise UploadError("Upload is larger than announced.", 413)
+                f.write(block)
+                current += len(block)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return current
+
+
+def finished_upload(upload_id):
+    """Path and metadata of an upload that has received all its bytes."""
+    meta = read_meta(upload_id)
+    offset = upload_offset(upload_id)
+    if offset != meta["size"]:
+        raise UploadError(
+            f"Upload is incomplete, received {offset}/{meta['size']} bytes.", 409
+        )
+    part_path, _ = upload_paths(upload_id)
+    return part_path, meta
+
+
+def inbox_dir(meta):
+    """Directory of the inbox an upload goes to, relative to the inbox."""
+    kind = meta["kind"]
+    if kind == "gas":
+        return os.path.join(kind, meta["python_class"], meta["serial"])
+    if kind == "meteo":
+        if not meta.get("source"):
+            raise UploadError("Provide source")
+        return os.path.join(kind, os.path.basename(meta["source"]))
+    return kind
+
+
+def queue_upload(upload_id, inbox_root):
+    """
+    Move a finished upload into the inbox, the inbox watcher ingests it and
+    records the result with record_upload_result.
+
+    Returns
+    -------
+    dict
+        metadata of the upload with state queued
+    """
+    part_path, meta = finished_upload(upload_id)
+    rel_dir = inbox_dir(meta)
+    name = f"{upload_id}_{meta['filename']}"
+    target_dir = os.path.join(inbox_root, rel_dir)
+    os.makedirs(target_dir, exist_ok=True)
+    meta = {**meta, "state": "queued", "inbox_path": os.path.join(rel_dir, name)}
+    # queued before the watcher can see the file so its result isn't
+    # overwritten
+    write_meta(upload_id, meta)
+    # the watcher skips dot files, the rename makes the file appear whole
+    # even when the inbox is on another file system
+    tmp_path = os.path.join(target_dir, f".{name}")
+    shutil.move(part_path, tmp_path)
+    os.replace(tmp_path, os.path.join(target_dir, name))
+    logger.debug(f"Queued upload {upload_id} as {meta['inbox_path']}.")
+    return meta
+
+
+def record_upload_result(rel_path, result):
+    """
+    Store the result of ingesting an inbox file if it came from an upload.
+
+    Parameters
+    ----------
+    rel_path : str
+        Path of the file relative to the inbox
+    result : dict
+        state done or failed and the message, report or error
+    """
+    match = inbox_name_re.match(os.path.basename(rel_path))
+    if match is None:
+        return
+    upload_id = match.group(1)
+    try:
+        meta = read_meta(upload_id)
+    except UploadError:
+        return
+    write_meta(upload_id, {**meta, **result, "finished": time.time()})
+
+
+def remove_upload(upload_id):
+    for path in upload_paths(upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def remove_stale_uploads(max_age=UPLOAD_MAX_AGE):
+    """
+    Remove uploads that haven't received data in max_age seconds and the
+    status of queued uploads that haven't changed in max_age seconds.
+    """
+    now = time.time()
+    for entry in os.scandir(UPLOAD_DIR):
+        upload_id, ext = os.path.splitext(entry.name)
+        if ext not in (".part", ".json") or not upload_id_re.match(upload_id):
+            continue
+        if ext == ".json" and os.path.exists(upload_paths(upload_id)[0]):
+            continue
+        if now - entry.stat().st_mtime > max_age:
+            logger.info(f"Removing stale upload {upload_id}.")
+            remove_upload(upload_id)
+
@@ -21,10 +21,6 @@ class User(db.Model):
 User_tbl = Table("users", User.metadata)
 
 
-def mk_user_table():
-    User.metadata.create_all(engine)
-
-
 def check_existing_user(username):
     existing_user_query = f"""
         SELECT 1 FROM users WHERE username = '{username}';
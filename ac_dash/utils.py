@@ -1,185 +1,58 @@
-import os
 import json
+import time
 import logging
 import hashlib
-import zipfile
 
 from dash import ctx, no_update
 import pandas as pd
-import numpy as np
 from datetime import datetime, timedelta
 from plotly.graph_objs import Figure, Layout
 from .db import engine
 
 from .tools.influxdb_funcs import init_client, just_read
+from .tools.profiling import profile_stage
+from .metrics import observe_cycle_init
+from .tools.logger import get_logger, lazy
+from .app_config import load_config
+from .flux_init import init_from_cycle_table
 
 from .measuring import instruments
 from .measurement import MeasurementCycle
+from .ingest import (
+    process_measurement_zip,
+    process_protocol_file,
+    process_protocol_zip,
+    protocol_to_cycles,
+)
 from .data_mgt import (
-    df_to_gas_table,
     gas_table_to_df,
     cycle_table_to_df,
     single_flux_to_table,
     flux_range_to_df,
-    fluxes_to_table,
 )
 from .create_graph import (
     mk_attribute_plot,
     apply_highlighter,
 )
 
-logger = logging.getLogger("defaultLogger")
+logger = get_logger("dash")
+
+# moved to app_config, flux_init and ingest, still importable from here
+__all__ = [
+    "load_config",
+    "init_from_cycle_table",
+    "process_measurement_zip",
+    "process_protocol_file",
+    "process_protocol_zip",
+]
 attribute_plots = {}
 # track and save currently calculated measurements
 
 
-protocol_pdargs = {
-    "sep": "\t",
-    "names": ["datetime", "id", "state"],
-    "dtype": {
-        "datetime": "str",
-        "id": "str",
-        "state": "str",
-    },
-    "usecols": ["datetime", "id", "state"],
-}
-
-
-def process_protocol_file(filedata, chamber_map):
-    df = pd.read_csv(filedata, **protocol_pdargs)
-    df["datetime"] = pd.to_datetime(df["datetime"], format="%d.%m.%Y %H:%M:%S")
-
-    df["state"] = df["state"].astype(int)
-    df["id"] = df["id"].astype(int)
-    df.sort_values(by="datetime", inplace=True)
-
-    df.sort_values(by="id").reset_index(drop=True, inplace=True)
-    # NOTE: needs to be done in this seemingly overcomplicated way since
-    # each cycle’s start time is the same (almost always) as end time of the previous cycle
-    # so only grouping by datetime will cause issues since there's no
-    # telling which order they'll end up
-    # create list of dataframes where each dataframe only has cycles from
-    # one chamber
-    id_groups = [group for _, group in df.groupby("id")]
-    grouped = []
-    for id_group in id_groups:
-        # calculate time differences between rows, and when time difference
-        # is over 16minutes, increment. This creates a unique identifier for
-        # each cycle
-        id_group["cycle"] = (
-            id_group["datetime"].diff() > pd.Timedelta(minutes=16)
-        ).cumsum()
-        # group each cycle into its own dataframe and append to list
-        [grouped.append(group) for _, group in id_group.groupby("cycle")]
-    #
-    # sort the list of dataframes by the start time of the cycle
-    sorts = sorted(grouped, key=lambda df: df["datetime"].iloc[0])
-
-    dfs = []
-    for df in sorts:
-        if df.empty:
-            continue
-        # needs open, close and deactivate
-        if df["state"].nunique() != 3:
-            continue
-        chamber = df["id"].iloc[0]
-        # first ten is the start
-        start = df.loc[df["state"] == 10, "datetime"].iloc[0]
-        # first 11 is the close
-        close = df.loc[df["state"] == 11, "datetime"].iloc[0]
-        # second 10 should be the end, use -1 to grab the last to be
-        # sure
-        open = df.loc[df["state"] == 10, "datetime"].iloc[-1]
-        # last 00 is the end
-        end = df.loc[df["state"] == 0, "datetime"].iloc[-1]
-        data = {
-            "chamber_id": [chamber],
-            "start_time": [start],
-            "close_offset": [int((close - start).total_seconds())],
-            "open_offset": [int((open - start).total_seconds())],
-            "end_offset": [int((end - start).total_seconds())],
-        }
-        group = pd.DataFrame(data)
-        # if any of these are negative there's something wrong
-        if np.any(group[["close_offset", "open_offset", "end_offset"]].to_numpy() < 0):
-            continue
-        dfs.append(group)
-    dfa = pd.concat(dfs)
-    dfa["chamber_id"] = dfa["chamber_id"].astype(str).map(chamber_map)
-    dfa["start_time"] = (
-        dfa["start_time"]
-        .dt.tz_localize("Europe/Helsinki", ambiguous=True)
-        .dt.tz_convert("UTC")
-    )
-
-    return dfa
-
-
-def process_protocol_zip(file_path, chamber_map):
-    with zipfile.ZipFile(file_path, "r") as z:
-        file_list = z.namelist()
-
-        dfa = []
-        for file_name in file_list:
-            file_exts = "log"
-            if file_name.endswith(file_exts):
-                print(f"Processing: {file_name}")
-
-                # open file and read to dataframe
-                with z.open(file_name) as f:
-                    df = process_protocol_file(f, chamber_map)
-                    dfa.append(df)
-    data = pd.concat(dfa)
-    return data
-
-
 def process_measurement_file(filedata, instrument):
     return instrument.read_output_file(filedata)
 
 
-def process_measurement_zip(file_path, instrument):
-    with zipfile.ZipFile(file_path, "r") as z:
-        file_list = z.namelist()
-
-        in_rows = 0
-        push_rows = 0
-        for file_name in file_list:
-            file_exts = ("csv", "data", "dat")
-            if file_name.endswith(file_exts):
-                print(f"Processing: {file_name}")
-
-                # open file and read to dataframe
-                with z.open(file_name) as f:
-                    df = instrument.read_output_file(f)
-                    df["datetime"] = (
-                        df["datetime"]
-                        .dt.tz_localize("Europe/Helsinki", ambiguous=True)
-                        .dt.tz_convert("UTC")
-                    )
-                    df["instrument_serial"] = instrument.serial
-                    df["instrument_model"] = instrument.model
-                    df_copy, dupes = df_to_gas_table(df)
-                    in_rows += len(df)
-                    push_rows += len(df_copy)
-    return push_rows, in_rows
-
-
-def load_config():
-    """Load configuration for InfluxDB."""
-    filepath = os.path.abspath(os.path.dirname(__file__))
-    with open(f"{filepath}/config/config.json", "r") as f:
-        defaults = json.load(f)
-    with open(f"{filepath}/config/custom.json", "r") as f:
-        custom = json.load(f)
-    config = {**defaults, **custom}
-    return (
-        config["chambers"],
-        config["chamber_map"],
-        config["layout"],
-        config["measurements"],
-    )
-
-
 def load_cycles():
     """Load measurement cycles from a configuration file."""
     with open("config/cycle.json", "r") as f:
@@ -207,46 +80,6 @@ def generate_measurements(month, cycles):
     return all_measurements
 
 
-def init_from_cycle_table(
-    cycle_df, use_class=None, serial=None, conn=None, meteo_source=None
-):
-    instrument = instruments.get(use_class)(serial)
-    all_measurements = []
-    o = 0
-    for idx, row in cycle_df.iterrows():
-        o += 1
-        start = row.start_time
-        close = row.close_offset
-        open = row.open_offset
-        end = row.end_offset
-        id = row.chamber_id
-        logger.info(f"Initiating {start}")
-        m = MeasurementCycle(
-            id,
-            start,
-            close,
-            open,
-            end,
-            instrument,
-            meteo_source=meteo_source,
-            conn=conn,
-        )
-        if m.data is not None and not m.data.empty:
-            # single_flux_to_table(m.attribute_df)
-            all_measurements.append(m.attribute_df)
-        if o == 100:
-            o = 0
-            if len(all_measurements) == 0:
-                continue
-            df = pd.concat(all_measurements)
-            fluxes_to_table(df)
-            all_measurements = []
-            continue
-    if len(all_measurements) > 0:
-        df = pd.concat(all_measurements)
-        fluxes_to_table(df)
-
-
 def generate_measurements2(cycles, serial, use_class):
     """Generate MeasurementCycle objects for each day and cycle."""
     global measurements
@@ -303,8 +136,8 @@ def handle_triggers(args, all_chambers, graph_names):
     logger.debug(end_date)
     date_range = (start_date, end_date)
     logger.info("Running.")
-    logger.info(f"Triggered key: {ctx.triggered_id}")
-    logger.debug(f"Start date: {start_date}.")
+    logger.info("Triggered key: %s", ctx.triggered_id)
+    logger.debug("Start date: %s.", start_date)
     selected_chambers = selected_chambers or all_chambers
 
     skips = None
@@ -355,12 +188,13 @@ def handle_triggers(args, all_chambers, graph_names):
     if index == 0:
         index = df_meas["start_time"].iloc[0]
 
-    logger.debug(df_meas["chamber_id"].unique())
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Chambers %s", df_meas["chamber_id"].unique())
 
     measurements = df_meas.copy()
 
     picked_point = None
-    logger.debug(f"Skip invalid value: {skip_invalid}")
+    logger.debug("Skip invalid value: %s", skip_invalid)
 
     if triggered_elem == "next-button":
         logger.debug("prev-button clicked.")
@@ -388,7 +222,7 @@ def handle_triggers(args, all_chambers, graph_names):
         logger.debug(picked_point)
         measurement = df_meas.loc[df_meas["start_time"] == picked_point].iloc[0]
         index = picked_point
-        logger.info(f"index: {index}")
+        logger.info("index: %s", index)
     else:
         measurement = df_meas.loc[df_meas["start_time"] == index].iloc[0]
 
@@ -400,14 +234,17 @@ def handle_triggers(args, all_chambers, graph_names):
     instrument = measurement.get("instrument_model").replace("-", "")
     serial = measurement.get("instrument_serial")
     logger.debug(measurement)
-    m = MeasurementCycle(
-        measurement.get("chamber_id"),
-        measurement.get("start_time"),
-        measurement.get("close_offset"),
-        measurement.get("open_offset"),
-        measurement.get("end_offset"),
-        instruments.get(instrument)(serial),
-    )
+    with profile_stage("measurement_init"):
+        t0 = time.perf_counter()
+        m = MeasurementCycle(
+            measurement.get("chamber_id"),
+            measurement.get("start_time"),
+            measurement.get("close_offset"),
+            measurement.get("open_offset"),
+            measurement.get("end_offset"),
+            instruments.get(instrument)(serial),
+        )
+        observe_cycle_init(m, time.perf_counter() - t0)
     if triggered_elem in gas_plots:
         for i, gas_plot in enumerate(gas_plots):
             if gas_relays[i] is None:
@@ -416,7 +253,7 @@ def handle_triggers(args, all_chambers, graph_names):
                 gas = gas_plot.split("-")[0]
                 parse_relayout(gas_relays[i], m, gas)
                 measurements = update_row(m, measurements)
-                logger.debug(measurements.iloc[0].get("lagtime"))
+                logger.debug("Lagtime %s", lazy(measurements.iloc[0].get, "lagtime"))
     measurement = m
 
     return (
@@ -532,13 +369,13 @@ def execute_actions(triggered_id, measurement, measurements, date_range):
         logger.debug("max-r clicked.")
         measurement.lagtime = 0
         measurement.get_max()
-        logger.info(measurement.attribute_dict)
+        logger.debug("%s", lazy(measurement.get_attribute_dict))
         push_single_point(measurement)
     if triggered_id == "push-all":
         logger.debug("push-all clicked.")
     if triggered_id == "push-single":
         logger.debug("push-single clicked.")
-        logger.debug(measurement.attribute_dict)
+        logger.debug("%s", lazy(measurement.get_attribute_dict))
         logger.debug(measurement.air_temperature)
         # measurement.get_max()
         push_single_point(measurement)
@@ -546,7 +383,7 @@ def execute_actions(triggered_id, measurement, measurements, date_range):
     if triggered_id == "mark-invalid":
         logger.debug("mark-invalid clicked.")
         measurement.is_valid_manual = False
-        logger.debug(measurement.attribute_df.to_dict())
+        logger.debug("%s", lazy(lambda: measurement.attribute_df.to_dict()))
         push_single_point(measurement)
 
     if triggered_id == "toggle-valid":
@@ -565,11 +402,21 @@ def execute_actions(triggered_id, measurement, measurements, date_range):
         measurement.lagtimes_s = 0
     if triggered_id == "add-time":
         measurement.end_offset = measurement._end_offset + 120
-        measurement.data = gas_table_to_df(measurement.start_time, measurement.end)
+        measurement.data = gas_table_to_df(
+            measurement.start_time,
+            measurement.end,
+            measurement.instrument.serial,
+            instrument=measurement.instrument,
+        )
         push_single_point(measurement)
     if triggered_id == "substract-time":
         measurement.end_offset = measurement._end_offset - 120
-        measurement.data = gas_table_to_df(measurement.start_time, measurement.end)
+        measurement.data = gas_table_to_df(
+            measurement.start_time,
+            measurement.end,
+            measurement.instrument.serial,
+            instrument=measurement.instrument,
+        )
         push_single_point(measurement)
 
 
@@ -751,64 +598,11 @@ def parse_cycle_to_db(start, end, ifdb_dict, chamber_map):
     meas_dict = {"bucket": "Testi", "measurement": "AC_STATE", "fields": None}
     with init_client(ifdb_dict) as client:
         df = just_read(ifdb_dict, meas_dict, client, start_ts=start, stop_ts=end)
-        df.sort_values(by="id").reset_index(drop=True, inplace=True)
-        # NOTE: needs to be done in this seemingly overcomplicated way since
-        # each cycle’s start time is the same (almost always) as end time of the previous cycle
-        # so only grouping by datetime will cause issues since there's no
-        # telling which order they'll end up
-
         df["state"] = df["state"].astype(int)
         # telegraf pushes chamber ids with spaces
         df["id"] = df["id"].str.strip().astype(int)
         df["id"] = df["id"].map(chamber_map)
-        # create list of dataframes where each dataframe only has cycles from
-        # one chamber
-        id_groups = [group for _, group in df.groupby("id")]
-        grouped = []
-        for id_group in id_groups:
-            # calculate time differences between rows, and when time difference
-            # is over 16minutes, increment. (Realistically its always 3 hours
-            # with the oulanka cycle) This creates a unique identifier for
-            # each cycle
-            id_group["cycle"] = (
-                id_group["datetime"].diff() > pd.Timedelta(minutes=16)
-            ).cumsum()
-            # group each cycle into its own dataframe and append to list
-            [grouped.append(group) for _, group in id_group.groupby("cycle")]
-    # sort the list of dataframes by start time
-    sorts = sorted(grouped, key=lambda df: df["datetime"].iloc[0])
-    # concatenate all dataframes a single dataframe
-
-    dfs = []
-    for df in sorts:
-        if df.empty:
-            continue
-        # needs open, close and deactivate
-        if df["state"].nunique() != 3:
-            continue
-        chamber = df["id"].iloc[0]
-        # first 10 is the start
-        start = df.loc[df["state"] == 10, "datetime"].iloc[0]
-        # first 11 is the close
-        close = df.loc[df["state"] == 11, "datetime"].iloc[0]
-        # second 10 should be the opening, use -1 to grab the last to be
-        # sure
-        open = df.loc[df["state"] == 10, "datetime"].iloc[-1]
-        # last 00 is the end
-        end = df.loc[df["state"] == 0, "datetime"].iloc[-1]
-        data = {
-            "chamber_id": [chamber],
-            "start_time": [start],
-            "close_offset": [int((close - start).total_seconds())],
-            "open_offset": [int((open - start).total_seconds())],
-            "end_offset": [int((end - start).total_seconds())],
-        }
-        group = pd.DataFrame(data)
-        # if any of these are 0 or less there's something wrong
-        if np.any(group[["close_offset", "open_offset", "end_offset"]].to_numpy() < 0):
-            continue
-        dfs.append(group)
-
-    dfa = pd.concat(dfs)
-
-    return dfa
+    # realistically the gap between cycles is always 3 hours with the
+    # oulanka cycle
+    return protocol_to_cycles(df.dropna(subset=["id"]))
+
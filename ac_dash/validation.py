@@ -1,7 +1,7 @@
-import logging
 from .tools.filter import get_datetime_index
+from .tools.logger import get_logger
 
-logger = logging.getLogger("defaultLogger")
+logger = get_logger("engine")
 
 error_codes = {
     1: "has errors",
@@ -27,7 +27,7 @@ error_codes = {
 
 def check_quality_r2(r2):
     r2_threshold = 0.93
-    logger.debug(f"r2: {r2}")
+    logger.debug("r2: %s", r2)
     return r2_threshold > r2
 
 
@@ -50,7 +50,7 @@ def check_trends_up(data, threshold):
 
     trending_up = max >= max_shifted
     percentage_upward = trending_up.mean() * 100
-    logger.debug(f"Upward percent: {percentage_upward}")
+    logger.debug("Upward percent: %s", percentage_upward)
 
     # if 95% of values are only going upward, mark invalid
     return percentage_upward >= threshold
@@ -67,7 +67,7 @@ def check_trends_down(measurement):
     )
     trending_down = min <= min_shifted
     percentage_downward = trending_down.mean() * 100
-    logger.debug(f"Downward percent: {percentage_downward}")
+    logger.debug("Downward percent: %s", percentage_downward)
     # if 95% of values are only going downward, mark invalid
     threshold = 95
     return percentage_downward >= threshold
@@ -96,8 +96,8 @@ def check_too_few(df, measurement_time):
 
 
 def check_too_many(df, measurement_time):
-    logger.debug(f"Length: {len(df)}")
-    logger.debug(f"Measurement_time: {measurement_time}")
+    logger.debug("Length: %s", len(df))
+    logger.debug("Measurement_time: %s", measurement_time)
     return len(df) > measurement_time * 1.1
 
 
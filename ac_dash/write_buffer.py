@@ -0,0 +1,199 @@
+import json
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger("defaultLogger")
+
+
+class WriteBehindBuffer:
+    """
+    In-process buffer for rows that are written to the db later in batches.
+
+    Rows are merged by key so that repeated edits of the same row only cause
+    one write. The buffer is flushed by a background thread every
+    flush_interval seconds, when it has max_rows rows and at exit.
+
+    NOTE: the buffer only lives in one process, other gunicorn workers see
+    the buffered values only after they have been flushed and a flush could
+    overwrite their newer edits. Only enable it with a single worker.
+
+    Parameters
+    ----------
+    writer : callable
+        Called with a list of row dicts, must write them in one transaction.
+    key_func : callable
+        Returns a hashable key for a row dict.
+    max_rows : int
+        Flush when this many rows are buffered.
+    flush_interval : float
+        Seconds between background flushes.
+    max_attempts : int
+        Failed writes of a row before it is given up on.
+    dead_letter_path : str, optional
+        Rows that were given up on or are still buffered when the buffer is
+        stopped are appended here as json lines, otherwise they are logged.
+    """
+
+    def __init__(
+        self,
+        writer,
+        key_func,
+        max_rows=200,
+        flush_interval=2.0,
+        max_attempts=5,
+        dead_letter_path=None,
+    ):
+        self.writer = writer
+        self.key_func = key_func
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.dead_letter_path = dead_letter_path
+        self.enabled = False
+        self._pending = {}
+        # failed writes per key
+        self._attempts = {}
+        # rows that are being written, still visible for reads
+        self._flushing = {}
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, rows):
+        """Buffer rows, newer values of a row replace older ones."""
+        self._start()
+        with self._lock:
+            for row in rows:
+                key = self.key_func(row)
+                self._pending.setdefault(key, {}).update(row)
+            full = len(self._pending) >= self.max_rows
+        if full:
+            self.flush()
+
+    def get(self, key):
+        """Return the buffered row for key or None."""
+        with self._lock:
+            row = self._flushing.get(key, {}).copy()
+            row.update(self._pending.get(key, {}))
+        return row or None
+
+    def rows(self):
+        """All buffered rows, pending values override ones being flushed."""
+        with self._lock:
+            merged = {key: row.copy() for key, row in self._flushing.items()}
+            for key, row in self._pending.items():
+                merged.setdefault(key, {}).update(row)
+        return merged
+
+    def flush(self):
+        """
+        Write all buffered rows.
+
+        Rows with the same columns are written in one batch, a failed batch
+        doesn't keep the others from being written. Rows of failed batches
+        are buffered again until they have failed max_attempts times.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                items = list(self._flushing.items())
+            written = 0
+            failed = {}
+            try:
+                # rows need to have the same columns to be written in one
+                # statement
+                by_cols = {}
+                for key, row in items:
+                    by_cols.setdefault(tuple(row.keys()), []).append((key, row))
+                for batch in by_cols.values():
+                    try:
+                        self.writer([row for _, row in batch])
+                    except Exception as e:
+                        logger.error(f"Writing {len(batch)} buffered rows failed: {e}")
+                        failed.update(batch)
+                    else:
+                        written += len(batch)
+                logger.debug(f"Flushed {written} buffered rows.")
+            finally:
+                with self._lock:
+                    for key in self._flushing:
+                        if key not in failed:
+                            self._attempts.pop(key, None)
+                    self._flushing = {}
+                if failed:
+                    self._requeue(failed)
+        return written
+
+    def stop(self):
+        """
+        Stop the background thread, write remaining rows and keep the ones
+        that couldn't be written in the dead letter file.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 2)
+            self._thread = None
+        self.flush()
+        with self._lock:
+            rows = list(self._pending.values())
+            self._pending = {}
+            self._attempts = {}
+        if rows:
+            self._dead_letter(rows, "unflushed at stop")
+
+    def _requeue(self, failed):
+        dead = []
+        with self._lock:
+            for key, row in failed.items():
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts >= self.max_attempts:
+                    self._attempts.pop(key, None)
+                    dead.append(row)
+                    continue
+                self._attempts[key] = attempts
+                # edits made during the flush are newer
+                row = dict(row)
+                row.update(self._pending.get(key, {}))
+                self._pending[key] = row
+        if dead:
+            self._dead_letter(dead, f"failed {self.max_attempts} times")
+
+    def _dead_letter(self, rows, reason):
+        logger.error(f"Giving up on {len(rows)} buffered rows, {reason}.")
+        if self.dead_letter_path is None:
+            for row in rows:
+                logger.error(f"Lost buffered row: {row}")
+            return
+        try:
+            with open(self.dead_letter_path, "a") as f:
+                for row in rows:
+                    f.write(json.dumps(row, default=str) + "\n")
+        except OSError as e:
+            logger.error(f"Writing {self.dead_letter_path} failed: {e}")
+            for row in rows:
+                logger.error(f"Lost buffered row: {row}")
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="write-behind-flush", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
@@ -0,0 +1,5 @@
+# API and ingest workers without the dash app:
+# gunicorn -c gunicorn.conf.py api_wsgi:server
+from ac_dash.api_app import create_api_app
+
+server = create_api_app()
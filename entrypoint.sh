@@ -10,6 +10,9 @@ if [ "$DATABASE" = "postgres" ]; then
   echo "PostgreSQL started"
 fi
 
+# before anything loads app.py, its layout reads these tables
+python -m ac_dash.bootstrap
+
 if [ "$FLASK_DEBUG" = "1" ]; then
   echo "Creating the database tables..."
   python manage.py create_db
@@ -0,0 +1,26 @@
+# gunicorn -c gunicorn.conf.py app:server
+import os
+import glob
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+# tells the app how many processes serve it, see FLUX_WRITE_BEHIND
+os.environ["AC_DASH_WORKERS"] = str(workers)
+
+
+def on_starting(server):
+    # prometheus values of the previous run would be summed with these, the
+    # profiling switches and logs of ac_dash.tools.shared_state start over
+    multiproc_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for pattern in ("*.db", "*.on", "*.json", "*.jsonl"):
+            for path in glob.glob(os.path.join(multiproc_dir, pattern)):
+                os.remove(path)
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -3,8 +3,6 @@ import click
 
 from ac_dash.server import server, db, User
 from ac_dash.users_mgt.users_mgt import add_user as user_to_db
-from ac_dash.data_mgt import delete_fluxes
-from ac_dash import mk_ac_plot
 
 
 cli = FlaskGroup(server)
@@ -27,6 +25,55 @@ def add_user(username, password, email, role):
     user_to_db(username, password, email, role)
 
 
+# without an app context, loading app.py builds the layout from the tables
+# this creates
+@cli.command("bootstrap", with_appcontext=False)
+def bootstrap():
+    """Create the tables, the volume trigger and the built in instruments."""
+    from ac_dash.bootstrap import bootstrap as run_bootstrap
+
+    seconds = run_bootstrap()
+    print(f"Database ready in {seconds:.2f} s.")
+
+
+@cli.command("check_startup")
+@click.option("--budget", default=1.0, show_default=True, help="Seconds per import")
+@click.option(
+    "--module",
+    "modules",
+    multiple=True,
+    default=("ac_dash.server", "api_wsgi", "app"),
+    show_default=True,
+)
+@click.option(
+    "--lean",
+    multiple=True,
+    default=("ac_dash.server", "api_wsgi"),
+    show_default=True,
+    help="Modules that must not import dash or plotly",
+)
+def check_startup(budget, modules, lean):
+    """
+    Fail if a cold import takes longer than the budget, queries the db or
+    loads dash where it shouldn't.
+    """
+    from ac_dash.bootstrap import startup_cost
+
+    failed = []
+    for module in modules:
+        cost = startup_cost(module)
+        print(
+            f"{module}: {cost['seconds']:.3f} s, {cost['queries']} queries, "
+            f"dash {'loaded' if cost['dash'] else 'not loaded'}"
+        )
+        if cost["seconds"] > budget or cost["queries"]:
+            failed.append(module)
+        elif cost["dash"] and module in lean:
+            failed.append(module)
+    if failed:
+        raise click.ClickException(f"Failed the startup check: {', '.join(failed)}")
+
+
 @cli.command("seed_db")
 def seed_db():
     db.session.add(User(email="eero.koskinen@oulu.fi"))
@@ -38,11 +85,185 @@ def seed_db():
 @click.argument("end")
 @with_appcontext
 def del_fluxes(start, end):
+    from ac_dash.data_mgt import delete_fluxes
+
     print(f"Deleting fluxes from {start} to {end}.")
     delete_fluxes(start, end)
 
 
 cli.add_command(del_fluxes)
 
+
+@cli.command("watch_inbox")
+@click.option("--inbox", default=None, help="Inbox directory, AC_DASH_INBOX")
+@click.option("--archive", default=None, help="Where ingested files are moved")
+@click.option("--quarantine", default=None, help="Where failed files are moved")
+@click.option("--workers", default=2, show_default=True)
+@click.option("--interval", default=5.0, show_default=True)
+@click.option("--settle", default=10.0, show_default=True)
+@click.option("--once", is_flag=True, help="Ingest what is there and exit")
+def watch_inbox(inbox, archive, quarantine, workers, interval, settle, once):
+    from ac_dash.inbox import Inbox, INBOX_DIR
+    from ac_dash.app_config import load_config
+
+    (_, chamber_map, _, _) = load_config()
+    watcher = Inbox(
+        inbox or INBOX_DIR,
+        chamber_map,
+        archive=archive,
+        quarantine=quarantine,
+        workers=workers,
+        interval=interval,
+        settle=settle,
+    )
+    totals = watcher.run(once=once)
+    print(
+        f"Ingested {totals['files']} files ({totals['failed']} failed), "
+        f"{totals['rows']} rows."
+    )
+
+
+@cli.command("generate_data")
+@click.argument("out_dir", required=False)
+@click.option("--chambers", default=12, show_default=True)
+@click.option("--days", default=1, show_default=True)
+@click.option("--start", default="2024-06-01", show_default=True)
+@click.option("--serial", default="TG10-01000", show_default=True)
+@click.option("--noise", default=1.0, show_default=True, help="Noise multiplier")
+@click.option("--gap-rate", default=0.001, show_default=True)
+@click.option("--diag-rate", default=0.0005, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+@click.option("--to-db", is_flag=True, help="Push to the database, no files")
+def generate_data(
+    out_dir, chambers, days, start, serial, noise, gap_rate, diag_rate, seed, to_db
+):
+    """Generate synthetic gas, protocol, meteo and volume data."""
+    from ac_dash.tools.synthetic import SyntheticSite, generate_files, push_to_db
+    from ac_dash.app_config import load_config
+
+    (_, chamber_map, _, _) = load_config()
+    site = SyntheticSite(
+        chambers=chambers,
+        days=days,
+        start=start,
+        serial=serial,
+        noise=noise,
+        gap_rate=gap_rate,
+        diag_rate=diag_rate,
+        seed=seed,
+    )
+    if to_db:
+        pushed = push_to_db(site, chamber_map)
+        print(", ".join(f"{rows} {kind} rows" for kind, rows in pushed.items()))
+        return
+    if out_dir is None:
+        raise click.UsageError("Give OUT_DIR or --to-db.")
+    paths = generate_files(site, out_dir, chamber_map)
+    print(", ".join(f"{len(files)} {kind} files" for kind, files in paths.items()))
+
+
+@cli.command("benchmark")
+@click.option("--out", default=None, help="Save the results as JSON")
+@click.option("--compare", "baseline", default=None, help="Earlier results JSON")
+@click.option("--cycles", default=20, show_default=True, help="Cycles per case")
+@click.option("--repeat", default=3, show_default=True)
+@click.option("--db", is_flag=True, help="Also benchmark df_to_gas_table")
+def benchmark(out, baseline, cycles, repeat, db):
+    """Benchmark the flux engine and ingest paths on synthetic data."""
+    from ac_dash.tools import benchmark as bench
+    from ac_dash.app_config import load_config
+
+    (_, chamber_map, _, _) = load_config()
+    run = bench.run_suite(chamber_map, n_cycles=cycles, repeat=repeat, db=db)
+    changes = None
+    if baseline:
+        changes = bench.compare(bench.load_results(baseline), run)
+    print(bench.format_results(run, changes))
+    if out:
+        bench.save_results(run, out)
+        print(f"Saved results to {out}")
+
+
+@cli.command("loadtest")
+@click.option("--url", default="http://localhost:5000", show_default=True)
+@click.option("--username", default="admin", show_default=True)
+@click.option("--password", prompt=True, hide_input=True)
+@click.option("--start", required=True, help="Date range the reviewers select")
+@click.option("--end", required=True)
+@click.option("--levels", default="1,2,4,8", show_default=True, help="Reviewers")
+@click.option("--duration", default=30.0, show_default=True, help="Seconds per level")
+@click.option("--read-only", is_flag=True, help="Skip the steps that save fluxes")
+@click.option("--out", default=None, help="Save the report as JSON")
+def loadtest(url, username, password, start, end, levels, duration, read_only, out):
+    """Ramp concurrent reviewers against a local server."""
+    import json
+    from ac_dash.tools import loadtest as lt
+
+    steps = lt.default_steps
+    if read_only:
+        steps = tuple(step for step in steps if step not in lt.write_steps)
+    try:
+        report = lt.run_loadtest(
+            url,
+            username,
+            password,
+            start,
+            end,
+            levels=tuple(int(n) for n in levels.split(",")),
+            duration=duration,
+            steps=steps,
+        )
+    except lt.LoadTestError as e:
+        raise click.ClickException(str(e))
+    print(lt.format_report(report))
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved report to {out}")
+
+
+@cli.command("equivalence")
+@click.argument("candidate")
+@click.option("--reference", default="reference", show_default=True)
+@click.option("--cycles", default=20, show_default=True, help="Cycles per case")
+@click.option("--start", default=None, help="Use cycles from the database")
+@click.option("--end", default=None)
+@click.option("--use-class", default=None, help="python_class of the instrument")
+@click.option("--serial", default=None)
+@click.option("--out", default=None, help="Save the report as JSON")
+def equivalence(candidate, reference, cycles, start, end, use_class, serial, out):
+    """
+    Compare a CANDIDATE flux engine (module:function) to the reference on
+    synthetic cycles or on cycles from the database.
+    """
+    import json
+    import pandas as pd
+    from ac_dash.tools import equivalence as eq
+
+    if start:
+        if not (use_class and serial):
+            raise click.UsageError("--start needs --use-class and --serial.")
+        corpus = eq.db_corpus(
+            pd.Timestamp(start, tz="UTC"),
+            pd.Timestamp(end, tz="UTC") if end else pd.Timestamp.now(tz="UTC"),
+            use_class,
+            serial,
+        )
+    else:
+        corpus = eq.synthetic_corpus(cycles)
+    report = eq.run_equivalence(
+        corpus, eq.load_engine(candidate), eq.load_engine(reference)
+    )
+    print(
+        f"{report['mismatched_cycles']}/{report['cycles']} cycles differ, "
+        f"{report['errors']} failed. Mismatches per field: {report['fields']}"
+    )
+    for detail in report["details"][:20]:
+        print(detail)
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
 if __name__ == "__main__":
     cli()